@@ -0,0 +1,180 @@
+"""
+Measures the throughput and peak memory of each preprocessor phase on a synthetic corpus from `bench.corpus`.
+
+Run from the repository root with `python -m bench.bench_phases`. Results are printed as JSON, or written to the
+file given with `--output`. Pass the JSON of an earlier run with `--baseline` to print how each phase changed;
+the exit status is 1 if any phase got slower than `--tolerance` allows.
+
+Each phase is timed on its own, on inputs prepared by the phases before it:
+    - splice_lines: physical lines of every file, through `LogicalLine.splice_lines`
+    - tokenize_line: sanitized logical lines, through `tokenize_line`
+    - parse_line: tokenized directive lines, through `parse_line`
+    - ShuntingYard: the tokens of every #if and #elif expression, through `ShuntingYard.feed`
+    - evaluate_ast: the directives of every file, through `evaluate_ast` with a fresh macro table and empty memos
+"""
+from typing import Callable, Dict, List, Tuple
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from src.preprocessor.string_santization import LogicalLine, Sanitizer
+from src.preprocessor.tokenizer import Token, TokenType, tokenize_line
+from src.preprocessor.parser import ASTObject, IfDirective, parse_line
+from src.preprocessor.shunting_yard import ShuntingYard
+from src.preprocessor import interpreter
+from src.preprocessor.interpreter import evaluate_ast
+from src.preprocessor.macro_table import MacroTable
+from .corpus import CorpusSize, generate_corpus
+
+
+# A phase returns the number of items it processed
+Phase = Callable[[], int]
+
+
+def prepare_phases(texts: List[str]) -> Dict[str, Tuple[str, Phase]]:
+    """Builds the input of every phase from the file `texts`, and returns each phase with the unit it counts."""
+    logical_lines = [str(line) for text in texts for line in Sanitizer.sanitize(text)]
+    tokenized = [[t for t in tokenize_line(line, i) if t.type is not TokenType.WHITESPACE]
+                 for i, line in enumerate(logical_lines)]
+    directives = [tokens for tokens in tokenized if tokens and tokens[0].type is TokenType.DIRECTIVE]
+    asts: List[List[ASTObject]] = [[parse_line(tokens) for tokens in file_directives]
+                                   for file_directives in _directives_by_file(texts)]
+    expressions: List[List[Token]] = [o.expression for ast in asts for o in ast
+                                      if isinstance(o, IfDirective) and o.directive in ("if", "elif")]
+
+    def splice() -> int:
+        return sum(len(LogicalLine.splice_lines(text)) for text in texts)
+
+    def tokenize() -> int:
+        return sum(len(tokenize_line(line, i)) for i, line in enumerate(logical_lines))
+
+    def parse() -> int:
+        for tokens in directives:
+            parse_line(tokens)
+        return len(directives)
+
+    def shunting_yard() -> int:
+        for tokens in expressions:
+            ShuntingYard().feed(tokens)
+        return len(expressions)
+
+    def evaluate() -> int:
+        # Otherwise every run after the first is timed on the memos that the first one filled
+        interpreter.EXPANDER.clear()
+        interpreter.EXPRESSION_CACHE.clear()
+        for ast in asts:
+            evaluate_ast(ast, MacroTable())
+        return sum(len(ast) for ast in asts)
+
+    return {
+        "splice_lines": ("logical lines", splice),
+        "tokenize_line": ("tokens", tokenize),
+        "parse_line": ("directives", parse),
+        "ShuntingYard": ("expressions", shunting_yard),
+        "evaluate_ast": ("directives", evaluate),
+    }
+
+
+def _directives_by_file(texts: List[str]) -> List[List[List[Token]]]:
+    result = []
+    for text in texts:
+        file_directives = []
+        for line in Sanitizer.sanitize(text, directives_only=True):
+            tokens = tokenize_line(str(line), line.segments[0][0])
+            file_directives.append([t for t in tokens if t.type is not TokenType.WHITESPACE])
+        result.append(file_directives)
+    return result
+
+
+def measure(phase: Phase, repeat: int) -> Dict[str, float]:
+    """Returns the best time over `repeat` runs, and the peak memory of one more run traced by `tracemalloc`."""
+    best = float("inf")
+    items = 0
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        items = phase()
+        best = min(best, time.perf_counter() - start)
+
+    # Traced separately, since tracing slows the phase down
+    gc.collect()
+    tracemalloc.start()
+    try:
+        phase()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"items": items, "seconds": best, "items_per_second": items / best if best else 0.0, "peak_bytes": peak}
+
+
+def run(size: CorpusSize, seed: int, repeat: int, phases: List[str]) -> dict:
+    corpus = generate_corpus(size, seed)
+    texts = list(corpus.files.values())
+    prepared = prepare_phases(texts)
+
+    results = {}
+    for name in phases:
+        unit, phase = prepared[name]
+        results[name] = {"unit": unit, **measure(phase, repeat)}
+
+    return {
+        "corpus": {**size._asdict(), "seed": seed, "files": len(texts), "bytes": sum(len(t) for t in texts),
+                   "physical_lines": sum(t.count("\n") for t in texts)},
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "phases": results,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Prints the change of every phase against `baseline`, and returns False if any phase regressed."""
+    ok = True
+    for name, result in results["phases"].items():
+        before = baseline.get("phases", {}).get(name)
+        if before is None or not before["items_per_second"]:
+            continue
+
+        speed = result["items_per_second"] / before["items_per_second"]
+        memory = result["peak_bytes"] / before["peak_bytes"] if before["peak_bytes"] else 1.0
+        regressed = speed < 1 - tolerance
+        ok = ok and not regressed
+        print(f"{name:<14} speed {speed:6.2f}x  peak memory {memory:6.2f}x{'  REGRESSED' if regressed else ''}",
+              file=sys.stderr)
+    return ok
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--scale", type=float, default=1.0, help="multiplies every corpus size")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--phase", action="append", choices=["splice_lines", "tokenize_line", "parse_line",
+                                                                 "ShuntingYard", "evaluate_ast"])
+    arg_parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    arg_parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    arg_parser.add_argument("--tolerance", type=float, default=0.1, help="slowdown allowed before failing")
+    args = arg_parser.parse_args()
+
+    phases = args.phase or ["splice_lines", "tokenize_line", "parse_line", "ShuntingYard", "evaluate_ast"]
+    results = run(CorpusSize().scaled(args.scale), args.seed, args.repeat, phases)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
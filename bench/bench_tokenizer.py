@@ -0,0 +1,104 @@
+"""
+Measures tokenizer throughput on a large synthetic header.
+
+Run from the repository root with `python -m bench.bench_tokenizer`. The legacy scanner below is the
+per-position loop that `tokenize_line_iter` used before it switched to `MASTER_REGEX`, over a frozen copy of
+the `TOKEN_MAP` of that time, duplicate entries included. It is kept here only as the baseline for comparison,
+so changes to the tokenizer do not move it.
+"""
+import argparse
+import re
+import time
+from typing import Callable, Iterator, List
+from src.preprocessor.tokenizer import Token, TokenType, tokenize_line_iter
+
+
+LEGACY_TOKEN_MAP = (
+    (re.compile(r"\s"),             TokenType.WHITESPACE),
+    (re.compile(r"#(\S*)"),         TokenType.DIRECTIVE),
+    (re.compile(r"\"(.*)\""), TokenType.STRING_LITERAL),
+    (re.compile(r"(\d+)(\S?)(\d*)"), TokenType.NUM_LITERAL),
+    (re.compile(r"defined"),        TokenType.OP_DEFINED),
+    (re.compile(r"=="),             TokenType.OP_EQ),
+    (re.compile(r"!="),             TokenType.OP_NEQ),
+    (re.compile(r"(\d+)(\S?)(\d*)"), TokenType.NUM_LITERAL),
+    (re.compile(r"defined"),        TokenType.OP_DEFINED),
+    (re.compile(r"=="),             TokenType.OP_EQ),
+    (re.compile(r"!="),             TokenType.OP_NEQ),
+    (re.compile(r"<="),             TokenType.OP_LTE),
+    (re.compile(r">="),             TokenType.OP_GTE),
+    (re.compile(r"&&"),             TokenType.OP_AND),
+    (re.compile(r"\|\|"),           TokenType.OP_OR),
+    (re.compile(r"##"),             TokenType.OP_CONCAT),
+    (re.compile(r"<"),              TokenType.OP_LT),
+    (re.compile(r">"),              TokenType.OP_GT),
+    (re.compile(r"\("),             TokenType.LPAREN),
+    (re.compile(r"\)"),             TokenType.RPAREN),
+    (re.compile(r","),              TokenType.COMMA),
+    (re.compile(r"#"),              TokenType.OP_JOIN),
+    (re.compile(r"!"),              TokenType.OP_NOT),
+    (re.compile(r"[a-zA-Z]\w*"),    TokenType.IDENTIFIER),
+    (re.compile(r"\S"),             TokenType.GENERIC)
+)
+
+
+def legacy_tokenize_line_iter(line: str, line_num: int = 0) -> Iterator[Token]:
+    cursor = 0
+
+    while cursor < len(line):
+        match_generator = ((regex.match(line, cursor), token_type) for regex, token_type in LEGACY_TOKEN_MAP)
+        match, token_type = next(x for x in match_generator if x[0] is not None)
+
+        yield Token(token_type, match, cursor, line_num)
+        cursor += len(match.group(0))
+
+
+def synthetic_header(line_count: int) -> List[str]:
+    """Builds a header that mixes directives, conditionals and plain C declarations."""
+    templates = (
+        "#include <sys/types_{0}.h>",
+        "#define CONFIG_VALUE_{0} ({0} + 0x{0:x})",
+        "#if defined(FEATURE_{0}) && FEATURE_{0} >= 2 || !defined(LEGACY_{0})",
+        "static inline int helper_{0}(int a, int b) {{ return a != b ? a : b; }}",
+        "#define MAKE_NAME_{0}(x, y) x ## y",
+        "#endif",
+        "typedef struct node_{0} {{ struct node_{0} *next; char name[{0}]; }} node_{0}_t;",
+        "    /* field {0} */ unsigned long long counter_{0} = {0}ULL;",
+    )
+    return [templates[i % len(templates)].format(i) for i in range(line_count)]
+
+
+def measure(tokenizer: Callable[[str, int], Iterator[Token]], lines: List[str], repeat: int) -> float:
+    """Returns the best tokens/sec over `repeat` runs."""
+    best = 0.0
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = 0
+        for line_num, line in enumerate(lines):
+            for _ in tokenizer(line, line_num):
+                count += 1
+        elapsed = time.perf_counter() - start
+        best = max(best, count / elapsed)
+
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--lines", type=int, default=20000)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    lines = synthetic_header(args.lines)
+    before = measure(legacy_tokenize_line_iter, lines, args.repeat)
+    after = measure(tokenize_line_iter, lines, args.repeat)
+
+    print(f"lines:   {args.lines}")
+    print(f"before:  {before:,.0f} tokens/sec")
+    print(f"after:   {after:,.0f} tokens/sec")
+    print(f"speedup: {after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Deterministic generator of synthetic C source trees for the benchmarks. The same seed and sizes always produce the
+same files, so results from different runs and commits can be compared.
+
+A corpus has:
+    - a chain of guarded headers, each including the next, `depth` levels deep
+    - `macros` object and function-like macros spread over those headers
+    - conditionals nested `nesting` levels deep
+    - macros whose bodies are continued with `\\` over `continuation` physical lines
+    - one large generated header of roughly `large_lines` lines
+    - `units` translation units that include the head of the chain and the large header
+"""
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Union
+import random
+
+
+class CorpusSize(NamedTuple):
+    depth: int = 32
+    macros: int = 4000
+    nesting: int = 6
+    continuation: int = 24
+    large_lines: int = 20000
+    units: int = 16
+
+    def scaled(self, scale: float) -> "CorpusSize":
+        return CorpusSize(*(max(1, int(round(value * scale))) for value in self))
+
+
+class Corpus(NamedTuple):
+    """The generated files, by path relative to the corpus root, and the translation units among them."""
+    files: Dict[str, str]
+    units: List[str]
+
+
+def _condition(rng: random.Random, macro_count: int) -> str:
+    """An #if expression made of the operators `ShuntingYard` supports."""
+    terms = []
+    for _ in range(rng.randint(1, 4)):
+        name = f"CFG_{rng.randrange(macro_count)}"
+        kind = rng.randrange(4)
+        if kind == 0:
+            terms.append(f"defined({name})")
+        elif kind == 1:
+            terms.append(f"!defined {name}")
+        elif kind == 2:
+            terms.append(f"{name} >= {rng.randrange(8)}")
+        else:
+            terms.append(f"({name} == {rng.randrange(8)} || {name} != 0)")
+    return " && ".join(terms) if rng.random() < 0.5 else " || ".join(terms)
+
+
+def _conditional_block(rng: random.Random, prefix: str, nesting: int, macro_count: int, lines: List[str]):
+    lines.append(f"#if {_condition(rng, macro_count)}")
+    lines.append(f"#define {prefix}_TAKEN 1")
+    if nesting > 1:
+        _conditional_block(rng, f"{prefix}_N", nesting - 1, macro_count, lines)
+    lines.append(f"#elif {_condition(rng, macro_count)}")
+    lines.append(f"int {prefix.lower()}_elif;")
+    lines.append("#else")
+    lines.append(f"#undef {prefix}_TAKEN")
+    lines.append("#endif")
+
+
+def _continued_macro(name: str, continuation: int) -> List[str]:
+    lines = [f"#define {name}(a, b) \\"]
+    for i in range(continuation - 1):
+        lines.append(f"    do {{ (a)[{i}] = (b) + {i}; }} while (0); \\")
+    lines.append("    (void)0")
+    return lines
+
+
+def _chain_header(rng: random.Random, index: int, size: CorpusSize) -> str:
+    guard = f"CHAIN_{index}_H"
+    lines = [f"/* Generated header {index} */", f"#ifndef {guard}", f"#define {guard}"]
+    if index + 1 < size.depth:
+        lines.append(f"#include \"chain_{index + 1}.h\"")
+    lines.append("#include <stddef.h>")
+
+    per_header = max(1, size.macros // size.depth)
+    for i in range(per_header):
+        number = index * per_header + i
+        if i % 5 == 4:
+            lines.append(f"#define FN_{number}(x, y) ((x) > (y) ? CFG_{number} : (y))")
+        else:
+            lines.append(f"#define CFG_{number} {rng.randrange(8)}")
+        if i % 16 == 0:
+            lines.append(f"static const int value_{number} = {number};  // line comment")
+
+    _conditional_block(rng, f"BLOCK_{index}", size.nesting, size.macros, lines)
+    lines.extend(_continued_macro(f"LONG_{index}", size.continuation))
+    lines.append(f"/* multi-line\n   comment {index} */")
+    lines.append(f"#endif /* {guard} */")
+    return "\n".join(lines) + "\n"
+
+
+def _large_header(rng: random.Random, size: CorpusSize) -> str:
+    lines = ["#pragma once"]
+    i = 0
+    while len(lines) < size.large_lines:
+        kind = i % 8
+        if kind == 0:
+            lines.append(f"#define LARGE_{i} (CFG_{rng.randrange(size.macros)})")
+        elif kind == 1:
+            lines.append(f"#if LARGE_{i - 1} > 3 && defined(CFG_{rng.randrange(size.macros)})")
+            lines.append(f"typedef struct large_{i} {{ int field; char name[{i % 64 + 1}]; }} large_{i}_t;")
+            lines.append("#endif")
+        elif kind == 2:
+            lines.extend(_continued_macro(f"LARGE_FN_{i}", 4))
+        else:
+            lines.append(f"static inline int large_fn_{i}(int a) {{ return a * {i} + \"str{i}\"[0]; }}")
+        i += 1
+    return "\n".join(lines) + "\n"
+
+
+def generate_corpus(size: CorpusSize = CorpusSize(), seed: int = 0) -> Corpus:
+    """Generates a corpus in memory."""
+    rng = random.Random(seed)
+    files = {f"include/chain_{i}.h": _chain_header(rng, i, size) for i in range(size.depth)}
+    files["include/stddef.h"] = "#pragma once\ntypedef unsigned long size_t;\n"
+    files["include/large.h"] = _large_header(rng, size)
+
+    units = []
+    for i in range(size.units):
+        path = f"src/unit_{i}.c"
+        defines = "".join(f"#define CFG_{rng.randrange(size.macros)} {rng.randrange(8)}\n" for _ in range(8))
+        files[path] = (f"{defines}#include \"chain_0.h\"\n#include <large.h>\n"
+                       f"int main_{i}(void) {{ return LARGE_0 + FN_4(1, 2); }}\n")
+        units.append(path)
+
+    return Corpus(files, units)
+
+
+def write_corpus(corpus: Corpus, root: Union[str, Path]) -> List[Path]:
+    """Writes a corpus under `root`, returning the paths of its translation units."""
+    root = Path(root)
+    for path, text in corpus.files.items():
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text(text)
+    return [root / path for path in corpus.units]
@@ -0,0 +1,324 @@
+"""
+Runs builds. The modules of a `crust.CrustBuildConfiguration` are turned into one compile job per translation unit
+and one link job per module, and the jobs run on a pool of workers, like `make -j`. Jobs on the longest chain of
+remaining work are started first, using the durations recorded by earlier builds, so the longest compiles do not
+end up running alone at the end of the build.
+"""
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Set, Union
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import subprocess
+import tempfile
+import time
+from ..preprocessor.parallel import scan_module
+from ..preprocessor.translation_unit import ScanResult
+from .object_cache import ObjectCache
+
+
+DEFAULT_BUILD_DIR = Path("./.crust-build/")
+DEFAULT_COMPILER = "cc"
+
+# Indexed by `CrustBuildConfiguration.Optimization`
+OPTIMIZATION_FLAGS = (["-O0"], ["-O2"], ["-O3"], ["-Os"])
+# Indexed by `CrustBuildConfiguration.WarningConfig`; each level includes the ones before it
+WARNING_FLAGS = ([], ["-pedantic"], ["-pedantic", "-Wall"], ["-pedantic", "-Wall", "-Wextra"])
+
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"
+UP_TO_DATE = "up to date"
+CACHED = "cached"
+
+
+def compile_flags(configuration) -> List[str]:
+    """Returns the compiler options of a `crust.CrustBuildConfiguration`."""
+    flags = OPTIMIZATION_FLAGS[int(configuration.optimization)] + WARNING_FLAGS[int(configuration.warnings)]
+    if configuration.warnings_are_errors:
+        flags.append("-Werror")
+    flags.extend(str(p) for p in configuration.additional_params)
+    return flags
+
+
+class BuildJob:
+    """
+    One command of a build. `name` identifies the job in the build and in the duration history. The job is up to
+    date when `output` is newer than every file in `inputs` and none of the jobs in `dependencies` had to run.
+    The output of a `cacheable` job only depends on its command and inputs, so it can come from an `ObjectCache`.
+    """
+    __slots__ = ("name", "command", "inputs", "output", "dependencies", "cacheable")
+
+    def __init__(self, name: str, command: List[str], inputs: Sequence[Path], output: Path,
+                 dependencies: Sequence["BuildJob"] = (), cacheable: bool = False):
+        self.name = name
+        self.command = command
+        self.inputs = list(inputs)
+        self.output = output
+        self.dependencies = list(dependencies)
+        self.cacheable = cacheable
+
+    def __repr__(self) -> str:
+        return f"BuildJob({self.name!r})"
+
+    def up_to_date(self) -> bool:
+        try:
+            built = os.stat(self.output).st_mtime_ns
+            return all(os.stat(p).st_mtime_ns <= built for p in self.inputs)
+        except OSError:
+            return False
+
+
+class JobResult(NamedTuple):
+    """
+    How a job ended. `returncode` and `output` are None for jobs that did not run, except that the `output` of a
+    job taken from an `ObjectCache` is what the compiler printed when the object was built.
+    """
+    status: str
+    returncode: Optional[int]
+    duration: float
+    output: Optional[str]
+
+
+class BuildResult(NamedTuple):
+    """The result of every job of a build, in the order they finished."""
+    succeeded: bool
+    jobs: Dict[str, JobResult]
+
+
+class BuildHistory:
+    """
+    The duration of every job of earlier builds, stored as JSON at `path`. Jobs that never ran are estimated at
+    the average of the known durations.
+    """
+
+    def __init__(self, path: Union[str, Path, None] = None):
+        self.path = Path(path) if path is not None else None
+        self.durations: Dict[str, float] = {}
+        if self.path is not None:
+            try:
+                with open(self.path) as f:
+                    self.durations = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def estimate(self, name: str) -> float:
+        duration = self.durations.get(name)
+        if duration is not None:
+            return duration
+        if self.durations:
+            return sum(self.durations.values()) / len(self.durations)
+        return 1.0
+
+    def record(self, name: str, duration: float):
+        self.durations[name] = duration
+
+    def save(self):
+        if self.path is None:
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.durations, f)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+def object_path(build_dir: Path, source: Path) -> Path:
+    """Returns where the object file of `source` goes, named so sources with the same name do not collide."""
+    digest = hashlib.sha256(os.fsencode(os.path.dirname(os.path.abspath(source)))).hexdigest()[:12]
+    return build_dir / f"{source.stem}-{digest}.o"
+
+
+def plan_build(configuration,
+               build_dir: Union[str, Path] = DEFAULT_BUILD_DIR,
+               include_dirs: Iterable[Union[str, Path]] = (),
+               scans: Optional[Mapping[str, Sequence[ScanResult]]] = None) -> List[BuildJob]:
+    """
+    Returns the jobs that build every module of a `crust.CrustBuildConfiguration`, with the compile jobs before the
+    link jobs that depend on them. The module's `variables` are defined with `-D`. Compile jobs are named
+    `<configuration name>/<module name>/<source>`, so a source shared by several modules gets one job in each, and
+    link jobs `<configuration name>/<module name>`.
+
+    Parameters:
+        - `build_dir` Outputs go in `build_dir/<configuration name>/<module name>`.
+        - `include_dirs` Passed to the compiler with `-I`, and used to find the dependencies of each source.
+        - `scans` The scanned translation units of each module, by module name. Modules without one are scanned
+                  with `scan_module`.
+    """
+    include_dirs = [Path(os.path.abspath(d)) for d in include_dirs]
+    compiler = str(configuration.compiler or DEFAULT_COMPILER)
+    flags = compile_flags(configuration) + [f"-I{d}" for d in include_dirs]
+    scans = scans or {}
+
+    jobs: List[BuildJob] = []
+    links: List[BuildJob] = []
+    for module in configuration.modules:
+        module_dir = Path(build_dir) / configuration.name / module.name
+        defines = [f"-D{name}={value}" for name, value in module.variables.items()]
+        results = scans.get(module.name)
+        if results is None:
+            results = scan_module(module, include_dirs=include_dirs, defines=module.variables)
+
+        compiles = []
+        for result in results:
+            output = object_path(module_dir, result.path)
+            compiles.append(BuildJob(f"{configuration.name}/{module.name}/{result.path}",
+                                     [compiler, *flags, *defines, "-c", str(result.path), "-o", str(output)],
+                                     [result.path, *result.dependencies], output, cacheable=True))
+
+        output = module_dir / module.name
+        static = ["-static"] if configuration.enable_static_linking else []
+        links.append(BuildJob(f"{configuration.name}/{module.name}",
+                              [compiler, *static, *(str(j.output) for j in compiles), "-o", str(output)],
+                              [j.output for j in compiles], output, compiles))
+        jobs.extend(compiles)
+
+    return jobs + links
+
+
+def critical_path(jobs: Sequence[BuildJob], history: BuildHistory) -> Dict[str, float]:
+    """
+    Returns the length of the longest chain of work that starts with each job: its estimated duration plus the
+    longest chain of the jobs that depend on it. `jobs` must list every job after its dependencies.
+    """
+    dependents: Dict[str, List[BuildJob]] = {j.name: [] for j in jobs}
+    for job in jobs:
+        for dependency in job.dependencies:
+            dependents[dependency.name].append(job)
+
+    lengths: Dict[str, float] = {}
+    for job in reversed(jobs):
+        lengths[job.name] = history.estimate(job.name) + max((lengths[d.name] for d in dependents[job.name]),
+                                                             default=0.0)
+    return lengths
+
+
+def _run(job: BuildJob, cache: Optional[ObjectCache] = None) -> JobResult:
+    job.output.parent.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+
+    key = None
+    if cache is not None and job.cacheable:
+        try:
+            key = cache.key(job.command, job.output, job.inputs)
+        except OSError:
+            # A missing input or compiler, which the compiler reports
+            pass
+        if key is not None:
+            output = cache.get(key, job.output)
+            if output is not None:
+                return JobResult(CACHED, None, time.perf_counter() - start, output)
+
+    try:
+        process = subprocess.run(job.command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 universal_newlines=True)
+    except OSError as e:
+        return JobResult(FAILED, None, time.perf_counter() - start, str(e))
+
+    status = SUCCEEDED if process.returncode == 0 else FAILED
+    if key is not None and status == SUCCEEDED:
+        cache.put(key, job.output, process.stdout)
+    return JobResult(status, process.returncode, time.perf_counter() - start, process.stdout)
+
+
+def run_build(jobs: Sequence[BuildJob], workers: Optional[int] = None, history: Optional[BuildHistory] = None,
+              stop_on_failure: bool = False, cache: Optional[ObjectCache] = None) -> BuildResult:
+    """
+    Runs `jobs` on `workers` threads, each waiting on its own compiler process. Ready jobs with the longest
+    critical path start first. Jobs that are up to date are not run, and neither are the jobs that depend on a job
+    that failed. With `stop_on_failure`, no job is started after the first failure, but running jobs are allowed
+    to finish. The durations of the jobs that ran are recorded in `history`, which is saved at the end. The
+    outputs of cacheable jobs are taken from `cache` when it has them, and stored in it otherwise.
+    """
+    if history is None:
+        history = BuildHistory()
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if len({job.name for job in jobs}) != len(jobs):
+        raise ValueError("Jobs must have unique names")
+
+    priority = critical_path(jobs, history)
+    order = {job.name: i for i, job in enumerate(jobs)}
+    waiting: Dict[str, int] = {job.name: len(job.dependencies) for job in jobs}
+    dependents: Dict[str, List[BuildJob]] = {job.name: [] for job in jobs}
+    for job in jobs:
+        for dependency in job.dependencies:
+            dependents[dependency.name].append(job)
+
+    results: Dict[str, JobResult] = {}
+    ran: Set[str] = set()
+    # Ties are broken by the order of `jobs`, which keeps the schedule deterministic, and then by when the job
+    # became ready, so the jobs themselves are never compared
+    sequence = itertools.count()
+    ready = [(-priority[job.name], order[job.name], next(sequence), job) for job in jobs if not job.dependencies]
+    heapq.heapify(ready)
+    running: Dict[Future, BuildJob] = {}
+    stopped = False
+
+    def finish(job: BuildJob, result: JobResult):
+        results[job.name] = result
+        for dependent in dependents[job.name]:
+            if result.status in (FAILED, SKIPPED):
+                if dependent.name not in results:
+                    finish(dependent, JobResult(SKIPPED, None, 0.0, None))
+                continue
+
+            waiting[dependent.name] -= 1
+            if waiting[dependent.name] == 0 and dependent.name not in results:
+                heapq.heappush(ready, (-priority[dependent.name], order[dependent.name], next(sequence), dependent))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while ready or running:
+            while ready and len(running) < workers and not stopped:
+                *_, job = heapq.heappop(ready)
+                if not any(d.name in ran for d in job.dependencies) and job.up_to_date():
+                    finish(job, JobResult(UP_TO_DATE, None, 0.0, None))
+                    continue
+                running[executor.submit(_run, job, cache)] = job
+
+            if stopped and not running:
+                break
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                result = future.result()
+                ran.add(job.name)
+                if result.returncode is not None:
+                    history.record(job.name, result.duration)
+                if result.status == FAILED and stop_on_failure:
+                    stopped = True
+                finish(job, result)
+
+    for job in jobs:
+        if job.name not in results:
+            results[job.name] = JobResult(SKIPPED, None, 0.0, None)
+
+    history.save()
+    return BuildResult(all(r.status in (SUCCEEDED, UP_TO_DATE, CACHED) for r in results.values()), results)
+
+
+def build(configuration,
+          build_dir: Union[str, Path] = DEFAULT_BUILD_DIR,
+          include_dirs: Iterable[Union[str, Path]] = (),
+          scans: Optional[Mapping[str, Sequence[ScanResult]]] = None,
+          workers: Optional[int] = None,
+          object_cache: Optional[ObjectCache] = None) -> BuildResult:
+    """
+    Builds a `crust.CrustBuildConfiguration` with `plan_build` and `run_build`. The job durations are kept in
+    `build_dir`. When `warnings_are_errors` is set, the build stops at the first failure.
+    """
+    jobs = plan_build(configuration, build_dir, include_dirs, scans)
+    history = BuildHistory(Path(build_dir) / configuration.name / "durations.json")
+    return run_build(jobs, workers, history, stop_on_failure=configuration.warnings_are_errors, cache=object_cache)
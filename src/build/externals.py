@@ -0,0 +1,303 @@
+"""
+Fetches and builds externals. Each `crust.CrustRemoteExternal` or `crust.CrustLocalExternal` is fetched, built by
+running its script, and its artifacts are stored in a content-addressed `ArtifactStore`. The store is keyed by
+where the external comes from, its script, its artifacts and the build configuration, so an external that was
+already built with the same inputs is copied from the store instead, whichever project built it. Independent
+externals are fetched and built concurrently.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Union
+from urllib.request import urlopen
+from urllib.parse import urlsplit
+import glob
+import hashlib
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import zipfile
+from ..preprocessor.cache import DEFAULT_CACHE_DIR, fingerprint_file
+from .executor import FAILED, compile_flags
+
+
+# Bumped whenever the key layout changes, which invalidates old entries
+_KEY_VERSION = b"CRSTEXT1"
+# Written into install directories, to tell which entry they were installed from
+_KEY_FILE = ".crust-key"
+
+BUILT = "built"
+REUSED = "reused"
+
+ARCHIVE_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz", ".zip")
+
+
+def _tree_fingerprint(directory: str, digest):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.fsencode(os.path.relpath(path, directory)) + b"\0")
+            digest.update(fingerprint_file(path))
+
+
+def external_key(external, configuration=None) -> str:
+    """
+    Returns the store key of a remote or local external. Remote externals are identified by their URL, so the
+    contents behind a URL are expected not to change. Local externals are identified by their path and a hash
+    of their contents.
+    """
+    digest = hashlib.blake2b(_KEY_VERSION, digest_size=32)
+    url = getattr(external, "url", None)
+    if url is not None:
+        digest.update(b"url\0" + url.encode())
+    else:
+        path = os.path.abspath(external.path)
+        digest.update(b"path\0" + os.fsencode(path) + b"\0")
+        if os.path.isdir(path):
+            _tree_fingerprint(path, digest)
+        else:
+            digest.update(fingerprint_file(path))
+
+    for line in external.script:
+        digest.update(b"\0script\0" + line.encode())
+    for pattern in external.artifacts:
+        digest.update(b"\0artifact\0" + pattern.encode())
+
+    if configuration is not None:
+        digest.update(b"\0compiler\0" + str(configuration.compiler or "").encode())
+        for flag in compile_flags(configuration):
+            digest.update(b"\0flag\0" + flag.encode())
+
+    return digest.hexdigest()
+
+
+class ArtifactStore:
+    """
+    Keeps the built artifacts of externals under `directory`, one directory per key. An entry is added by
+    renaming a finished directory into place, so concurrent builds, in this process or others, never see a
+    partial entry, and the first one to finish wins.
+    """
+
+    def __init__(self, directory: Union[str, Path] = DEFAULT_CACHE_DIR):
+        self.directory = Path(directory) / "externals"
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Path]:
+        """Returns the directory of the entry stored under `key`, if there is one. Counts a hit or a miss."""
+        entry = self.directory / key
+        if entry.is_dir():
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        return None
+
+    def add(self, key: str, source: Union[str, Path], artifacts: Iterable[str] = ()) -> Path:
+        """
+        Stores the files in `source` that match the glob patterns in `artifacts`, keeping their paths relative to
+        `source`, under `key`. Everything in `source` is stored if there are no patterns.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        source = os.path.abspath(source)
+        artifacts = list(artifacts)
+
+        temp_dir = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            if not artifacts:
+                shutil.rmtree(temp_dir)
+                shutil.copytree(source, temp_dir, symlinks=True)
+            for pattern in artifacts:
+                matches = glob.glob(os.path.join(glob.escape(source), pattern), recursive=True)
+                if not matches:
+                    raise Exception(f"The artifact {pattern} was not built")
+                for match in matches:
+                    target = os.path.join(temp_dir, os.path.relpath(match, source))
+                    if os.path.isdir(match):
+                        shutil.rmtree(target, ignore_errors=True)
+                        shutil.copytree(match, target, symlinks=True)
+                    else:
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        shutil.copy2(match, target)
+
+            entry = self.directory / key
+            try:
+                os.rename(temp_dir, entry)
+            except OSError:
+                if not entry.is_dir():
+                    raise
+                # Built concurrently by someone else
+                shutil.rmtree(temp_dir)
+            return entry
+        except BaseException:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+
+    def clear(self):
+        """Removes every entry."""
+        if self.directory.exists():
+            shutil.rmtree(self.directory)
+
+
+class ExternalResult(NamedTuple):
+    """How fetching one external ended. `directory` is where it was installed, and `error` why it failed."""
+    status: str
+    directory: Optional[Path]
+    error: Optional[str]
+
+
+class ExternalsResult(NamedTuple):
+    """The result of every external, by name. `succeeded` is False if a required external failed."""
+    succeeded: bool
+    externals: Dict[str, ExternalResult]
+
+
+def _escapes(name: str) -> bool:
+    """Checks if the archive member path `name` is absolute or leaves the directory it is unpacked into."""
+    parts = name.replace("\\", "/").split("/")
+    return name.startswith(("/", "\\")) or os.path.splitdrive(name)[0] != "" or ".." in parts
+
+
+def _check_archive(path: str):
+    """Raises if unpacking the archive at `path` would write, or link to, anything outside the directory."""
+    # Each member's path, and for links the path they point to, relative to the directory
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            members = [(name, None) for name in archive.namelist()]
+    else:
+        with tarfile.open(path) as archive:
+            members = []
+            for member in archive.getmembers():
+                if not (member.isfile() or member.isdir() or member.issym() or member.islnk()):
+                    raise Exception(f"The archive member {member.name} is not a file, directory or link")
+                if member.issym():
+                    members.append((member.name, os.path.join(os.path.dirname(member.name), member.linkname)))
+                else:
+                    members.append((member.name, member.linkname if member.islnk() else None))
+
+    for name, link in members:
+        if _escapes(name):
+            raise Exception(f"The archive member {name} is outside of the archive")
+        if link is not None and (os.path.isabs(link) or os.path.normpath(link).split(os.sep)[0] == ".."):
+            raise Exception(f"The archive member {name} links outside of the archive")
+
+
+def _fetch(external, directory: str):
+    """Fetches the sources of `external` into `directory`, unpacking archives."""
+    url = getattr(external, "url", None)
+    if url is None:
+        path = os.path.abspath(external.path)
+        if os.path.isdir(path):
+            shutil.rmtree(directory)
+            shutil.copytree(path, directory, symlinks=True)
+            return
+        name = os.path.basename(path)
+        download = os.path.join(directory, name)
+        shutil.copy2(path, download)
+    else:
+        name = os.path.basename(urlsplit(url).path) or "download"
+        download = os.path.join(directory, name)
+        with urlopen(url) as response, open(download, "wb") as f:
+            shutil.copyfileobj(response, f)
+
+    if name.endswith(ARCHIVE_SUFFIXES):
+        _check_archive(download)
+        shutil.unpack_archive(download, directory)
+        os.unlink(download)
+
+
+def _build(external, directory: str, configuration=None):
+    """Runs the script of `external` in `directory`, one shell command per line."""
+    env = dict(os.environ)
+    if configuration is not None:
+        if configuration.compiler is not None:
+            env["CC"] = str(configuration.compiler)
+        env["CFLAGS"] = " ".join(compile_flags(configuration))
+
+    for line in external.script:
+        process = subprocess.run(line, shell=True, cwd=directory, env=env, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT, universal_newlines=True)
+        if process.returncode != 0:
+            raise Exception(f"`{line}` failed with exit code {process.returncode}:\n{process.stdout}")
+
+
+def _install(entry: Path, target: Path, key: str):
+    try:
+        if (target / _KEY_FILE).read_text() == key:
+            return
+    except OSError:
+        pass
+
+    if target.exists():
+        shutil.rmtree(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copytree(entry, target, symlinks=True)
+    (target / _KEY_FILE).write_text(key)
+
+
+def _check_name(name: str):
+    if not name or name in (".", "..") or any(sep in name for sep in ("/", "\\", os.sep, os.altsep) if sep):
+        raise ValueError(f"The external name {name!r} is not a single path component")
+
+
+def fetch_external(external, store: ArtifactStore, install_dir: Union[str, Path], configuration=None) -> ExternalResult:
+    """
+    Installs a remote or local external into `install_dir/<name>`, from `store` if it holds a build with the same
+    inputs, and otherwise by fetching and building it in a temporary directory and adding it to `store`. The name
+    of the external must be a single path component, as whatever is at `install_dir/<name>` is replaced.
+    """
+    _check_name(external.name)
+    target = Path(install_dir) / external.name
+    try:
+        key = external_key(external, configuration)
+        entry = store.get(key)
+        status = REUSED
+        if entry is None:
+            store.directory.mkdir(parents=True, exist_ok=True)
+            work_dir = tempfile.mkdtemp(dir=store.directory, prefix=".work-")
+            try:
+                _fetch(external, work_dir)
+                _build(external, work_dir, configuration)
+                entry = store.add(key, work_dir, external.artifacts)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            status = BUILT
+
+        _install(entry, target, key)
+    except Exception as e:
+        return ExternalResult(FAILED, None, str(e))
+
+    return ExternalResult(status, target, None)
+
+
+def fetch_externals(externals: Iterable,
+                    install_dir: Union[str, Path] = Path("./.externals/"),
+                    store: Optional[ArtifactStore] = None,
+                    configuration=None,
+                    workers: Optional[int] = None) -> ExternalsResult:
+    """
+    Installs every remote and local external in `externals`, such as the `externals` of a `crust.CrustModule`,
+    on `workers` threads. System externals are already installed and are left out.
+
+    Parameters:
+        - `install_dir` Each external is installed in a directory named after it, see `CrustGlobal.external_install_dir`.
+        - `store` The `ArtifactStore` to reuse and keep builds in. Defaults to the one in the default cache directory.
+        - `configuration` The `crust.CrustBuildConfiguration` to build with. The compiler and its flags are given
+                          to the scripts as `CC` and `CFLAGS`, and are part of the store key.
+    """
+    store = store if store is not None else ArtifactStore()
+    externals = [e for e in externals if hasattr(e, "url") or hasattr(e, "script")]
+    names = [e.name for e in externals]
+    if len(set(names)) != len(names):
+        raise ValueError("Externals must have unique names")
+    for name in names:
+        _check_name(name)
+
+    with ThreadPoolExecutor(max_workers=workers or min(len(externals), os.cpu_count() or 1) or 1) as executor:
+        results: List[ExternalResult] = list(executor.map(
+            lambda e: fetch_external(e, store, install_dir, configuration), externals))
+
+    succeeded = all(r.status != FAILED or not e.required for e, r in zip(externals, results))
+    return ExternalsResult(succeeded, {e.name: r for e, r in zip(externals, results)})
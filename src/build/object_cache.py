@@ -0,0 +1,229 @@
+"""
+Content-addressed cache of object files, like ccache. An object file is stored under a hash of everything that
+goes into compiling it: the source, every file it includes, the compiler and the command line. A build in a fresh
+checkout, or after switching branches, copies the objects it already built once instead of compiling them again.
+"""
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import hashlib
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+from ..preprocessor.cache import DEFAULT_CACHE_DIR, fingerprint_file
+
+
+# Bumped whenever the key or entry layout changes, which invalidates old entries
+_KEY_VERSION = b"CRSTOBJ2"
+# An entry is this header, the compiler output, then the object file
+_HEADER = struct.Struct("<8sQ")
+
+# An argument that is an absolute path, or an option with an absolute path attached, such as `-I/usr/include`
+_PATH_ARG_REGEX = re.compile(r"(-[\w-]+=?)?(/.*)")
+
+
+class ObjectCache:
+    """
+    Stores object files and what the compiler printed while building them under `directory`, by the key
+    `ObjectCache.key` computes for their compile command. The least recently used objects are evicted once they
+    take more than `max_bytes`. The cache can be shared by the threads of one build and by several builds at once.
+
+    Paths below `base_dir`, the current directory unless given, are hashed relative to it, as with ccache's
+    `base_dir`, so checkouts of the same project in different places share objects. Pass None to hash absolute
+    paths. Like with ccache, an object taken from another checkout may hold that checkout's paths in its debug
+    information.
+    """
+
+    def __init__(self, directory: Union[str, Path] = DEFAULT_CACHE_DIR, max_bytes: int = 5 * 1024 * 1024 * 1024,
+                 base_dir: Union[str, Path, None] = "."):
+        self.directory = Path(directory) / "objects"
+        self.max_bytes = max_bytes
+        self.base_dir = os.path.abspath(base_dir) if base_dir is not None else None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._total_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        # Content hashes by (path, mtime, size), so a header included by many sources is hashed once
+        self._fingerprints: Dict[Tuple[str, int, int], bytes] = {}
+        self._compilers: Dict[str, bytes] = {}
+
+    def _fingerprint(self, path: Union[str, Path]) -> bytes:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        fingerprint = self._fingerprints.get(key)
+        if fingerprint is None:
+            fingerprint = self._fingerprints[key] = fingerprint_file(path)
+        return fingerprint
+
+    def compiler_identity(self, compiler: str) -> bytes:
+        """Identifies the compiler at `compiler` by the path, size and mtime of the executable, as ccache does."""
+        identity = self._compilers.get(compiler)
+        if identity is None:
+            resolved = shutil.which(compiler) or compiler
+            stat = os.stat(resolved)
+            identity = self._compilers[compiler] = os.fsencode(
+                f"{self._relative(os.path.realpath(resolved))}\0{stat.st_size}\0{stat.st_mtime_ns}")
+        return identity
+
+    def _relative(self, path: str) -> str:
+        """Returns `path`, which is absolute, relative to `base_dir` if it is below it."""
+        base_dir = self.base_dir
+        if base_dir is None:
+            return path
+        path = os.path.normpath(path)
+        if path == base_dir or path.startswith(base_dir.rstrip(os.sep) + os.sep):
+            return os.path.relpath(path, base_dir)
+        return path
+
+    def _relative_arg(self, arg: str) -> str:
+        match = _PATH_ARG_REGEX.fullmatch(arg)
+        if match is None:
+            return arg
+        return (match.group(1) or "") + self._relative(match.group(2))
+
+    def key(self, command: Sequence[str], output: Union[str, Path], inputs: Sequence[Union[str, Path]]) -> str:
+        """
+        Returns the key of the object that `command` writes to `output`. `command[0]` is the compiler, and
+        `inputs` are the source followed by the dependency closure found by scanning it. The output path is left
+        out, so the same object built into another build directory has the same key, and paths below `base_dir`
+        are made relative to it.
+        """
+        digest = hashlib.blake2b(_KEY_VERSION, digest_size=32)
+        digest.update(self.compiler_identity(command[0]))
+
+        output = os.path.abspath(output)
+        for arg in command[1:]:
+            digest.update(b"\0")
+            if os.path.isabs(arg) and os.path.normpath(arg) == output:
+                continue
+            digest.update(os.fsencode(self._relative_arg(arg)))
+
+        for path in inputs:
+            digest.update(b"\1")
+            digest.update(os.fsencode(self._relative(os.path.abspath(path))))
+            digest.update(self._fingerprint(path))
+
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.directory / key
+
+    def get(self, key: str, output: Union[str, Path]) -> Optional[str]:
+        """
+        Copies the object stored under `key` to `output`, if there is one, and returns what the compiler printed
+        while building it, so it can be shown again. Returns None if there is no entry. Counts a hit or a miss.
+        """
+        entry_path = self._entry_path(key)
+        output = Path(output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, temp_name = tempfile.mkstemp(dir=output.parent, prefix=".tmp-")
+        try:
+            # The copy gets the current time, so it is newer than its inputs
+            with os.fdopen(fd, "wb") as f, open(entry_path, "rb") as entry:
+                magic, output_size = _HEADER.unpack(entry.read(_HEADER.size))
+                compiler_output = entry.read(output_size)
+                if magic != _KEY_VERSION or len(compiler_output) != output_size:
+                    raise ValueError("Corrupt entry")
+                shutil.copyfileobj(entry, f)
+            os.replace(temp_name, output)
+        except (OSError, ValueError, struct.error):
+            os.unlink(temp_name)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            # Mark the entry as recently used
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return compiler_output.decode(errors="replace")
+
+    def put(self, key: str, output: Union[str, Path], compiler_output: Optional[str] = None):
+        """
+        Stores the object at `output` under `key`, with what the compiler printed while building it, then evicts
+        old entries if the cache is over budget.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry_path = self._entry_path(key)
+        encoded = (compiler_output or "").encode()
+
+        # Write to a temporary file first so that other builds never see a partial entry
+        fd, temp_name = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f, open(output, "rb") as source:
+                f.write(_HEADER.pack(_KEY_VERSION, len(encoded)))
+                f.write(encoded)
+                shutil.copyfileobj(source, f)
+            try:
+                old_size = entry_path.stat().st_size
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(temp_name, entry_path)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += entry_path.stat().st_size - old_size
+            self._evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in `max_bytes`."""
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        if self._total_bytes is None:
+            self._total_bytes = sum(stat.st_size for stat, _ in self._entries())
+        if self._total_bytes <= self.max_bytes:
+            return
+
+        for stat, entry in sorted(self._entries(), key=lambda x: x[0].st_mtime_ns):
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                # Evicted by another build sharing the directory
+                pass
+            self._total_bytes -= stat.st_size
+            self.evictions += 1
+
+    def _entries(self) -> List[Tuple[os.stat_result, Path]]:
+        """The entries in the cache directory and their stats, leaving out temporary files."""
+        entries = []
+        if self.directory.exists():
+            for entry in self.directory.iterdir():
+                if entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    entries.append((entry.stat(), entry))
+                except FileNotFoundError:
+                    continue
+        return entries
+
+    @property
+    def size(self) -> int:
+        """The number of bytes the entries take."""
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(stat.st_size for stat, _ in self._entries())
+            return self._total_bytes
+
+    def clear(self):
+        """Removes every entry."""
+        with self._lock:
+            for _, entry in self._entries():
+                entry.unlink()
+            self._total_bytes = 0
+            self._fingerprints.clear()
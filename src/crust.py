@@ -54,7 +54,7 @@ class ExternalManagerMixin:
         Adds a remote dependency as a requirement for this module.
         """
         if not name:
-            name = urlsplit(url)["path"]
+            name = Path(urlsplit(url).path).name
 
         self.externals.append(CrustRemoteExternal(
             url, name, script, artifacts, required
@@ -74,11 +74,14 @@ class ExternalManagerMixin:
                            path: Union[str, Path],
                            script: Iterable[str] = [],
                            artifacts: Iterable[str] = [],
-                           required: bool = True) -> "CrustModule":
+                           required: bool = True,
+                           name: Optional[str] = None) -> "CrustModule":
         if type(path) is str:
-            path = Path(str)
+            path = Path(path)
+        if not name:
+            name = path.name
 
-        self.externals.append(CrustLocalExternal(path, script, artifacts, required))
+        self.externals.append(CrustLocalExternal(path, name, script, artifacts, required))
         return self
 
 
@@ -0,0 +1,175 @@
+"""
+Persistent cache of parsed directive lists. Each file's `ASTObject` list is stored on disk, keyed by the file's
+path and validated against its mtime, size and content hash, so unchanged files are never parsed twice.
+"""
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+import hashlib
+import os
+import pickle
+import struct
+import tempfile
+from .parser import ASTObject
+from .scanner import scan_buffer_compact
+
+
+DEFAULT_CACHE_DIR = Path("./.crust-cache/")
+
+# Bumped whenever the entry layout or the pickled classes change, which invalidates old entries
+_MAGIC = b"CRSTAST6"
+_HEADER = struct.Struct("<8sqq32s")
+
+
+def fingerprint_bytes(data: bytes) -> bytes:
+    """Returns the same hash as `fingerprint_file` for the contents of a file that was already read."""
+    return hashlib.blake2b(data, digest_size=32).digest()
+
+
+def read_file(path: Union[str, Path]) -> Tuple[os.stat_result, bytes]:
+    """
+    Returns the stat and the contents of the file at `path`. The stat is taken before reading, so if the file
+    changes meanwhile, the stat is older than the contents and the change is noticed the next time.
+    """
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        return stat, f.read()
+
+
+def fingerprint_file(path: Union[str, Path]) -> bytes:
+    """Returns a 32 byte hash of the contents of the file at `path`."""
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.digest()
+
+
+class ASTCache:
+    """
+    Stores the parsed directives of files under `directory`. An entry is used as is when the file's mtime and
+    size are unchanged; otherwise the file's content hash decides. The least recently used entries are evicted
+    once the entries take more than `max_bytes` on disk.
+
+    The parsed objects are stored with `pickle`, so only point this at directories you trust.
+    """
+
+    def __init__(self, directory: Union[str, Path] = DEFAULT_CACHE_DIR, max_bytes: int = 256 * 1024 * 1024,
+                 encoding: str = "utf-8"):
+        self.directory = Path(directory) / "ast"
+        self.max_bytes = max_bytes
+        self.encoding = encoding
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._total_bytes: Optional[int] = None
+
+    def _entry_path(self, path: Path) -> Path:
+        return self.directory / hashlib.sha256(os.fsencode(path.resolve())).hexdigest()
+
+    def get(self, path: Union[str, Path]) -> Optional[List[ASTObject]]:
+        """Returns the cached directives of `path`, or None if there is no valid entry. Counts a hit or a miss."""
+        path = Path(path)
+        entry_path = self._entry_path(path)
+        stat = path.stat()
+
+        try:
+            with open(entry_path, "rb") as f:
+                magic, mtime_ns, size, content_hash = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != _MAGIC or size != stat.st_size:
+                    raise ValueError("Stale entry")
+                if mtime_ns != stat.st_mtime_ns and content_hash != fingerprint_file(path):
+                    raise ValueError("Stale entry")
+                ast = pickle.load(f)
+        except (OSError, ValueError, struct.error, pickle.UnpicklingError, EOFError):
+            self.misses += 1
+            return None
+
+        if mtime_ns != stat.st_mtime_ns:
+            # The file was touched but not changed. Store the new mtime so the hash is not computed again
+            self.put(path, ast, content_hash, stat)
+        else:
+            # Mark the entry as recently used
+            os.utime(entry_path)
+
+        self.hits += 1
+        return ast
+
+    def put(self, path: Union[str, Path], ast: List[ASTObject], content_hash: Optional[bytes] = None,
+            stat: Optional[os.stat_result] = None):
+        """
+        Stores the directives of `path`, then evicts old entries if the cache is over budget. `content_hash` and
+        `stat` should be those of the contents `ast` was parsed from, with `stat` taken before they were read, as
+        `read_file` does; otherwise they are taken now, which is only right if the file did not change since.
+        """
+        path = Path(path)
+        if stat is None:
+            stat = path.stat()
+        if content_hash is None:
+            content_hash = fingerprint_file(path)
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry_path = self._entry_path(path)
+        old_size = entry_path.stat().st_size if entry_path.exists() else 0
+
+        # Write to a temporary file first so that readers never see a partial entry
+        fd, temp_name = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, stat.st_mtime_ns, stat.st_size, content_hash))
+                pickle.dump(ast, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_name, entry_path)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+
+        if self._total_bytes is not None:
+            self._total_bytes += entry_path.stat().st_size - old_size
+        self.evict()
+
+    def parse(self, path: Union[str, Path]) -> List[ASTObject]:
+        """Returns the directives of `path`, parsing and storing them on a miss."""
+        ast = self.get(path)
+        if ast is None:
+            stat, data = read_file(path)
+            ast = scan_buffer_compact(data, self.encoding)
+            self.put(path, ast, fingerprint_bytes(data), stat)
+
+        return ast
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in `max_bytes`."""
+        if self._total_bytes is None:
+            self._total_bytes = sum(stat.st_size for stat, _ in self._entries())
+        if self._total_bytes <= self.max_bytes:
+            return
+
+        for stat, entry in sorted(self._entries(), key=lambda x: x[0].st_mtime_ns):
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                # Evicted by another process sharing the directory
+                pass
+            self._total_bytes -= stat.st_size
+            self.evictions += 1
+
+    def _entries(self) -> List[Tuple[os.stat_result, Path]]:
+        """The entries in the cache directory and their stats. Entries removed while listing are left out."""
+        entries = []
+        if self.directory.exists():
+            for entry in self.directory.iterdir():
+                try:
+                    entries.append((entry.stat(), entry))
+                except FileNotFoundError:
+                    continue
+        return entries
+
+    def clear(self):
+        """Removes every entry."""
+        if self.directory.exists():
+            for entry in self.directory.iterdir():
+                entry.unlink()
+        self._total_bytes = 0
@@ -0,0 +1,284 @@
+"""
+Persistent dependency database. The results of scanning translation units are kept in an SQLite database in the
+cache directory, together with the fingerprint of every file they read, so a later scan only evaluates the
+translation units that include a file that changed.
+"""
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple, Union
+import json
+import os
+import pickle
+import sqlite3
+import time
+from .cache import DEFAULT_CACHE_DIR, fingerprint_file
+from .parallel import scan_parallel
+from .translation_unit import ScanResult
+
+
+# Bumped whenever the schema changes, which drops the old tables
+_SCHEMA_VERSION = 2
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    configuration TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash BLOB NOT NULL,
+    PRIMARY KEY (configuration, path)
+);
+CREATE TABLE IF NOT EXISTS units (
+    configuration TEXT NOT NULL,
+    path TEXT NOT NULL,
+    unresolved BLOB NOT NULL,
+    PRIMARY KEY (configuration, path)
+);
+CREATE TABLE IF NOT EXISTS edges (
+    configuration TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    dependency TEXT NOT NULL,
+    PRIMARY KEY (configuration, unit, position)
+);
+CREATE INDEX IF NOT EXISTS edges_by_dependency ON edges (dependency);
+"""
+
+Fingerprint = Tuple[int, int, bytes]
+
+
+def configuration_key(include_dirs: Iterable[Union[str, Path]] = (), quote_dirs: Iterable[Union[str, Path]] = (),
+                      defines: Optional[Mapping[str, str]] = None, encoding: str = "utf-8") -> str:
+    """Returns a key for the scan settings, since the same file can have different dependencies under each."""
+    return json.dumps([[os.path.abspath(d) for d in include_dirs], [os.path.abspath(d) for d in quote_dirs],
+                       sorted((defines or {}).items()), encoding])
+
+
+class DependencyDB:
+    """
+    Stores the `ScanResult` of every translation unit scanned with the settings named by `configuration`, and the
+    mtime, size and content hash of each file they read, in `directory`. A file whose mtime or size changed only
+    counts as changed if its content hash changed too. Fingerprints are stored per configuration, so a scan with
+    one configuration never hides a change from another.
+
+    Translation units with includes that could not be resolved are always rescanned, since the missing header may
+    have been created since. A header that is created earlier in the include path than the one a translation unit
+    found is not noticed, as with `make` style dependency files.
+
+    The unresolved includes are stored with `pickle`, so only point this at directories you trust.
+    """
+
+    def __init__(self, directory: Union[str, Path] = DEFAULT_CACHE_DIR, configuration: str = ""):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.configuration = configuration
+        self.connection = sqlite3.connect(str(directory / "dependencies.sqlite3"))
+
+        with self.connection:
+            version, = self.connection.execute("PRAGMA user_version").fetchone()
+            if version != _SCHEMA_VERSION:
+                self.connection.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS units; "
+                                              "DROP TABLE IF EXISTS edges;")
+                self.connection.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            self.connection.executescript(_SCHEMA)
+
+        # Whether each file changed, as found by this instance
+        self._changed: Dict[str, bool] = {}
+        self.hashed = 0
+
+    def _fingerprint(self, path: str) -> Optional[Fingerprint]:
+        row = self.connection.execute("SELECT mtime_ns, size, hash FROM files WHERE configuration = ? AND path = ?",
+                                      (self.configuration, path)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def changed(self, path: Union[str, Path]) -> bool:
+        """Checks if the file at `path` changed since it was last stored, or was never stored."""
+        path = os.path.abspath(path)
+        changed = self._changed.get(path)
+        if changed is not None:
+            return changed
+
+        stored = self._fingerprint(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            changed = True
+        else:
+            if stored is None:
+                changed = True
+            elif (stat.st_mtime_ns, stat.st_size) == stored[:2]:
+                changed = False
+            elif stat.st_size != stored[1]:
+                changed = True
+            else:
+                self.hashed += 1
+                content_hash = fingerprint_file(path)
+                changed = content_hash != stored[2]
+                if not changed:
+                    # Touched but not modified, so the hash is not needed next time
+                    with self.connection:
+                        self.connection.execute("UPDATE files SET mtime_ns = ? WHERE configuration = ? AND path = ?",
+                                                (stat.st_mtime_ns, self.configuration, path))
+
+        self._changed[path] = changed
+        return changed
+
+    def load(self, unit: Union[str, Path]) -> Optional[ScanResult]:
+        """Returns the stored `ScanResult` of the translation unit at `unit`, if there is one."""
+        unit = os.path.abspath(unit)
+        row = self.connection.execute("SELECT unresolved FROM units WHERE configuration = ? AND path = ?",
+                                      (self.configuration, unit)).fetchone()
+        if row is None:
+            return None
+
+        dependencies = self.connection.execute(
+            "SELECT dependency FROM edges WHERE configuration = ? AND unit = ? ORDER BY position",
+            (self.configuration, unit))
+        return ScanResult(Path(unit), [Path(d) for d, in dependencies], pickle.loads(row[0]))
+
+    def is_stale(self, unit: Union[str, Path]) -> bool:
+        """Checks if the translation unit at `unit` has to be scanned again."""
+        result = self.load(unit)
+        if result is None or result.unresolved:
+            return True
+        return self.changed(unit) or any(self.changed(d) for d in result.dependencies)
+
+    def dependents(self, path: Union[str, Path]) -> List[Path]:
+        """Returns the translation units that include the file at `path`, directly or not."""
+        rows = self.connection.execute("SELECT DISTINCT unit FROM edges WHERE configuration = ? AND dependency = ? "
+                                       "ORDER BY unit", (self.configuration, os.path.abspath(path)))
+        return [Path(unit) for unit, in rows]
+
+    def fingerprints(self, paths: Iterable[Union[str, Path]]) -> Dict[str, Fingerprint]:
+        """
+        Returns the current fingerprint of every file in `paths` that exists. Take them before scanning and pass
+        them to `store`, so an edit made while the scan runs is still noticed by the next one.
+        """
+        fingerprints: Dict[str, Fingerprint] = {}
+        for path in paths:
+            path = os.path.abspath(path)
+            if self._changed.get(path) is False:
+                stored = self._fingerprint(path)
+                if stored is not None:
+                    fingerprints[path] = stored
+                    continue
+            try:
+                stat = os.stat(path)
+                fingerprints[path] = (stat.st_mtime_ns, stat.st_size, fingerprint_file(path))
+            except OSError:
+                pass
+        return fingerprints
+
+    def store(self, results: Iterable[ScanResult], fingerprints: Optional[Mapping[str, Fingerprint]] = None,
+              started: Optional[int] = None):
+        """
+        Stores `results`, along with the fingerprint of every file they read: the one in `fingerprints`, taken with
+        `fingerprints` before the scan, or else the current one. A file that is not in `fingerprints` and was
+        modified after `started`, in `time.time_ns` nanoseconds, may have changed while it was scanned, so it is
+        not stored and counts as changed next time.
+        """
+        fingerprints = fingerprints or {}
+        files: Set[str] = set()
+        with self.connection:
+            for result in results:
+                unit = os.path.abspath(result.path)
+                self.connection.execute("INSERT OR REPLACE INTO units VALUES (?, ?, ?)",
+                                        (self.configuration, unit, pickle.dumps(result.unresolved)))
+                self.connection.execute("DELETE FROM edges WHERE configuration = ? AND unit = ?",
+                                        (self.configuration, unit))
+                self.connection.executemany("INSERT INTO edges VALUES (?, ?, ?, ?)",
+                                            ((self.configuration, unit, i, os.path.abspath(d))
+                                             for i, d in enumerate(result.dependencies)))
+                files.add(unit)
+                files.update(os.path.abspath(d) for d in result.dependencies)
+
+            for path in files:
+                fingerprint = fingerprints.get(path)
+                if fingerprint is None:
+                    if self._changed.get(path) is False:
+                        continue
+                    try:
+                        stat = os.stat(path)
+                        if started is not None and stat.st_mtime_ns >= started:
+                            self.connection.execute("DELETE FROM files WHERE configuration = ? AND path = ?",
+                                                    (self.configuration, path))
+                            continue
+                        fingerprint = (stat.st_mtime_ns, stat.st_size, fingerprint_file(path))
+                    except OSError:
+                        continue
+                self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                                        (self.configuration, path, *fingerprint))
+                self._changed.pop(path, None)
+
+    def prune(self, units: Iterable[Union[str, Path]]):
+        """Forgets every translation unit of this configuration that is not in `units`, and unused fingerprints."""
+        keep = {os.path.abspath(u) for u in units}
+        stored = [path for path, in self.connection.execute("SELECT path FROM units WHERE configuration = ?",
+                                                            (self.configuration,))]
+        with self.connection:
+            for path in stored:
+                if path not in keep:
+                    self.connection.execute("DELETE FROM units WHERE configuration = ? AND path = ?",
+                                            (self.configuration, path))
+                    self.connection.execute("DELETE FROM edges WHERE configuration = ? AND unit = ?",
+                                            (self.configuration, path))
+            self.connection.execute("DELETE FROM files WHERE configuration = ? "
+                                    "AND path NOT IN (SELECT path FROM units WHERE configuration = ?) "
+                                    "AND path NOT IN (SELECT dependency FROM edges WHERE configuration = ?)",
+                                    (self.configuration,) * 3)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class IncrementalScan:
+    """The results of `scan_incremental`, and the translation units that had to be scanned again."""
+    __slots__ = ("results", "rescanned")
+
+    def __init__(self, results: List[ScanResult], rescanned: List[Path]):
+        self.results = results
+        self.rescanned = rescanned
+
+
+def scan_incremental(paths: Iterable[Union[str, Path]],
+                     include_dirs: Iterable[Union[str, Path]] = (),
+                     quote_dirs: Iterable[Union[str, Path]] = (),
+                     defines: Optional[Mapping[str, str]] = None,
+                     workers: Optional[int] = None,
+                     cache_dir: Union[str, Path] = DEFAULT_CACHE_DIR,
+                     encoding: str = "utf-8") -> IncrementalScan:
+    """
+    Like `scan_parallel`, but only the translation units that are new, or that read a file that changed since
+    the last scan with the same settings, are scanned again. The others reuse the results stored in the
+    `DependencyDB` in `cache_dir`, which is also used for the `ASTCache`, so the changed files are the only ones
+    parsed again.
+    """
+    include_dirs, quote_dirs = list(include_dirs), list(quote_dirs)
+    paths = sorted({Path(os.path.abspath(p)) for p in paths})
+
+    with DependencyDB(cache_dir, configuration_key(include_dirs, quote_dirs, defines, encoding)) as db:
+        stale = [p for p in paths if db.is_stale(p)]
+
+        # Fingerprint the files the stale units read last time before scanning them again
+        known: Set[Path] = set(stale)
+        for path in stale:
+            previous = db.load(path)
+            if previous is not None:
+                known.update(previous.dependencies)
+        started = time.time_ns()
+        fingerprints = db.fingerprints(known)
+
+        scanned: Dict[Path, ScanResult] = {}
+        if stale:
+            for result in scan_parallel(stale, include_dirs, quote_dirs, defines, workers, cache_dir, encoding):
+                scanned[result.path] = result
+        db.store(scanned.values(), fingerprints, started)
+        db.prune(paths)
+
+        results = [scanned[p] if p in scanned else db.load(p) for p in paths]
+
+    return IncrementalScan(results, stale)
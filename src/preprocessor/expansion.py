@@ -0,0 +1,302 @@
+"""
+Macro expansion. Implements the rescanning algorithm of the C standard with hide sets: every token carries the
+names of the macros that produced it, and a macro is never expanded again within its own expansion. Covers
+object-like and function-like macros, the `#` and `##` operators and, in #if expressions, `defined`.
+
+The full expansions of object-like macros are memoized. An entry is reused while the macro table's generation is
+unchanged, and otherwise revalidated against the definitions the expansion read.
+"""
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+from .tokenizer import TOKEN_MAP, TokenType, Token, tokenize_line
+from .parser import ObjectMacro, FunctionMacro
+from .expression import MacroTable
+from .shunting_yard import PreprocessorSyntaxError
+
+
+HideSet = FrozenSet[str]
+# A token and the names of the macros it must not be expanded by
+Item = Tuple[Token, HideSet]
+
+_NO_NAMES: HideSet = frozenset()
+_NUM_REGEX = next(regex for regex, token_type in TOKEN_MAP if token_type is TokenType.NUM_LITERAL)
+_TRUE = _NUM_REGEX.match("1")
+_FALSE = _NUM_REGEX.match("0")
+
+# Stands in for an empty argument next to a '##', see C11 6.10.3.3
+_PLACEMARKER = Token(TokenType.GENERIC)
+
+
+class _Incomplete(Exception):
+    """Raised when an expansion on its own would need tokens that follow it, so it cannot be memoized."""
+
+
+class _Expansion:
+    """A memoized expansion of an object-like macro and every definition it read."""
+    __slots__ = ("macro", "generation", "dependencies", "items")
+
+    def __init__(self, macro: ObjectMacro, generation: Optional[int], dependencies: Tuple[Tuple[str, object], ...],
+                 items: List[Item]):
+        self.macro = macro
+        self.generation = generation
+        self.dependencies = dependencies
+        self.items = items
+
+
+def _text(token: Token) -> str:
+    return token.value.group()
+
+
+def _spelling(tokens: Sequence[Token]) -> str:
+    """Joins the text of `tokens`, keeping a single space wherever the source had whitespace."""
+    parts = []
+    previous = None
+    for t in tokens:
+        text = _text(t)
+        if t.type is TokenType.STRING_LITERAL:
+            text = text.replace("\\", "\\\\").replace("\"", "\\\"")
+        if previous is not None and (t.line != previous.line or t.col > previous.col + len(_text(previous))):
+            parts.append(" ")
+        parts.append(text)
+        previous = t
+
+    return "".join(parts)
+
+
+def _retokenize(text: str, like: Token) -> List[Token]:
+    """Tokenizes text produced by `#` or `##`, placing the tokens at the position of `like`."""
+    tokens = [t for t in tokenize_line(text, like.line) if t.type is not TokenType.WHITESPACE]
+    for t in tokens:
+        t.col += like.col
+
+    return tokens
+
+
+class MacroExpander:
+    """
+    Expands macros in token lists. Full expansions of object-like macros are memoized, so a version macro that is
+    tested by many #if directives is only expanded once for as long as nothing it depends on is redefined. The memo
+    is cleared once it holds `max_entries` entries.
+    """
+
+    def __init__(self, max_entries: int = 65536):
+        self.max_entries = max_entries
+        self.memo: Dict[Tuple[str, bool], _Expansion] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def expand(self, tokens: Sequence[Token], macro_table: MacroTable) -> List[Token]:
+        """Fully expands `tokens`, such as the tokens of a computed #include."""
+        return [t for t, _ in self._expand([(t, _NO_NAMES) for t in tokens], macro_table, False, None)]
+
+    def expand_expression(self, tokens: Sequence[Token], macro_table: MacroTable) -> List[Token]:
+        """
+        Expands an #if expression. Each `defined X` and `defined(X)` is replaced with 1 or 0 before the macros
+        around it are expanded, so the result only holds the identifiers of macros that are not defined.
+        """
+        return [t for t, _ in self._expand([(t, _NO_NAMES) for t in tokens], macro_table, True, None)]
+
+    def clear(self):
+        """Forgets every memoized expansion."""
+        self.memo.clear()
+
+    def _expand(self, items: List[Item], macro_table: MacroTable, expression: bool,
+                lookups: Optional[Dict[str, object]]) -> List[Item]:
+        """
+        Rescans `items` until no macro can be expanded. When `lookups` is given the expansion is isolated: every
+        definition read is recorded in it, and `_Incomplete` is raised if the result could depend on what follows.
+        """
+        output: List[Item] = []
+        # The next item is at the end, so expansions are pushed back in reverse
+        pending = items[::-1]
+
+        def lookup(name: str):
+            macro = macro_table.get(name)
+            if lookups is not None:
+                lookups[name] = macro
+            return macro
+
+        while pending:
+            token, hidden = pending.pop()
+
+            if expression and token.type is TokenType.OP_DEFINED:
+                output.append((self._defined(token, pending, lookup, lookups is not None), hidden))
+                continue
+            if token.type is not TokenType.IDENTIFIER:
+                output.append((token, hidden))
+                continue
+
+            name = _text(token)
+            macro = None if name in hidden else lookup(name)
+            if macro is None:
+                output.append((token, hidden))
+                continue
+
+            if isinstance(macro, ObjectMacro):
+                if not hidden and lookups is None:
+                    memoized = self._memoized(name, macro, macro_table, expression)
+                    if memoized is not None:
+                        output.extend(memoized)
+                        continue
+
+                substituted = self._substitute(macro.tokens, None, hidden | {name}, macro_table, expression, lookups)
+                pending.extend(reversed(substituted))
+                continue
+
+            # A function-like macro is only invoked if its name is followed by '('
+            if not pending:
+                if lookups is not None:
+                    raise _Incomplete()
+                output.append((token, hidden))
+                continue
+            if pending[-1][0].type is not TokenType.LPAREN:
+                output.append((token, hidden))
+                continue
+
+            arguments, closing_hidden = self._collect_arguments(token, macro, pending, lookups is not None)
+            substituted = self._substitute(macro.expression, dict(zip(macro.params, arguments)),
+                                           (hidden & closing_hidden) | {name}, macro_table, expression, lookups)
+            pending.extend(reversed(substituted))
+
+        return output
+
+    def _memoized(self, name: str, macro: ObjectMacro, macro_table: MacroTable, expression: bool) -> Optional[List[Item]]:
+        """Returns the full expansion of the object-like macro `name`, or None if it depends on what follows it."""
+        key = (name, expression)
+        generation = getattr(macro_table, "generation", None)
+
+        entry = self.memo.get(key)
+        if entry is not None and entry.macro is macro:
+            if generation is None or entry.generation != generation:
+                if any(macro_table.get(n) is not m for n, m in entry.dependencies):
+                    entry = None
+                else:
+                    entry.generation = generation
+
+            if entry is not None:
+                self.hits += 1
+                return entry.items
+
+        self.misses += 1
+        lookups: Dict[str, object] = {name: macro}
+        try:
+            substituted = self._substitute(macro.tokens, None, frozenset((name, )), macro_table, expression, lookups)
+            items = self._expand(substituted, macro_table, expression, lookups)
+        except _Incomplete:
+            return None
+
+        if len(self.memo) >= self.max_entries:
+            self.memo.clear()
+        self.memo[key] = _Expansion(macro, generation, tuple(lookups.items()), items)
+        return items
+
+    def _defined(self, token: Token, pending: List[Item], lookup, isolated: bool) -> Token:
+        """Consumes the operand of `defined` from `pending` and returns a 1 or 0 literal in its place."""
+        def take(expected: TokenType) -> Token:
+            if not pending:
+                if isolated:
+                    raise _Incomplete()
+                raise PreprocessorSyntaxError(token.line, token.col, "'defined' must be followed by an identifier")
+            operand = pending.pop()[0]
+            if operand.type is not expected:
+                raise PreprocessorSyntaxError(operand.line, operand.col, f"Unexpected '{_text(operand)}' after 'defined'")
+            return operand
+
+        parenthesized = bool(pending) and pending[-1][0].type is TokenType.LPAREN
+        if parenthesized:
+            pending.pop()
+        name = _text(take(TokenType.IDENTIFIER))
+        if parenthesized:
+            take(TokenType.RPAREN)
+
+        return Token(TokenType.NUM_LITERAL, _TRUE if lookup(name) is not None else _FALSE, token.col, token.line)
+
+    def _collect_arguments(self, token: Token, macro: FunctionMacro, pending: List[Item],
+                           isolated: bool) -> Tuple[List[List[Item]], HideSet]:
+        """Consumes the parenthesized arguments of a call to `macro` from `pending`."""
+        pending.pop()
+        arguments: List[List[Item]] = [[]]
+        depth = 0
+
+        while pending:
+            item = pending.pop()
+            item_type = item[0].type
+
+            if item_type is TokenType.RPAREN:
+                if depth == 0:
+                    break
+                depth -= 1
+            elif item_type is TokenType.LPAREN:
+                depth += 1
+            elif item_type is TokenType.COMMA and depth == 0:
+                arguments.append([])
+                continue
+
+            arguments[-1].append(item)
+        else:
+            if isolated:
+                raise _Incomplete()
+            raise PreprocessorSyntaxError(token.line, token.col, f"Unterminated call to macro '{macro.identifier}'")
+
+        if len(macro.params) == 0 and arguments == [[]]:
+            arguments = []
+        if len(arguments) != len(macro.params):
+            raise PreprocessorSyntaxError(token.line, token.col,
+                                          f"Macro '{macro.identifier}' takes {len(macro.params)} arguments, got {len(arguments)}")
+
+        return arguments, item[1]
+
+    def _substitute(self, body: Sequence[Token], arguments: Optional[Dict[str, List[Item]]], hidden: HideSet,
+                    macro_table: MacroTable, expression: bool, lookups: Optional[Dict[str, object]]) -> List[Item]:
+        """
+        Replaces the parameters in a replacement list with their arguments and applies `#` and `##`. `arguments`
+        is None for an object-like macro. Every resulting token is hidden from the names in `hidden`.
+        """
+        def argument(t: Token) -> Optional[List[Item]]:
+            if arguments is None or t.type is not TokenType.IDENTIFIER:
+                return None
+            return arguments.get(_text(t))
+
+        output: List[Item] = []
+        paste = False
+        i = 0
+
+        while i < len(body):
+            t = body[i]
+            followed_by_paste = i + 1 < len(body) and body[i + 1].type is TokenType.OP_CONCAT
+
+            if t.type is TokenType.OP_CONCAT and output and i + 1 < len(body):
+                paste = True
+                i += 1
+                continue
+
+            if arguments is not None and t.type is TokenType.OP_JOIN and i + 1 < len(body) and argument(body[i + 1]) is not None:
+                stringized = _spelling([token for token, _ in argument(body[i + 1])])
+                items = [(token, hidden) for token in _retokenize(f"\"{stringized}\"", t)]
+                i += 2
+            elif argument(t) is not None:
+                if paste or followed_by_paste:
+                    # Operands of '##' are not expanded
+                    items = argument(t) or [(_PLACEMARKER, _NO_NAMES)]
+                else:
+                    items = self._expand(argument(t), macro_table, expression, lookups)
+                items = [(token, names | hidden) for token, names in items]
+                i += 1
+            else:
+                items = [(t, hidden)]
+                i += 1
+
+            if paste:
+                paste = False
+                left = output.pop()[0]
+                right = items[0][0]
+                if left is _PLACEMARKER:
+                    pasted = [right]
+                elif right is _PLACEMARKER:
+                    pasted = [left]
+                else:
+                    pasted = _retokenize(_text(left) + _text(right), left)
+                items = [(token, hidden) for token in pasted] + items[1:]
+
+            output.extend(items)
+
+        return [item for item in output if item[0] is not _PLACEMARKER]
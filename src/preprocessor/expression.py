@@ -0,0 +1,254 @@
+"""
+Compiled evaluation of #if expressions. An expression is converted to RPN by `ShuntingYard` once, and then compiled
+into a tree of closures with short-circuiting `&&`, `||` and `?:`. Results are memoized on the expression and the values of
+the macros it references, so a guard that appears in many headers is only evaluated once per macro state.
+"""
+from typing import Callable, Dict, FrozenSet, Iterable, List, Mapping, Optional, Tuple, Union
+from .tokenizer import TokenType, Token
+from .parser import ObjectMacro, FunctionMacro, Literal
+from .shunting_yard import ShuntingYard, PreprocessorSyntaxError
+
+
+MacroTable = Mapping[str, Union[ObjectMacro, FunctionMacro]]
+# Takes the macro table and the names of the macros currently being expanded
+Evaluator = Callable[[MacroTable, FrozenSet[str]], Literal]
+ExpressionSource = Tuple[Tuple[TokenType, str], ...]
+
+_BINARY_OPERATORS = {
+    TokenType.OP_EQ: lambda a, b: a == b,
+    TokenType.OP_NEQ: lambda a, b: a != b,
+    TokenType.OP_LT: lambda a, b: a < b,
+    TokenType.OP_GT: lambda a, b: a > b,
+    TokenType.OP_LTE: lambda a, b: a <= b,
+    TokenType.OP_GTE: lambda a, b: a >= b,
+    TokenType.OP_ADD: lambda a, b: a + b,
+    TokenType.OP_SUB: lambda a, b: a - b,
+    TokenType.OP_MUL: lambda a, b: a * b,
+    TokenType.OP_LSHIFT: lambda a, b: a << b,
+    TokenType.OP_RSHIFT: lambda a, b: a >> b,
+    TokenType.OP_BIT_AND: lambda a, b: a & b,
+    TokenType.OP_BIT_OR: lambda a, b: a | b,
+    TokenType.OP_BIT_XOR: lambda a, b: a ^ b,
+}
+
+_UNARY_OPERATORS = {
+    TokenType.OP_NOT: lambda a: not a,
+    TokenType.OP_BIT_NOT: lambda a: ~a,
+    TokenType.OP_UNARY_PLUS: lambda a: +a,
+    TokenType.OP_UNARY_MINUS: lambda a: -a,
+}
+
+
+def _divide(a, b):
+    """Divides like C, rounding towards zero rather than down."""
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+_DIVISION_OPERATORS = {
+    TokenType.OP_DIV: _divide,
+    TokenType.OP_MOD: lambda a, b: a - b * _divide(a, b),
+}
+
+
+def resolve_value(token: Token):
+    """Resolves a value token to a python object"""
+    if token.type == TokenType.NUM_LITERAL:
+        text = token.value.group()
+        integer = text.rstrip("uUlL")
+        if len(integer) > 1 and integer[0] == "0" and integer.isdigit():
+            try:
+                return int(integer, 8)
+            except ValueError:
+                raise PreprocessorSyntaxError(token.line, token.col, f"Invalid digit in octal constant '{text}'")
+        try:
+            return int(integer, 0)
+        except ValueError:
+            return float(text.rstrip("fFlL"))
+    elif token.type == TokenType.STRING_LITERAL:
+        return token.value.group(1)
+    raise ValueError(f"Expected a token of type NUM_LITERAL or STRING_LITERAL, got {token.type} instead")
+
+
+def expression_source(tokens: Iterable[Token]) -> ExpressionSource:
+    """Returns a hashable spelling of `tokens`, used as a cache key."""
+    return tuple((t.type, t.value.group()) for t in tokens)
+
+
+class CompiledExpression:
+    """An expression compiled to a closure tree. `identifiers` holds every macro name the expression reads."""
+    __slots__ = ("function", "identifiers")
+
+    def __init__(self, function: Evaluator, identifiers: FrozenSet[str]):
+        self.function = function
+        self.identifiers = identifiers
+
+    def __call__(self, macro_table: MacroTable, hidden: FrozenSet[str] = frozenset()) -> Literal:
+        return self.function(macro_table, hidden)
+
+
+class ExpressionCache:
+    """
+    Compiles and evaluates expressions. Compiled expressions are shared by every expression with the same spelling,
+    and results are memoized on the spelling plus the current definitions of the macros the expression reads.
+    Each memo is cleared once it holds `max_entries` entries.
+    """
+
+    def __init__(self, max_entries: int = 65536):
+        self.max_entries = max_entries
+        self.compiled: Dict[ExpressionSource, CompiledExpression] = {}
+        self.results: Dict[Tuple[ExpressionSource, tuple], Literal] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, tokens: Iterable[Token], source: Optional[ExpressionSource] = None) -> CompiledExpression:
+        tokens = list(tokens)
+        if source is None:
+            source = expression_source(tokens)
+
+        compiled = self.compiled.get(source)
+        if compiled is None:
+            if len(self.compiled) >= self.max_entries:
+                self.compiled.clear()
+            compiled = self.compiled[source] = compile_expression(tokens, self)
+
+        return compiled
+
+    def evaluate(self, tokens: Iterable[Token], macro_table: MacroTable) -> Literal:
+        tokens = list(tokens)
+        source = expression_source(tokens)
+        compiled = self.compile(tokens, source)
+
+        key = (source, tuple(macro_signature(name, macro_table) for name in sorted(compiled.identifiers)))
+        try:
+            rv = self.results[key]
+            self.hits += 1
+            return rv
+        except KeyError:
+            self.misses += 1
+
+        rv = compiled(macro_table)
+        if len(self.results) >= self.max_entries:
+            self.results.clear()
+        self.results[key] = rv
+        return rv
+
+    def identifier_value(self, name: str, macro_table: MacroTable, hidden: FrozenSet[str]) -> Literal:
+        """
+        The value of an identifier in an expression. Undefined identifiers, function-like macros and macros that
+        refer to themselves evaluate to 0. Object-like macros are evaluated as expressions.
+        """
+        macro = macro_table.get(name)
+        if not isinstance(macro, ObjectMacro) or name in hidden or len(macro.tokens) == 0:
+            return 0
+
+        tokens = macro.tokens
+        if len(tokens) == 1 and tokens[0].type in {TokenType.NUM_LITERAL, TokenType.STRING_LITERAL}:
+            return resolve_value(tokens[0])
+
+        return self.compile(tokens)(macro_table, hidden | {name})
+
+    def clear(self):
+        """Forgets every compiled expression and memoized result."""
+        self.compiled.clear()
+        self.results.clear()
+
+
+def macro_signature(name: str, macro_table: MacroTable, seen: FrozenSet[str] = frozenset()):
+    """
+    Describes the definition of `name` and of every macro its replacement list refers to. Two tables give the
+    same signature for a name only if an expression reading that name evaluates the same in both.
+    """
+    macro = macro_table.get(name)
+    if macro is None:
+        return None
+    if not isinstance(macro, ObjectMacro):
+        return ("()", )
+    if name in seen:
+        return ("...", )
+
+    seen = seen | {name}
+    nested = tuple(macro_signature(t.value.group(), macro_table, seen)
+                   for t in macro.tokens if t.type is TokenType.IDENTIFIER)
+    return (macro.spelling, nested) if nested else macro.spelling
+
+
+def _checked_division(a: Evaluator, b: Evaluator, o: Token) -> Evaluator:
+    divide = _DIVISION_OPERATORS[o.type]
+
+    def evaluate(table: MacroTable, hidden: FrozenSet[str]) -> Literal:
+        dividend = a(table, hidden)
+        divisor = b(table, hidden)
+        if divisor == 0:
+            raise PreprocessorSyntaxError(o.line, o.col, f"Division by zero in '{o.value.group()}'")
+        return divide(dividend, divisor)
+
+    return evaluate
+
+
+def compile_expression(tokens: List[Token], cache: Optional[ExpressionCache] = None) -> CompiledExpression:
+    """Compiles the tokens of an #if expression into a `CompiledExpression`."""
+    if cache is None:
+        cache = ExpressionCache()
+
+    sy = ShuntingYard()
+    sy.feed(tokens)
+
+    # Each entry is the compiled operand and, for a bare identifier, its name
+    stack: List[Tuple[Evaluator, Optional[str]]] = []
+    identifiers = set()
+
+    def pop(o: Token) -> Tuple[Evaluator, Optional[str]]:
+        try:
+            return stack.pop()
+        except IndexError:
+            raise PreprocessorSyntaxError(o.line, o.col, f"Missing operand for '{o.value.group()}'")
+
+    for o in sy.output_stack:
+        if o.type is TokenType.IDENTIFIER:
+            name = o.value.group()
+            identifiers.add(name)
+            stack.append(((lambda name: lambda table, hidden: cache.identifier_value(name, table, hidden))(name), name))
+        elif o.type in {TokenType.NUM_LITERAL, TokenType.STRING_LITERAL}:
+            value = resolve_value(o)
+            stack.append(((lambda value: lambda table, hidden: value)(value), None))
+        elif o.type is TokenType.OP_DEFINED:
+            name = pop(o)[1]
+            if name is None:
+                raise PreprocessorSyntaxError(o.line, o.col, "'defined' must be followed by an identifier")
+            stack.append(((lambda name: lambda table, hidden: name in table)(name), None))
+        elif o.type in _UNARY_OPERATORS:
+            a = pop(o)[0]
+            op = _UNARY_OPERATORS[o.type]
+            stack.append(((lambda a, op: lambda table, hidden: op(a(table, hidden)))(a, op), None))
+        elif o.type in {TokenType.OP_AND, TokenType.OP_OR}:
+            b = pop(o)[0]
+            a = pop(o)[0]
+            if o.type is TokenType.OP_AND:
+                function = (lambda a, b: lambda table, hidden: bool(a(table, hidden)) and bool(b(table, hidden)))(a, b)
+            else:
+                function = (lambda a, b: lambda table, hidden: bool(a(table, hidden)) or bool(b(table, hidden)))(a, b)
+            stack.append((function, None))
+        elif o.type is TokenType.OP_COLON:
+            # The operands of `a ? b : c`, only one of `b` and `c` is evaluated
+            c = pop(o)[0]
+            b = pop(o)[0]
+            a = pop(o)[0]
+            function = (lambda a, b, c: lambda table, hidden: b(table, hidden) if a(table, hidden) else c(table, hidden))(a, b, c)
+            stack.append((function, None))
+        elif o.type in _DIVISION_OPERATORS:
+            b = pop(o)[0]
+            a = pop(o)[0]
+            stack.append((_checked_division(a, b, o), None))
+        elif o.type in _BINARY_OPERATORS:
+            b = pop(o)[0]
+            a = pop(o)[0]
+            op = _BINARY_OPERATORS[o.type]
+            stack.append(((lambda a, b, op: lambda table, hidden: op(a(table, hidden), b(table, hidden)))(a, b, op), None))
+        else:
+            raise PreprocessorSyntaxError(o.line, o.col, f"Unsupported operator '{o.value.group()}' in expression")
+
+    if len(stack) != 1:
+        raise ValueError(f"Expected a single expression, got {len(stack)} operands")
+
+    return CompiledExpression(stack[0][0], frozenset(identifiers))
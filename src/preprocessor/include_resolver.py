@@ -0,0 +1,110 @@
+"""
+Resolution of #include paths against include directories. Every directory is listed once with `os.scandir` into
+an in-memory index, and every result, including a failed lookup, is cached, so resolving an include costs no
+system calls once the directories it touches have been listed.
+"""
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import os
+from .parser import IncludeDirective
+
+
+# Maps the names in a directory to whether they are directories themselves
+DirectoryListing = Dict[str, bool]
+
+
+class IncludeResolver:
+    """
+    Finds the file an `IncludeDirective` refers to.
+
+    Quoted includes (`#include "a.h"`) are looked up in the directory of the including file, then in `quote_dirs`
+    and then in `include_dirs`, like GCC's `-iquote` and `-I`. Angle includes (`#include <a.h>`) are only looked up
+    in `include_dirs`. Directory listings are read on first use and kept until `clear` is called.
+    """
+
+    def __init__(self, include_dirs: Iterable[Union[str, Path]] = (), quote_dirs: Iterable[Union[str, Path]] = ()):
+        self.include_dirs: List[str] = [os.path.abspath(d) for d in include_dirs]
+        self.quote_dirs: List[str] = [os.path.abspath(d) for d in quote_dirs]
+
+        self._listings: Dict[str, DirectoryListing] = {}
+        self._results: Dict[Tuple[Optional[str], str, bool], Optional[Path]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.scans = 0
+
+    def _listing(self, directory: str) -> DirectoryListing:
+        listing = self._listings.get(directory)
+        if listing is None:
+            listing = {}
+            self.scans += 1
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            listing[entry.name] = entry.is_dir()
+                        except OSError:
+                            # A broken symlink
+                            continue
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                pass
+            self._listings[directory] = listing
+
+        return listing
+
+    def _is_file(self, directory: str, relative: str) -> bool:
+        """Checks if `relative` names a file below `directory` using only the directory listings."""
+        if os.path.isabs(relative):
+            relative = os.path.normpath(relative)
+            directory, parts = os.path.dirname(relative), [os.path.basename(relative)]
+        else:
+            parts = relative.replace("\\", "/").split("/")
+            if any(part in {"", ".", ".."} for part in parts):
+                path = os.path.normpath(os.path.join(directory, relative))
+                directory, parts = os.path.dirname(path), [os.path.basename(path)]
+
+        # Walk down from `directory`, so a directory is only listed if its parent contains it
+        for part in parts[:-1]:
+            if self._listing(directory).get(part) is not True:
+                return False
+            directory = os.path.join(directory, part)
+
+        return self._listing(directory).get(parts[-1]) is False
+
+    def search_dirs(self, directive: IncludeDirective, including_file: Optional[Union[str, Path]] = None) -> List[str]:
+        """The directories `directive` is looked up in, in order."""
+        if not directive.expanded:
+            return self.include_dirs
+
+        dirs = self.quote_dirs + self.include_dirs
+        if including_file is not None:
+            dirs = [os.path.dirname(os.path.abspath(including_file))] + dirs
+        return dirs
+
+    def resolve(self, directive: IncludeDirective, including_file: Optional[Union[str, Path]] = None) -> Optional[Path]:
+        """Returns the path of the file `directive` includes, or None if it cannot be found."""
+        including_dir = None
+        if directive.expanded and including_file is not None:
+            including_dir = os.path.dirname(os.path.abspath(including_file))
+
+        key = (including_dir, directive.path, directive.expanded)
+        try:
+            rv = self._results[key]
+            self.hits += 1
+            return rv
+        except KeyError:
+            self.misses += 1
+
+        rv = None
+        for directory in self.search_dirs(directive, including_file):
+            if self._is_file(directory, directive.path):
+                rv = Path(os.path.normpath(os.path.join(directory, directive.path)))
+                break
+
+        self._results[key] = rv
+        return rv
+
+    def clear(self):
+        """Forgets every directory listing and result, for when the include directories have changed on disk."""
+        self._listings.clear()
+        self._results.clear()
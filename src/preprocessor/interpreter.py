@@ -1,144 +1,276 @@
-from typing import List, Dict, Set, Union, Iterator, Tuple, Optional
-from .tokenizer import TokenType, VALUE_TYPES, OPERATOR_TYPES, Token
-from .parser import ASTObject, IncludeDirective, DifferedIncludeDirective, ObjectMacro, FunctionMacro, IfDirective
-from .shunting_yard import ShuntingYard
-
-
-MacroTable = Dict[str, Union[ObjectMacro, FunctionMacro]]
+from typing import Callable, Iterator, List, Set, Union, Iterable, Optional, Sequence
+from pathlib import Path
+import re
+from .tokenizer import Token, tokenize_line
+from .string_santization import LogicalLine
+from .parser import ASTObject, IncludeDirective, DifferedIncludeDirective, ObjectMacro, FunctionMacro, IfDirective, PragmaDirective
+from .parser import UndefDirective, DiagnosticDirective, NullDirective
+from .parser import ConditionalIndex, build_conditional_index
+from .expression import ExpressionCache, resolve_value  # NOQA: F401 resolve_value is re-exported
+from .scanner import iter_directive_lines, parse_logical_line
+from .expansion import MacroExpander
+from .macro_table import MacroTable
+from . import stats
+
+
+EXPANDER = MacroExpander()
+EXPRESSION_CACHE = ExpressionCache()
+# Expanded expressions only hold identifiers that are not macros, which evaluate to 0
+_NO_MACROS: MacroTable = MacroTable().snapshot()
+
+# Called with every include that is reached, before evaluation continues. Used to follow includes
+IncludeHook = Callable[[IncludeDirective], None]
 
 
 def resolve_include(d: DifferedIncludeDirective, macro_table: MacroTable) -> IncludeDirective:
-    identifier_value = macro_table[d.identifier]
-
-    if isinstance(identifier_value, FunctionMacro):
-        raise NotImplementedError("Evaluating of function macros in includes is not currently supported.")
-
-    return IncludeDirective.from_tokens(identifier_value.tokens)
-
+    """Expands the tokens of a computed #include with the shared `EXPANDER`."""
+    tokens = d.tokens if d.tokens is not None else tokenize_line(d.identifier)
+    expanded = EXPANDER.expand(tokens, macro_table)
+
+    if len(expanded) == 0:
+        raise ValueError(f"#include {d.identifier} expands to nothing")
+
+    return IncludeDirective.from_tokens(expanded)
+
+
+def evaluate_expression(expression_tokens: List[Token], macro_table: Optional[MacroTable] = None):
+    """Expands the macros in an #if expression with `EXPANDER`, then evaluates it with `EXPRESSION_CACHE`."""
+    if macro_table is None:
+        macro_table = _NO_MACROS
+
+    return EXPRESSION_CACHE.evaluate(EXPANDER.expand_expression(expression_tokens, macro_table), _NO_MACROS)
+
+
+def evaluate_condition(directive: IfDirective, macro_table: MacroTable) -> bool:
+    """Evaluates the condition of an #if, #ifdef, #ifndef or #elif directive."""
+    if stats.COLLECTOR is not None:
+        stats.COLLECTOR.count("conditionals")
+
+    if directive.directive == "ifdef":
+        return directive.expression[0].value.group() in macro_table
+    if directive.directive == "ifndef":
+        return directive.expression[0].value.group() not in macro_table
+
+    return bool(evaluate_expression(directive.expression, macro_table))
+
+
+class _Conditional:
+    """State of an open #if block while evaluating a stream of directives."""
+    __slots__ = ("active", "taken", "parent_active")
+
+    def __init__(self, active: bool, parent_active: bool):
+        self.active = active
+        self.taken = active
+        self.parent_active = parent_active
+
+
+def _apply(o: ASTObject, macro_table: MacroTable, dependencies: Set[IncludeDirective],
+           include: Optional[IncludeHook] = None):
+    """Applies a directive that is not a conditional."""
+    if isinstance(o, (IncludeDirective, DifferedIncludeDirective)):
+        directive = o if isinstance(o, IncludeDirective) else resolve_include(o, macro_table)
+        dependencies.add(directive)
+        if include is not None:
+            include(directive)
+    elif isinstance(o, ObjectMacro):
+        macro_table[o.identifier] = o
+    elif isinstance(o, FunctionMacro):
+        macro_table[o.identifier] = o
+    elif isinstance(o, UndefDirective):
+        macro_table.pop(o.identifier, None)
+    elif isinstance(o, DiagnosticDirective):
+        if o.directive == "error":
+            raise Exception("#error " + " ".join(t.value.group() for t in o.message))
+    elif isinstance(o, (PragmaDirective, NullDirective)):
+        pass
+    else:
+        raise TypeError(o)
+
+
+def evaluate_ast(ast_objects: Iterable[ASTObject], macro_table: Optional[MacroTable] = None,
+                 conditional_index: Optional[ConditionalIndex] = None,
+                 include: Optional[IncludeHook] = None) -> Set[IncludeDirective]:
+    """
+    Evaluates `ast_objects` and returns the includes that are reached. `include` is called with each of them as
+    it is reached.
+
+    A list is evaluated with a `ConditionalIndex` (built with `parser.build_conditional_index` unless one is
+    passed in), so the branches that are not taken are jumped over. Any other iterable is consumed one object at
+    a time, so `ast_objects` can be a generator such as `scanner.parse_file`.
+    """
+    if macro_table is None:
+        macro_table = MacroTable()
+
+    collector = stats.COLLECTOR
+    if collector is not None:
+        with collector.phase("evaluate"):
+            macro_table = collector.wrap(macro_table)
+            if isinstance(ast_objects, Sequence):
+                return _evaluate_indexed(ast_objects, macro_table, conditional_index, include)
+            return _evaluate_stream(ast_objects, macro_table, include)
+
+    if isinstance(ast_objects, Sequence):
+        return _evaluate_indexed(ast_objects, macro_table, conditional_index, include)
+
+    return _evaluate_stream(ast_objects, macro_table, include)
+
+
+def _evaluate_indexed(ast_objects: Sequence[ASTObject], macro_table: MacroTable,
+                      conditional_index: Optional[ConditionalIndex], include: Optional[IncludeHook]) -> Set[IncludeDirective]:
+    dependencies: Set[IncludeDirective] = set()
 
-def resolve_value(token: Token):
-    """Resolves a value token to a python object"""
-    if token.type == TokenType.NUM_LITERAL:
-        try:
-            return int(token.value.group())
-        except ValueError:
-            return float(token.value.group())
-    elif token.type == TokenType.STRING_LITERAL:
-        return token.value.group(1)
-    raise ValueError(f"Expected a token of type NUM_LITERAL or STRING_LITERAL, got {token.type} instead")
+    if conditional_index is None:
+        conditional_index = build_conditional_index(ast_objects)
 
+    i = 0
+    while i < len(ast_objects):
+        o = ast_objects[i]
 
-def evaluate_expression(expression_tokens: List[Token]):
-    sy = ShuntingYard()
-    sy.feed(expression_tokens)
+        if isinstance(o, IfDirective):
+            block = conditional_index[i]
 
-    eval_stack = []
-    for o in sy.output_stack:
-        if o.type in VALUE_TYPES:
-            eval_stack.append(resolve_value(o))
+            if o.directive in {"if", "ifdef", "ifndef"}:
+                # Jump to the first branch that is taken, or past the #endif if there is none
+                i = block.end
+                for branch in block.branches:
+                    branch_directive = ast_objects[branch]
+                    if branch_directive.directive == "else" or evaluate_condition(branch_directive, macro_table):
+                        i = branch
+                        break
+            elif o.directive in {"elif", "else"}:
+                # The end of the branch that was taken
+                i = block.end
+
+            i += 1
             continue
 
-        if o.type not in OPERATOR_TYPES:
-            raise ValueError(f"{o.line}, {o.col}: Expected an operator.")
-
-        # Unary operators
-
-        if o.type is TokenType.OP_NOT:
-            eval_stack.append(not eval_stack.pop())
-
-        # TODO: Defined implementation
-
-        # Normal operators
-
-        op_a = eval_stack.pop()
-        op_b = eval_stack.pop()
-
-        if o.type is TokenType.OP_AND:
-            eval_stack.append(op_a and op_b)
-        elif o.type is TokenType.OP_OR:
-            eval_stack.append(op_a or op_b)
-        elif o.type is TokenType.OP_EQ:
-            eval_stack.append(op_a == op_b)
-        elif o.type is TokenType.OP_GT:
-            eval_stack.append(op_a > op_b)
-        elif o.type is TokenType.OP_GTE:
-            eval_stack.append(op_a >= op_b)
-        elif o.type is TokenType.OP_LT:
-            eval_stack.append(op_a < op_b)
-        elif o.type is TokenType.OP_LTE:
-            eval_stack.append(op_a <= op_b)
-        elif o.type is TokenType.OP_NEQ:
-            eval_stack.append(op_a != op_b)
-
-    return eval_stack[0]
-
-
-def get_branches(objects: List[ASTObject]) -> List[Tuple[int, IfDirective]]:
-    directives: Iterator[Tuple[int, IfDirective]] = filter(lambda x: isinstance(x[1], IfDirective), enumerate(objects))
-    rv = []
-    depth = 0
-
-    for d in directives:
-        if d[1].directive in {"if", "ifdef"}:
-            depth += 1
-        elif d[1].directive == "endif":
-            depth -= 1
-
-        if depth == 1:
-            rv.append(d)
-
-    return rv
+        _apply(o, macro_table, dependencies, include)
+        i += 1
 
+    return dependencies
 
-def evaluate_choice(objects: List[ASTObject], i: int = 0):
-    branches = get_branches(objects)
-    last_index = branches[-1][0] + i + 1
 
-    for index, branch in enumerate(branches[:-1]):
-        if branch[1].directive == "else" or evaluate_expression(branch[1].expression):
-            next_index = branch[0] + i + 1
-            stop_index = branches[index + 1][0]
-            return (next_index, stop_index, last_index)
+class _StreamState:
+    """Open conditionals are tracked on a stack; directives inside a branch that is not taken are skipped."""
 
-    return last_index
+    def __init__(self, macro_table: MacroTable, include: Optional[IncludeHook] = None):
+        self.macro_table = macro_table
+        self.include = include
+        self.dependencies: Set[IncludeDirective] = set()
+        self.conditionals: List[_Conditional] = []
 
+    @property
+    def active(self) -> bool:
+        return not self.conditionals or self.conditionals[-1].active
 
-def evaluate_ast(ast_objects: List[ASTObject], macro_table: Optional[MacroTable] = None):
-    dependencies: Set[IncludeDirective] = set()
+    def feed(self, o: ASTObject):
+        conditionals = self.conditionals
 
-    if not macro_table:
-        macro_table = dict()
+        if isinstance(o, IfDirective):
+            if o.directive in {"if", "ifdef", "ifndef"}:
+                parent_active = self.active
+                conditionals.append(_Conditional(parent_active and evaluate_condition(o, self.macro_table), parent_active))
+                return
+
+            if not conditionals:
+                raise Exception(f"#{o.directive} without #if")
+
+            conditional = conditionals[-1]
+            if o.directive == "elif":
+                conditional.active = (conditional.parent_active and not conditional.taken and
+                                      evaluate_condition(o, self.macro_table))
+                conditional.taken = conditional.taken or conditional.active
+            elif o.directive == "else":
+                conditional.active = conditional.parent_active and not conditional.taken
+                conditional.taken = True
+            elif o.directive == "endif":
+                conditionals.pop()
+            return
+
+        if self.active:
+            _apply(o, self.macro_table, self.dependencies, self.include)
+
+    def skip(self, directive: str) -> bool:
+        """
+        Handles a directive inside an inactive branch from its name alone. Returns False if the directive could
+        change which branch is active, in which case it has to be parsed and passed to `feed`.
+        """
+        if directive in {"if", "ifdef", "ifndef"}:
+            self.conditionals.append(_Conditional(False, False))
+        elif directive == "endif":
+            self.conditionals.pop()
+        elif directive in {"elif", "else"}:
+            return not self.conditionals[-1].parent_active
+        return True
+
+    def finish(self) -> Set[IncludeDirective]:
+        if self.conditionals:
+            raise Exception("Unterminated #if")
+
+        return self.dependencies
+
+
+def _evaluate_stream(ast_objects: Iterable[ASTObject], macro_table: MacroTable,
+                     include: Optional[IncludeHook]) -> Set[IncludeDirective]:
+    state = _StreamState(macro_table, include)
+    for o in ast_objects:
+        state.feed(o)
+
+    return state.finish()
+
+
+DIRECTIVE_NAME_REGEX = re.compile(r"[ \t]*#[ \t]*(\w*)")
+
+
+def evaluate_lines(logical_lines: Iterable[LogicalLine], macro_table: Optional[MacroTable] = None,
+                   include: Optional[IncludeHook] = None) -> Set[IncludeDirective]:
+    """
+    Evaluates sanitized directive lines, such as those yielded by `scanner.iter_directive_lines`, and returns the
+    includes that are reached. Lines are only tokenized and parsed while they are in an active branch. Inside an
+    inactive branch only the directive name is read, to track nested #if blocks and to find the #elif or #else
+    that may end it.
+    """
+    if macro_table is None:
+        macro_table = MacroTable()
+
+    collector = stats.COLLECTOR
+    if collector is not None:
+        with collector.phase("evaluate"):
+            return _evaluate_lines(logical_lines, collector.wrap(macro_table), include)
+
+    return _evaluate_lines(logical_lines, macro_table, include)
+
+
+def _evaluate_lines(logical_lines: Iterable[LogicalLine], macro_table: MacroTable,
+                    include: Optional[IncludeHook]) -> Set[IncludeDirective]:
+    state = _StreamState(macro_table, include)
+    for logical_line in logical_lines:
+        if not state.active:
+            match = DIRECTIVE_NAME_REGEX.match(str(logical_line))
+            if match is None or state.skip(match.group(1)):
+                continue
 
-    i = 0
-    while i < len(ast_objects):
-        o = ast_objects[i]
+        state.feed(parse_logical_line(logical_line))
 
-        if isinstance(o, IncludeDirective):
-            dependencies.add(IncludeDirective)
-        elif isinstance(o, DifferedIncludeDirective):
-            dependencies.add(resolve_include(o, macro_table))
-        elif isinstance(o, ObjectMacro):
-            macro_table[o.identifier] = o
-        elif isinstance(o, FunctionMacro):
-            macro_table[o.identifier] = o
-        elif isinstance(o, IfDirective):
-            if o.directive in {"if", "ifdef", "ifndef"}:
-                choice_result = evaluate_choice(ast_objects[i:], i)
+    return state.finish()
 
-                if type(choice_result) is tuple:
-                    choice_start, choice_end, jump = choice_result
-                    recurse_ast = ast_objects[choice_start:choice_end]
-                    dependencies.update(evaluate_ast(recurse_ast, macro_table))
-                    i = jump
-                else:
-                    i = choice_result
 
-                continue
+def evaluate_file(path: Union[str, Path], macro_table: Optional[MacroTable] = None, encoding: str = "utf-8",
+                  include: Optional[IncludeHook] = None) -> Set[IncludeDirective]:
+    """Evaluates the directives of the file at `path` with `evaluate_lines`."""
+    collector = stats.COLLECTOR
+    if collector is not None:
+        with collector.file(path):
+            return evaluate_lines(_spliced(iter_directive_lines(path, encoding), collector), macro_table, include)
 
-            raise Exception(f"#{o.directive} without #if")
-        else:
-            raise TypeError(o)
+    return evaluate_lines(iter_directive_lines(path, encoding), macro_table, include)
 
-        i += 1
 
-    return dependencies
+def _spliced(logical_lines: Iterator[LogicalLine], collector: stats.StatsCollector) -> Iterator[LogicalLine]:
+    # The file is read and sanitized as its lines are consumed, so each line is timed as splicing on its own
+    while True:
+        with collector.phase("splice"):
+            logical_line = next(logical_lines, None)
+        if logical_line is None:
+            return
+        yield logical_line
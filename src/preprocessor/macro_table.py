@@ -0,0 +1,198 @@
+"""
+A macro table that can be snapshotted and forked in constant time. The table is a chain of dict layers: writes go
+to the table's own layer, and a snapshot freezes that layer and starts a new one on top of it. Snapshots and forks
+share every layer below them, so exploring many branches of an include graph never copies the macro definitions.
+"""
+from typing import Dict, Iterator, Mapping, Optional, Tuple, Union
+from collections.abc import MutableMapping
+import itertools
+import sys
+from .parser import ObjectMacro, FunctionMacro
+
+
+Macro = Union[ObjectMacro, FunctionMacro]
+MacroDiff = Dict[str, Tuple[Optional[Macro], Optional[Macro]]]
+
+# Marks a name that was undefined in a layer above a layer that defines it
+_UNDEFINED = object()
+_MISSING = object()
+
+# Chains longer than this are flattened into a single layer when a snapshot is taken
+MAX_CHAIN_LENGTH = 32
+
+# Every change to any table takes the next generation, so tables with the same generation hold the same definitions
+_GENERATIONS = itertools.count(1)
+
+
+class MacroTable(MutableMapping):
+    """
+    A `dict`-like mapping of macro names to `ObjectMacro` and `FunctionMacro` definitions. Names are interned.
+
+    `snapshot` returns a read-only table holding the current definitions, and `fork` returns a new mutable table
+    starting from them. Both take constant time. `diff` finds the names that differ between two tables by looking
+    only at the layers they do not share.
+
+    `generation` changes whenever a definition does. It is copied by snapshots and forks, so two tables have the
+    same generation only if they hold the same definitions, and results computed from a table can be reused for as
+    long as its generation is unchanged.
+    """
+    __slots__ = ("_layer", "_parent", "_length", "_size", "_frozen", "_generation")
+
+    def __init__(self, definitions: Optional[Mapping[str, Macro]] = None):
+        self._layer: Dict[str, object] = {}
+        self._parent: Optional[MacroTable] = None
+        self._length = 1
+        self._size = 0
+        self._frozen = False
+        self._generation = 0
+
+        if definitions is not None:
+            self.update(definitions)
+
+    @classmethod
+    def _on_top_of(cls, parent: Optional["MacroTable"], layer: Dict[str, object], size: int,
+                   frozen: bool, generation: int) -> "MacroTable":
+        table = cls.__new__(cls)
+        table._layer = layer
+        table._parent = parent
+        table._length = 1 if parent is None else parent._length + 1
+        table._size = size
+        table._frozen = frozen
+        table._generation = generation
+        return table
+
+    def _lookup(self, name: str):
+        table = self
+        while table is not None:
+            value = table._layer.get(name, _MISSING)
+            if value is not _MISSING:
+                return value
+            table = table._parent
+
+        return _MISSING
+
+    def _check_mutable(self):
+        if self._frozen:
+            raise TypeError("A macro table snapshot cannot be modified")
+
+    def __getitem__(self, name: str) -> Macro:
+        value = self._lookup(name)
+        if value is _MISSING or value is _UNDEFINED:
+            raise KeyError(name)
+
+        return value
+
+    def __contains__(self, name) -> bool:
+        value = self._lookup(name)
+        return value is not _MISSING and value is not _UNDEFINED
+
+    def __setitem__(self, name: str, macro: Macro):
+        self._check_mutable()
+        if name not in self:
+            self._size += 1
+
+        self._layer[sys.intern(name)] = macro
+        self._generation = next(_GENERATIONS)
+
+    def __delitem__(self, name: str):
+        self._check_mutable()
+        if name not in self:
+            raise KeyError(name)
+
+        if self._parent is not None and name in self._parent:
+            self._layer[name] = _UNDEFINED
+        else:
+            del self._layer[name]
+        self._size -= 1
+        self._generation = next(_GENERATIONS)
+
+    def __iter__(self) -> Iterator[str]:
+        seen = set()
+        table = self
+        while table is not None:
+            for name, value in table._layer.items():
+                if name not in seen:
+                    seen.add(name)
+                    if value is not _UNDEFINED:
+                        yield name
+            table = table._parent
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __repr__(self):
+        return f"MacroTable({dict(self.items())})"
+
+    @property
+    def frozen(self) -> bool:
+        return self._frozen
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def _flatten(self) -> Dict[str, object]:
+        return {name: self[name] for name in self}
+
+    def snapshot(self) -> "MacroTable":
+        """Returns a read-only table with the current definitions. Later changes to this table do not affect it."""
+        if self._frozen:
+            return self
+        if not self._layer and self._parent is not None:
+            # Nothing changed since the last snapshot
+            return self._parent
+
+        if self._length > MAX_CHAIN_LENGTH:
+            snapshot = MacroTable._on_top_of(None, self._flatten(), self._size, True, self._generation)
+        else:
+            snapshot = MacroTable._on_top_of(self._parent, self._layer, self._size, True, self._generation)
+
+        self._layer = {}
+        self._parent = snapshot
+        self._length = snapshot._length + 1
+        return snapshot
+
+    def fork(self) -> "MacroTable":
+        """Returns a mutable copy of this table. Changes to either table are not seen by the other."""
+        return MacroTable._on_top_of(self.snapshot(), {}, self._size, False, self._generation)
+
+    copy = fork
+
+    def diff(self, other: Mapping[str, Macro]) -> MacroDiff:
+        """
+        Returns `{name: (definition in other, definition in self)}` for every name defined differently in the two
+        tables, using None for a name that is not defined. Definitions are compared by identity, so redefining a
+        macro with the same text counts as a change.
+        """
+        if not isinstance(other, MacroTable):
+            other = MacroTable(other)
+
+        # Layers shared by both chains hold the same definitions and are not looked at
+        other_chain = set()
+        table = other
+        while table is not None:
+            other_chain.add(id(table))
+            table = table._parent
+
+        names = set()
+        shared = None
+        table = self
+        while table is not None:
+            if id(table) in other_chain:
+                shared = table
+                break
+            names.update(table._layer)
+            table = table._parent
+
+        table = other
+        while table is not None and table is not shared:
+            names.update(table._layer)
+            table = table._parent
+
+        changes: MacroDiff = {}
+        for name in names:
+            old, new = other.get(name), self.get(name)
+            if old is not new:
+                changes[name] = (old, new)
+
+        return changes
@@ -0,0 +1,138 @@
+"""
+Parallel dependency scanning. Translation units are spread over a process pool in batches. Each worker process
+keeps one `TranslationUnitScanner` for its lifetime, so the headers and summaries it loads for one batch are
+reused by every later batch it handles.
+
+While a `stats.StatsCollector` is attached, each batch is scanned under a collector of its own, which is sent back
+with the results and merged into the attached one. A header that several workers load is counted once by each.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+import functools
+import os
+from . import stats
+from .cache import ASTCache
+from .include_resolver import IncludeResolver
+from .summary import SummaryCache
+from .translation_unit import ScanResult, TranslationUnitScanner, predefined_macros
+
+
+# Batches are filled up to this many bytes of translation unit source, so small files share one round trip
+DEFAULT_BATCH_BYTES = 256 * 1024
+# Aim for at least this many batches per worker, so uneven batches can still be balanced
+BATCHES_PER_WORKER = 4
+SOURCE_SUFFIXES = {".c", ".cc", ".cpp", ".cxx", ".c++", ".C"}
+
+
+class _Worker:
+    """The scanning state of one worker process."""
+
+    def __init__(self, include_dirs: Sequence[str], quote_dirs: Sequence[str], defines: Mapping[str, str],
+                 cache_dir: Optional[str], encoding: str):
+        ast_cache = ASTCache(cache_dir, encoding=encoding) if cache_dir is not None else None
+        self.scanner = TranslationUnitScanner(IncludeResolver(include_dirs, quote_dirs), ast_cache, encoding,
+                                              SummaryCache())
+        self.predefined = predefined_macros(defines).snapshot()
+
+    def scan(self, paths: Sequence[Path]) -> List[ScanResult]:
+        return [self.scanner.scan(path, self.predefined.fork()) for path in paths]
+
+
+_WORKER: Optional[_Worker] = None
+
+
+def _init_worker(*args):
+    global _WORKER
+    _WORKER = _Worker(*args)
+
+
+def _scan_batch(paths: Sequence[Path], collect: bool = False) -> Tuple[List[ScanResult], Optional[stats.StatsCollector]]:
+    if not collect:
+        return _WORKER.scan(paths), None
+
+    with stats.StatsCollector() as collector:
+        results = _WORKER.scan(paths)
+    return results, collector
+
+
+def batch_files(paths: Sequence[Path], workers: int, batch_bytes: int = DEFAULT_BATCH_BYTES) -> List[List[Path]]:
+    """
+    Splits `paths` into consecutive batches of roughly equal source size, keeping their order. A batch holds at
+    most `batch_bytes` bytes unless it is a single file, and there are enough batches to keep every worker busy.
+    """
+    sizes = []
+    for path in paths:
+        try:
+            sizes.append(os.stat(path).st_size)
+        except OSError:
+            # Reported by the worker that scans it
+            sizes.append(0)
+
+    target = max(1, min(batch_bytes, sum(sizes) // (workers * BATCHES_PER_WORKER)))
+
+    batches: List[List[Path]] = []
+    batch: List[Path] = []
+    batch_size = 0
+    for path, size in zip(paths, sizes):
+        batch.append(path)
+        batch_size += size
+        if batch_size >= target:
+            batches.append(batch)
+            batch, batch_size = [], 0
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def scan_parallel(paths: Iterable[Union[str, Path]],
+                  include_dirs: Iterable[Union[str, Path]] = (),
+                  quote_dirs: Iterable[Union[str, Path]] = (),
+                  defines: Optional[Mapping[str, str]] = None,
+                  workers: Optional[int] = None,
+                  cache_dir: Union[str, Path, None] = None,
+                  encoding: str = "utf-8",
+                  batch_bytes: int = DEFAULT_BATCH_BYTES) -> List[ScanResult]:
+    """
+    Scans the translation units at `paths` on a pool of `workers` processes and returns their `ScanResult`s,
+    sorted by path.
+
+    Parameters:
+        - `include_dirs`, `quote_dirs` The include directories, see `IncludeResolver`.
+        - `defines` Macros defined before every translation unit, as `{name: value}`.
+        - `workers` The number of processes. Defaults to the number of cores; with 1, everything runs in this process.
+        - `cache_dir` A directory for an `ASTCache` shared by all workers. No cache is used if it is None.
+        - `batch_bytes` The amount of source to send to a worker at once.
+    """
+    paths = sorted({Path(os.path.abspath(p)) for p in paths})
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    worker_args = ([str(d) for d in include_dirs], [str(d) for d in quote_dirs], dict(defines or {}),
+                   str(cache_dir) if cache_dir is not None else None, encoding)
+
+    if workers == 1 or len(paths) <= 1:
+        return _Worker(*worker_args).scan(paths)
+
+    batches = batch_files(paths, workers, batch_bytes)
+    parent_collector = stats.COLLECTOR
+    results: List[ScanResult] = []
+    with ProcessPoolExecutor(max_workers=min(workers, len(batches)), initializer=_init_worker,
+                             initargs=worker_args) as executor:
+        # `map` yields in submission order, which keeps the results sorted
+        for batch_results, collector in executor.map(functools.partial(_scan_batch, collect=parent_collector is not None),
+                                                     batches):
+            results.extend(batch_results)
+            if collector is not None:
+                parent_collector.merge(collector)
+
+    return results
+
+
+def scan_module(module, **kwargs) -> List[ScanResult]:
+    """
+    Scans the source files of a `crust.CrustModule` with `scan_parallel`. Headers in `module.files` are only
+    scanned as dependencies of the sources that include them.
+    """
+    return scan_parallel((p for p in module.files if Path(p).suffix in SOURCE_SUFFIXES), **kwargs)
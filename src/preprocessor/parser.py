@@ -1,7 +1,7 @@
 """
 Phase 1 of the parsing step. Organizes tokens into contectual objects by line.
 """
-from typing import Union, Iterable, Dict, List, Set, Iterator
+from typing import Union, Iterable, Dict, List, Optional, Set, Iterator, Tuple
 from itertools import takewhile
 from .tokenizer import TokenType, Token
 
@@ -19,6 +19,9 @@ def parse_identifier_list(tokens: Iterable[Token]) -> Iterable[Token]:
     cursor = 1
     rv = []
 
+    if peek_token(tokens, TokenType.RPAREN, 1):
+        return rv
+
     while cursor < len(tokens):
         rv.append(expect_token(tokens[cursor], TokenType.IDENTIFIER))
         n = expect_token(tokens[cursor + 1], {TokenType.COMMA, TokenType.RPAREN})
@@ -78,14 +81,19 @@ class IncludeDirective:
     def __eq__(self, o):
         return self.path == o.path and self.expanded == o.expanded
 
+    def __hash__(self):
+        return hash((self.path, self.expanded))
+
 
 class DifferedIncludeDirective:
+    """An include of the form `#include MACRO...`. `tokens` holds every token after `include`, for expansion."""
     @classmethod
     def from_tokens(cls, tokens: List[Token]):
-        return cls(expect_token(tokens[0], TokenType.IDENTIFIER).value.group())
+        return cls(expect_token(tokens[0], TokenType.IDENTIFIER).value.group(), tokens)
 
-    def __init__(self, identifier: str):
+    def __init__(self, identifier: str, tokens: Optional[List[Token]] = None):
         self.identifier = identifier
+        self.tokens = tokens
 
 
 class ObjectMacro:
@@ -101,6 +109,15 @@ class ObjectMacro:
         self.identifier = identifier
         self.tokens = tokens
 
+    @property
+    def spelling(self) -> Tuple[str, ...]:
+        """The text of every token in the replacement list. Computed once."""
+        try:
+            return self._spelling
+        except AttributeError:
+            self._spelling = tuple(t.value.group() for t in self.tokens)
+            return self._spelling
+
     def __repr__(self):
         return f"ObjectMacro(identifier={self.identifier}, tokens={self.tokens})"
 
@@ -113,7 +130,8 @@ class FunctionMacro:
     def from_tokens(cls, tokens: List[Token]):
         identifer = expect_token(tokens[0], TokenType.IDENTIFIER)
         params = parse_identifier_list(tokens[1:])
-        expression = tokens[2 + 2 * len(params):]
+        # The name, '(' and every parameter with the ',' or ')' after it. An empty list is just "()"
+        expression = tokens[2 + max(1, 2 * len(params)):]
 
         return cls(identifer.value.group(), tuple(t.value.group() for t in params), expression)
 
@@ -130,9 +148,10 @@ class FunctionMacro:
 
 
 class IfDirective:
-    def __init__(self, directive: str, expression: List[Token]):
+    def __init__(self, directive: str, expression: List[Token], line: int = -1):
         self.directive = directive
         self.expression = expression
+        self.line = line
 
     def __repr__(self):
         return f"IfDirective(directive={self.directive}, expression={self.expression})"
@@ -149,7 +168,42 @@ class PragmaDirective:
         return f"PragmaDirective(value={self.value})"
 
 
-ASTObject = Union[IncludeDirective, DifferedIncludeDirective, ObjectMacro, FunctionMacro, IfDirective, PragmaDirective]
+class UndefDirective:
+    @classmethod
+    def from_tokens(cls, tokens: List[Token]):
+        return cls(expect_token(tokens[0], TokenType.IDENTIFIER).value.group())
+
+    def __init__(self, identifier: str):
+        self.identifier = identifier
+
+    def __repr__(self):
+        return f"UndefDirective(identifier={self.identifier})"
+
+    def __eq__(self, o):
+        return self.identifier == o.identifier
+
+
+class DiagnosticDirective:
+    """An #error or #warning directive."""
+    def __init__(self, directive: str, message: List[Token]):
+        self.directive = directive
+        self.message = message
+
+    def __repr__(self):
+        return f"DiagnosticDirective(directive={self.directive}, message={self.message})"
+
+
+class NullDirective:
+    """A `#` on its own, which does nothing."""
+    def __repr__(self):
+        return "NullDirective()"
+
+    def __eq__(self, o):
+        return isinstance(o, NullDirective)
+
+
+ASTObject = Union[IncludeDirective, DifferedIncludeDirective, ObjectMacro, FunctionMacro, IfDirective, PragmaDirective,
+                  UndefDirective, DiagnosticDirective, NullDirective]
 
 
 def parse_line(tokens: List[Token]) -> ASTObject:
@@ -162,16 +216,125 @@ def parse_line(tokens: List[Token]) -> ASTObject:
         return IncludeDirective.from_tokens(tokens[1:])
 
     if directive_str == "define":
-        if tokens[2].type is TokenType.LPAREN:
+        # A macro is only function-like if the '(' immediately follows its name
+        if (len(tokens) > 2 and tokens[2].type is TokenType.LPAREN and
+           tokens[2].col == tokens[1].col + len(tokens[1].value.group())):
             return FunctionMacro.from_tokens(tokens[1:])
         return ObjectMacro.from_tokens(tokens[1:])
 
     if directive_str in {"if", "ifdef", "ifndef", "elif"}:
-        return IfDirective(directive_str, tokens[1:])
+        return IfDirective(directive_str, tokens[1:], directive.line)
     if directive_str in {"else", "endif"}:
-        return IfDirective(directive_str, 0)
+        return IfDirective(directive_str, 0, directive.line)
 
     if directive_str == "pragma":
         return PragmaDirective(tokens[1:])
+    if directive_str == "undef":
+        return UndefDirective.from_tokens(tokens[1:])
+    if directive_str in {"error", "warning"}:
+        return DiagnosticDirective(directive_str, tokens[1:])
+    if directive_str == "" and len(tokens) == 1:
+        return NullDirective()
 
-    raise NotImplementedError(f"Parsing directive {directive_str} is not yet implemented")
\ No newline at end of file
+    raise NotImplementedError(f"Parsing directive {directive_str} is not yet implemented")
+
+
+class ConditionalBlock:
+    """
+    The position of one #if/#ifdef/#ifndef ... #endif block in a list of AST objects. `branches` holds the index of
+    the opening directive and of every #elif and #else, and `end` holds the index of the #endif.
+    """
+    __slots__ = ("branches", "end")
+
+    def __init__(self, branches: List[int], end: int = -1):
+        self.branches = branches
+        self.end = end
+
+    def __repr__(self):
+        return f"ConditionalBlock(branches={self.branches}, end={self.end})"
+
+    def __eq__(self, o):
+        return self.branches == o.branches and self.end == o.end
+
+
+ConditionalIndex = Dict[int, ConditionalBlock]
+
+
+def build_conditional_index(objects: List[ASTObject]) -> ConditionalIndex:
+    """
+    Matches the conditional directives in `objects` in one stack based pass. The result maps the index of every
+    conditional directive to the `ConditionalBlock` it belongs to.
+    """
+    rv: ConditionalIndex = {}
+    stack: List[ConditionalBlock] = []
+
+    for i, o in enumerate(objects):
+        if not isinstance(o, IfDirective):
+            continue
+
+        if o.directive in {"if", "ifdef", "ifndef"}:
+            block = ConditionalBlock([i])
+            stack.append(block)
+        elif not stack:
+            raise Exception(f"#{o.directive} without #if")
+        elif o.directive == "endif":
+            block = stack.pop()
+            block.end = i
+        else:
+            block = stack[-1]
+            if objects[block.branches[-1]].directive == "else":
+                raise Exception(f"#{o.directive} after #else")
+            block.branches.append(i)
+
+        rv[i] = block
+
+    if stack:
+        raise Exception("Unterminated #if")
+
+    return rv
+
+
+def find_include_guard(objects: List[ASTObject], conditional_index: Optional[ConditionalIndex] = None) -> Optional[str]:
+    """
+    Returns the name of the guard macro if every directive in `objects` is inside one `#ifndef X` or
+    `#if !defined X` block without #elif or #else branches. Whether the file has anything but whitespace and
+    comments outside the block must be checked separately, see `scanner.is_blank_outside`.
+    """
+    if len(objects) < 2 or not isinstance(objects[0], IfDirective):
+        return None
+
+    if conditional_index is None:
+        conditional_index = build_conditional_index(objects)
+    block = conditional_index[0]
+    if block.end != len(objects) - 1 or len(block.branches) != 1:
+        return None
+
+    opening = objects[0]
+    spelling = [t.value.group() for t in opening.expression]
+    if opening.directive == "ifndef" and len(spelling) == 1:
+        return spelling[0]
+    if opening.directive == "if" and len(spelling) == 3 and spelling[:2] == ["!", "defined"]:
+        return spelling[2]
+    if opening.directive == "if" and len(spelling) == 5 and spelling[:3] == ["!", "defined", "("] and spelling[4] == ")":
+        return spelling[3]
+
+    return None
+
+
+def has_pragma_once(objects: List[ASTObject], guarded: bool = False) -> bool:
+    """
+    Checks for a `#pragma once` that is not inside a conditional block, or directly inside the include guard if
+    `guarded` is set. A `#pragma once` that depends on a condition is ignored.
+    """
+    depth = 0
+    for o in objects:
+        if isinstance(o, IfDirective):
+            if o.directive in {"if", "ifdef", "ifndef"}:
+                depth += 1
+            elif o.directive == "endif":
+                depth -= 1
+        elif (isinstance(o, PragmaDirective) and depth <= int(guarded) and len(o.value) > 0 and
+              o.value[0].value.group() == "once"):
+            return True
+
+    return False
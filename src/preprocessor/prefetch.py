@@ -0,0 +1,132 @@
+"""
+Read-ahead for scanning. A `PrefetchReader` reads files on a small thread pool while the scanner is busy parsing,
+so on slow or cold file systems the parser does not wait on each read in turn. `scan_prefetched` and `scan_async`
+scan translation units with one.
+"""
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Deque, Dict, Iterable, List, Mapping, Optional, Set, Tuple, Union
+import asyncio
+import functools
+import os
+from .cache import ASTCache, read_file
+from .include_resolver import IncludeResolver
+from .summary import SummaryCache
+from .translation_unit import ScanResult, TranslationUnitScanner, predefined_macros
+
+
+class PrefetchReader:
+    """
+    Reads files ahead of time on `threads` threads. At most `window` files are being read or held waiting to be
+    consumed at once; the rest of the requested files wait in a queue. A file that is read before its prefetch
+    has finished waits for it, and one that was never prefetched is read directly.
+
+    The reader is meant to be used from one thread, and should be closed when done.
+    """
+
+    def __init__(self, window: int = 32, threads: int = 8):
+        self.window = window
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="crust-prefetch")
+        self._pending: Dict[Path, Future] = {}
+        self._queue: Deque[Path] = deque()
+        self._queued: Set[Path] = set()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _fill(self):
+        while self._queue and len(self._pending) < self.window:
+            path = self._queue.popleft()
+            self._queued.discard(path)
+            self._pending[path] = self._executor.submit(read_file, path)
+
+    def prefetch(self, paths: Iterable[Union[str, Path]]):
+        """Queues `paths` to be read in the background, in order."""
+        for path in paths:
+            path = Path(path)
+            if path not in self._pending and path not in self._queued:
+                self._queue.append(path)
+                self._queued.add(path)
+
+        self._fill()
+
+    def read(self, path: Union[str, Path]) -> bytes:
+        """Returns the contents of the file at `path`, using the prefetched contents if there are any."""
+        return self.read_stat(path)[1]
+
+    def read_stat(self, path: Union[str, Path]) -> Tuple[os.stat_result, bytes]:
+        """Like `read`, but also returns the stat of the file, taken before it was read as with `read_file`."""
+        path = Path(path)
+        future = self._pending.pop(path, None)
+
+        if future is not None:
+            self.hits += 1
+            try:
+                return future.result()
+            finally:
+                self._fill()
+
+        self.discard(path)
+        self.misses += 1
+        return read_file(path)
+
+    def discard(self, path: Union[str, Path]):
+        """Drops the prefetched contents of `path`, if any, to make room for other files."""
+        path = Path(path)
+        future = self._pending.pop(path, None)
+        if future is not None:
+            future.cancel()
+        elif path in self._queued:
+            self._queued.discard(path)
+            self._queue.remove(path)
+        self._fill()
+
+    def close(self):
+        """Stops reading. Files that are being read are finished, but their contents are dropped."""
+        self._queue.clear()
+        self._queued.clear()
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def scan_prefetched(paths: Iterable[Union[str, Path]],
+                    include_dirs: Iterable[Union[str, Path]] = (),
+                    quote_dirs: Iterable[Union[str, Path]] = (),
+                    defines: Optional[Mapping[str, str]] = None,
+                    cache_dir: Union[str, Path, None] = None,
+                    encoding: str = "utf-8",
+                    window: int = 32,
+                    threads: int = 8) -> List[ScanResult]:
+    """
+    Scans the translation units at `paths` in this process, sorted by path, while a `PrefetchReader` reads the
+    translation units and the headers they include ahead of the parser. `paths` can come straight from
+    `normalize_path`. See `parallel.scan_parallel` for the other parameters.
+    """
+    paths = sorted({Path(os.path.abspath(p)) for p in paths})
+    ast_cache = ASTCache(cache_dir, encoding=encoding) if cache_dir is not None else None
+    predefined = predefined_macros(defines or {}).snapshot()
+
+    with PrefetchReader(window, threads) as reader:
+        scanner = TranslationUnitScanner(IncludeResolver(include_dirs, quote_dirs), ast_cache, encoding, SummaryCache(),
+                                         reader)
+        reader.prefetch(paths)
+        return [scanner.scan(path, predefined.fork()) for path in paths]
+
+
+async def scan_async(paths: Iterable[Union[str, Path]], executor: Optional[Executor] = None,
+                     **kwargs) -> List[ScanResult]:
+    """
+    Awaitable version of `scan_prefetched`. The scan runs on `executor`, the event loop's default executor if it is
+    None, so the event loop stays responsive. Pass a `ProcessPoolExecutor` to keep the scan off this process.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(scan_prefetched, list(paths), **kwargs))
@@ -0,0 +1,157 @@
+"""
+Directive-only scanning. Finds the logical lines that hold preprocessor directives with a `Sanitizer` in
+directives only mode, so that the bodies of C files are never tokenized or parsed.
+"""
+from typing import Iterable, Iterator, List, Union
+from pathlib import Path
+import mmap
+from .string_santization import LogicalLine, Sanitizer
+from .tokenizer import TokenType, tokenize_line
+from .parser import ASTObject, parse_line
+from .token_stream import TokenStream
+from . import stats
+
+
+def parse_logical_line(logical_line: LogicalLine) -> ASTObject:
+    """Tokenizes and parses a single directive line."""
+    collector = stats.COLLECTOR
+    if collector is not None:
+        return _parse_logical_line_collected(logical_line, collector)
+
+    tokens = tokenize_line(str(logical_line), logical_line.segments[0][0])
+    return parse_line([t for t in tokens if t.type is not TokenType.WHITESPACE])
+
+
+def _parse_logical_line_collected(logical_line: LogicalLine, collector: stats.StatsCollector) -> ASTObject:
+    with collector.phase("tokenize"):
+        tokens = [t for t in tokenize_line(str(logical_line), logical_line.segments[0][0])
+                  if t.type is not TokenType.WHITESPACE]
+    with collector.phase("parse"):
+        o = parse_line(tokens)
+
+    collector.count("logical_lines")
+    collector.count("tokens", len(tokens))
+    collector.count("directives")
+    return o
+
+
+def scan_directives(file_text: str) -> Iterator[ASTObject]:
+    """
+    Parses only the directive lines of `file_text`. Trigraphs, line splices and comments are handled by a
+    `Sanitizer` in directives only mode, so lines that are not directives never become tokens.
+    """
+    for logical_line in Sanitizer.sanitize(file_text, directives_only=True):
+        yield parse_logical_line(logical_line)
+
+
+def scan_directives_compact(file_text: str) -> List[ASTObject]:
+    """
+    Like `scan_directives`, but all directive lines are tokenized into one `TokenStream`. The returned objects
+    hold lazy token views instead of `Token` objects, which keeps them small when many files are held at once.
+    """
+    return _parse_compact(Sanitizer.sanitize(file_text, directives_only=True))
+
+
+def _parse_compact(logical_lines: Iterable[LogicalLine]) -> List[ASTObject]:
+    collector = stats.COLLECTOR
+    if collector is not None:
+        return _parse_compact_collected(logical_lines, collector)
+
+    stream = TokenStream.from_lines((line.segments[0][0], str(line)) for line in logical_lines)
+    return [parse_line(row) for row in stream.iter_rows()]
+
+
+def _parse_compact_collected(logical_lines: Iterable[LogicalLine], collector: stats.StatsCollector) -> List[ASTObject]:
+    # Reading a file and sanitizing it happen as its lines are consumed, so both count as splicing
+    with collector.phase("splice"):
+        logical_lines = list(logical_lines)
+    with collector.phase("tokenize"):
+        stream = TokenStream.from_lines((line.segments[0][0], str(line)) for line in logical_lines)
+    with collector.phase("parse"):
+        ast = [parse_line(row) for row in stream.iter_rows()]
+
+    collector.count("logical_lines", len(logical_lines))
+    collector.count("tokens", len(stream.types))
+    collector.count("directives", len(ast))
+    return ast
+
+
+def iter_directive_lines(path: Union[str, Path], encoding: str = "utf-8") -> Iterator[LogicalLine]:
+    """
+    Yields the sanitized directive lines of the file at `path`. The file is memory mapped and only the directive
+    lines are copied and decoded, so the file is never held in memory as a whole.
+    """
+    with open(path, "rb") as f:
+        try:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            return
+
+        with mapping:
+            yield from Sanitizer.sanitize(mapping, directives_only=True, encoding=encoding)
+
+
+def scan_file(path: Union[str, Path], encoding: str = "utf-8") -> Iterator[ASTObject]:
+    """Parses the directives of the file at `path`, see `iter_directive_lines`."""
+    for logical_line in iter_directive_lines(path, encoding):
+        yield parse_logical_line(logical_line)
+
+
+def scan_file_compact(path: Union[str, Path], encoding: str = "utf-8") -> List[ASTObject]:
+    """Like `scan_file`, but the directives share one `TokenStream`, as in `scan_directives_compact`."""
+    return _parse_compact(iter_directive_lines(path, encoding))
+
+
+def scan_buffer_compact(buffer: bytes, encoding: str = "utf-8") -> List[ASTObject]:
+    """Like `scan_file_compact`, for the contents of a file that was already read."""
+    return _parse_compact(Sanitizer.sanitize(buffer, directives_only=True, encoding=encoding))
+
+
+def is_blank_outside(path: Union[str, Path], first_line: int, last_line: int, encoding: str = "utf-8") -> bool:
+    """
+    Checks that the physical lines of the file at `path` before `first_line` and after `last_line` hold nothing
+    but whitespace and comments. Used to confirm that an include guard covers the whole file.
+    """
+    with open(path, encoding=encoding) as f:
+        return lines_blank_outside(f, first_line, last_line)
+
+
+def lines_blank_outside(lines: Iterable[str], first_line: int, last_line: int) -> bool:
+    """Like `is_blank_outside`, for the physical lines of a file that was already read."""
+    head: List[str] = []
+    tail: List[str] = []
+    for i, line in enumerate(lines):
+        if i < first_line:
+            head.append(line)
+        elif i > last_line:
+            tail.append(line)
+
+    return all(not str(logical_line).strip()
+               for text in (head, tail) for logical_line in Sanitizer.sanitize("".join(text)))
+
+
+def parse_stream(lines: Iterable[str]) -> Iterator[ASTObject]:
+    """
+    Lazily parses the directives in a stream of physical lines, such as an open text file. Only the logical
+    line being sanitized is held in memory, and lines that are not directives are never tokenized.
+    """
+    sanitizer = Sanitizer(directives_only=True)
+
+    for line in lines:
+        if not line.endswith("\n"):
+            line += "\n"
+        for logical_line in sanitizer.feed(line):
+            yield parse_logical_line(logical_line)
+
+    for logical_line in sanitizer.finish():
+        yield parse_logical_line(logical_line)
+
+
+def parse_file(path: Union[str, Path], encoding: str = "utf-8") -> Iterator[ASTObject]:
+    """
+    Lazily parses the directives of the file at `path`, reading it line by line. The result can be passed
+    straight to `interpreter.evaluate_ast`.
+    """
+    with open(path, encoding=encoding) as f:
+        yield from parse_stream(f)
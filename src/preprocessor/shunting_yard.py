@@ -1,31 +1,65 @@
 from typing import Set, Dict, Iterable
 from .tokenizer import TokenType, Token, VALUE_TYPES, OPERATOR_TYPES
 
+# The precidence of C operators, of which the preprocessor has every one but assignments, increments, sizeof and casts
 DEFAULT_PRECIDENCE_MAP = {
     TokenType.OP_DEFINED: 100,
     TokenType.OP_NOT: 100,
+    TokenType.OP_BIT_NOT: 100,
+    TokenType.OP_UNARY_PLUS: 100,
+    TokenType.OP_UNARY_MINUS: 100,
+    TokenType.OP_MUL: 97,
+    TokenType.OP_DIV: 97,
+    TokenType.OP_MOD: 97,
+    TokenType.OP_ADD: 96,
+    TokenType.OP_SUB: 96,
+    TokenType.OP_LSHIFT: 95,
+    TokenType.OP_RSHIFT: 95,
     TokenType.OP_GTE: 90,
     TokenType.OP_LTE: 90,
     TokenType.OP_LT: 90,
     TokenType.OP_GT: 90,
     TokenType.OP_EQ: 80,
     TokenType.OP_NEQ: 80,
-    TokenType.AND: 50,
-    TokenType.OR: 40
+    TokenType.OP_BIT_AND: 70,
+    TokenType.OP_BIT_XOR: 65,
+    TokenType.OP_BIT_OR: 60,
+    TokenType.OP_AND: 50,
+    TokenType.OP_OR: 40,
+    TokenType.OP_TERNARY: 30,
+    TokenType.OP_COLON: 30,
 }
 
 
-DEFAULT_RTL_SET = {TokenType.OP_NOT, TokenType.OP_DEFINED}
+DEFAULT_RTL_SET = {TokenType.OP_NOT, TokenType.OP_DEFINED, TokenType.OP_BIT_NOT, TokenType.OP_UNARY_PLUS,
+                   TokenType.OP_UNARY_MINUS}
+
+# The unary form of operators that are binary when they follow an operand
+DEFAULT_UNARY_MAP = {TokenType.OP_ADD: TokenType.OP_UNARY_PLUS, TokenType.OP_SUB: TokenType.OP_UNARY_MINUS}
+
+
+class PreprocessorSyntaxError(Exception):
+    def __init__(self, line: int, col: int, message: str):
+        super().__init__(f"{line}, {col}: {message}")
+        self.line = line
+        self.col = col
 
 
 class ShuntingYard():
+    """
+    Converts an expression to RPN. The conditional operator `a ? b : c` is output as `a b c :`, where the `:` takes
+    three operands.
+    """
     def __init__(self, precidence_map: Dict[TokenType, int] = DEFAULT_PRECIDENCE_MAP,
                  rtl_set: Set[TokenType] = DEFAULT_RTL_SET, value_token_set: Set[TokenType] = VALUE_TYPES,
-                 operator_token_set: Set[TokenType] = OPERATOR_TYPES):
+                 operator_token_set: Set[TokenType] = OPERATOR_TYPES,
+                 unary_map: Dict[TokenType, TokenType] = DEFAULT_UNARY_MAP):
         self.precidence = precidence_map
         self.rtl_set = rtl_set
         self.value_tokens = value_token_set
         self.op_tokens = operator_token_set
+        self.binary_op_tokens = operator_token_set - rtl_set
+        self.unary_map = unary_map
 
         self.operator_stack = []
         self.output_stack = []
@@ -52,23 +86,36 @@ class ShuntingYard():
         """
         while self.operator_stack:
             op_peek = self.operator_stack[-1]
-            op_comp = self._compare_operators(op_peek.token_type, op_tok.token_type)
+            op_comp = self._compare_operators(op_peek.type, op_tok.type)
 
-            if op_peek.token_type is not TokenType.LPARAN and (
-               op_peek.token_type in self.rtl_set or op_comp == 1):
+            # Every binary operator but `?` is left associative, so operators of equal precidence are output first
+            if op_peek.type is not TokenType.LPAREN and (
+               op_peek.type in self.rtl_set or op_comp > 0 or (op_comp == 0 and op_tok.type is not TokenType.OP_TERNARY)):
                 self.output_stack.append(self.operator_stack.pop())
             else:
                 break
 
         self.operator_stack.append(op_tok)
 
+    def _push_colon(self, colon_tok: Token):
+        """
+        Outputs the operators of the middle operand of a conditional, then replaces its `?` with the `:`, which is
+        output once the last operand is.
+        """
+        while self.operator_stack and self.operator_stack[-1].type not in {TokenType.OP_TERNARY, TokenType.LPAREN}:
+            self.output_stack.append(self.operator_stack.pop())
+
+        if not self.operator_stack or self.operator_stack[-1].type is not TokenType.OP_TERNARY:
+            raise PreprocessorSyntaxError(colon_tok.line, colon_tok.col, "Unexpected ':' without a '?'")
+        self.operator_stack[-1] = colon_tok
+
     def _push_parenthesis(self, paran_tok: Token):
-        if paran_tok.token_type is TokenType.LPAREN:
+        if paran_tok.type is TokenType.LPAREN:
             self.operator_stack.append(paran_tok)
-        elif paran_tok.token_type is TokenType.RPAREN:
+        elif paran_tok.type is TokenType.RPAREN:
             try:
-                while self.operator_stack[-1].token_type is not TokenType.LPAREN:
-                    self.output_stack.append(self.operator_stack.pop())
+                while self.operator_stack[-1].type is not TokenType.LPAREN:
+                    self._output_operator(self.operator_stack.pop())
 
                 # Discard the extra LPARAN
                 self.operator_stack.pop()
@@ -76,14 +123,19 @@ class ShuntingYard():
                 # Stack ran out without finding an LPARAN, we have mismatched parenthesis
                 raise PreprocessorSyntaxError(paran_tok.line, paran_tok.col, "Unexpected ')'.")
 
+    def _output_operator(self, operator: Token):
+        if operator.type is TokenType.OP_TERNARY:
+            raise PreprocessorSyntaxError(operator.line, operator.col, "Expected ':' after '?'")
+        self.output_stack.append(operator)
+
     def _push_operator_stack(self):
         """
         Pushes the remainder of the operator stack onto the output stack
         """
         for operator in reversed(self.operator_stack):
-            if operator.token_type in {TokenType.LPAREN, TokenType.RPAREN}:
+            if operator.type in {TokenType.LPAREN, TokenType.RPAREN}:
                 raise PreprocessorSyntaxError(operator.line, operator.col, "Unexpected paranthesis")
-            self.output_stack.append(operator)
+            self._output_operator(operator)
 
     def feed(self, tokens: Iterable[Token]):
         """
@@ -91,17 +143,25 @@ class ShuntingYard():
         `tokens` should be a be a list of that tokens that only make up the conditional expression
         """
 
-        while tokens:
-            tok = tokens.pop(0)
+        # Whether the previous token ended an operand, which makes a following `+` or `-` binary
+        after_operand = False
+        for tok in tokens:
+            if not after_operand and tok.type in self.unary_map:
+                tok = Token(self.unary_map[tok.type], tok.value, tok.col, tok.line)
 
-            if tok.token_type in self.value_tokens:
+            if tok.type in self.value_tokens:
                 self.output_stack.append(tok)
-            elif tok.token_type in self.rtl_set:
+            elif tok.type in self.rtl_set:
                 self.operator_stack.append(tok)
-            elif tok.token_type in (self.op_tokens - self.rtl_set):
+            elif tok.type is TokenType.OP_COLON:
+                self._push_colon(tok)
+            elif tok.type in self.binary_op_tokens:
                 self._push_operator(tok)
-            elif tok.token_type in {TokenType.LPAREN, TokenType.RPAREN}:
+            elif tok.type in {TokenType.LPAREN, TokenType.RPAREN}:
                 self._push_parenthesis(tok)
+            else:
+                raise PreprocessorSyntaxError(tok.line, tok.col, f"Unexpected '{tok.value.group()}' in expression")
+            after_operand = tok.type in self.value_tokens or tok.type is TokenType.RPAREN
 
         # Push all remaining operators on output stack. Note that list.extends is not used to check for mismatched parenthesis
         self._push_operator_stack()
@@ -0,0 +1,202 @@
+"""
+Per-phase instrumentation. While a `StatsCollector` is attached, the scanner, parser and interpreter report the
+time they spend splicing, tokenizing, parsing and evaluating each file, and count the logical lines, tokens,
+directives, evaluated conditionals and macro lookups. While none is attached, instrumented code only checks that
+`COLLECTOR` is None.
+
+    with StatsCollector() as stats:
+        scanner.scan("main.c")
+    print(stats.to_json())
+
+Phase times are exclusive: the time spent on a header included while evaluating a file is charged to the header,
+not to the file that includes it. The workers of `parallel.scan_parallel` collect their own stats, which are merged
+into the attached collector, so the seconds of a parallel scan add up the time of every worker.
+"""
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Optional
+import json
+import time
+
+
+PHASES = ("splice", "tokenize", "parse", "evaluate")
+COUNTERS = ("logical_lines", "tokens", "directives", "conditionals", "macro_lookups")
+
+# Work that is not done on behalf of a known file is charged to this name
+UNKNOWN_FILE = "<unknown>"
+
+# The attached collector, if any
+COLLECTOR: Optional["StatsCollector"] = None
+
+
+class FileStats:
+    """The seconds spent in each phase and the counters of one file, or of several files added together."""
+    __slots__ = ("seconds", "counts")
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self.counts: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(self.seconds.values())
+
+    def add(self, other: "FileStats"):
+        for phase, seconds in other.seconds.items():
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        for counter, count in other.counts.items():
+            self.counts[counter] = self.counts.get(counter, 0) + count
+
+    def to_dict(self) -> dict:
+        return {"seconds": dict(self.seconds), "total_seconds": self.total_seconds, "counts": dict(self.counts)}
+
+
+class _Phase:
+    """Times one phase of the current file, leaving out the time of the phases nested in it."""
+    __slots__ = ("collector", "name", "start", "nested")
+
+    def __init__(self, collector: "StatsCollector", name: str):
+        self.collector = collector
+        self.name = name
+
+    def __enter__(self):
+        self.nested = 0.0
+        self.collector._phases.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        phases = self.collector._phases
+        phases.pop()
+        if phases:
+            phases[-1].nested += elapsed
+
+        seconds = self.collector.current.seconds
+        seconds[self.name] = seconds.get(self.name, 0.0) + elapsed - self.nested
+
+
+class _File:
+    __slots__ = ("collector", "path")
+
+    def __init__(self, collector: "StatsCollector", path: str):
+        self.collector = collector
+        self.path = path
+
+    def __enter__(self):
+        self.collector._files.append(self.path)
+
+    def __exit__(self, *exc_info):
+        self.collector._files.pop()
+
+
+class StatsCollector:
+    """
+    Collects the `FileStats` of every file that is worked on while the collector is attached, keyed by path.
+    Attach it with a `with` block; collectors can be nested, in which case the innermost one collects.
+    """
+
+    def __init__(self):
+        self.files: Dict[str, FileStats] = {}
+        self._files: List[str] = []
+        self._phases: List[_Phase] = []
+        self._previous: List[Optional[StatsCollector]] = []
+
+    def __enter__(self) -> "StatsCollector":
+        global COLLECTOR
+        self._previous.append(COLLECTOR)
+        COLLECTOR = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global COLLECTOR
+        COLLECTOR = self._previous.pop()
+
+    @property
+    def current(self) -> FileStats:
+        """The stats of the file that is being worked on."""
+        path = self._files[-1] if self._files else UNKNOWN_FILE
+        stats = self.files.get(path)
+        if stats is None:
+            stats = self.files[path] = FileStats()
+        return stats
+
+    def file(self, path) -> _File:
+        """Returns a context manager that charges the work done inside it to the file at `path`."""
+        return _File(self, str(path))
+
+    def phase(self, name: str) -> _Phase:
+        """Returns a context manager that charges the time spent inside it to phase `name` of the current file."""
+        return _Phase(self, name)
+
+    def count(self, counter: str, n: int = 1):
+        counts = self.current.counts
+        counts[counter] = counts.get(counter, 0) + n
+
+    def wrap(self, macro_table: MutableMapping) -> MutableMapping:
+        """Returns a view of `macro_table` that counts every lookup as a macro lookup of the current file."""
+        if isinstance(macro_table, _CountingTable):
+            return macro_table
+        return _CountingTable(macro_table, self)
+
+    def total(self) -> FileStats:
+        """The stats of every file added together."""
+        total = FileStats()
+        for stats in self.files.values():
+            total.add(stats)
+        return total
+
+    def merge(self, other: "StatsCollector"):
+        """Adds the stats of `other`, for example one filled in by a worker process, to this collector."""
+        for path, stats in other.files.items():
+            self.files.setdefault(path, FileStats()).add(stats)
+
+    def clear(self):
+        self.files.clear()
+
+    def to_dict(self) -> dict:
+        return {"files": {path: stats.to_dict() for path, stats in sorted(self.files.items())},
+                "total": self.total().to_dict()}
+
+    def to_json(self, **kwargs) -> str:
+        """Exports `to_dict` as JSON. `kwargs` are passed to `json.dumps`."""
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+class _CountingTable(MutableMapping):
+    """Passes everything through to a macro table, counting the lookups."""
+
+    def __init__(self, macro_table: MutableMapping, collector: StatsCollector):
+        self.macro_table = macro_table
+        self.collector = collector
+
+    @property
+    def generation(self) -> Optional[int]:
+        # Keeps the memoized expansions of `MacroExpander` usable through the view
+        return getattr(self.macro_table, "generation", None)
+
+    def get(self, name: str, default=None):
+        self.collector.count("macro_lookups")
+        return self.macro_table.get(name, default)
+
+    def __getitem__(self, name: str):
+        self.collector.count("macro_lookups")
+        return self.macro_table[name]
+
+    def __contains__(self, name) -> bool:
+        self.collector.count("macro_lookups")
+        return name in self.macro_table
+
+    def __setitem__(self, name: str, macro):
+        self.macro_table[name] = macro
+
+    def __delitem__(self, name: str):
+        del self.macro_table[name]
+
+    def pop(self, name: str, *default):
+        return self.macro_table.pop(name, *default)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.macro_table)
+
+    def __len__(self) -> int:
+        return len(self.macro_table)
@@ -1,9 +1,12 @@
 """
-Implementation for phase 1 and 2 of the C preprocessor. It replaces escape sequences, trigraphs,
-and converts physical source lines to logical ones. Note that tokenization has not begun.
+Implementation for phases 1 to 3 of the C preprocessor. It replaces trigraphs, converts physical source
+lines to logical ones and replaces comments. `LogicalLine.splice_lines` only splices; `Sanitizer` performs
+all three phases in a single sweep. Note that tokenization has not begun.
 """
-from typing import List, Tuple
+from typing import List, Tuple, Optional, Iterable, Iterator
 from itertools import accumulate
+from bisect import bisect_right
+import re
 
 
 class LogicalLine:
@@ -13,21 +16,35 @@ class LogicalLine:
 
     @classmethod
     def splice_lines(cls, file_text: str) -> List["LogicalLine"]:
-        lines = file_text.splitlines()
-        rv: List["LogicalLine"] = []
+        return list(cls.splice_stream(file_text.splitlines()))
+
+    @classmethod
+    def splice_stream(cls, lines: Iterable[str]) -> Iterator["LogicalLine"]:
+        """
+        Lazily splices physical lines into logical lines. `lines` may still end with their line endings,
+        so a text file object can be passed directly.
+        """
         current_segments: List[Tuple[int, str]] = []
+        current_columns: List[int] = []
 
         for physical_line_index, value in enumerate(lines):
+            value = value.rstrip("\r\n")
             current_segments.append((physical_line_index, value.strip("\\")))
+            current_columns.append(len(value) - len(value.lstrip("\\")))
 
             if not value.endswith("\\"):
-                rv.append(cls(current_segments))
+                yield cls(current_segments, current_columns)
                 current_segments = []
+                current_columns = []
 
-        return rv
-
-    def __init__(self, segments: List[Tuple[int, str]]):
+    def __init__(self, segments: List[Tuple[int, str]], columns: Optional[List[int]] = None):
+        """
+        Parameters:
+            - `segments` The physical line index and text of every segment
+            - `columns` The physical column each segment starts at. Defaults to 0 for every segment.
+        """
         self.segments = segments
+        self.columns = columns if columns is not None else [0] * len(segments)
         self._acc_lengths: List[int] = list(accumulate((len(x[1]) for x in self.segments)))
 
     def __len__(self):
@@ -38,16 +55,28 @@ class LogicalLine:
 
     def __getitem__(self, index):
         if type(index) == int:
+            if index < 0:
+                index += len(self)
             seg_index = self._map_string_index_to_segment_index(index)
-            segment = self.segments[seg_index]
-            length = self._acc_lengths[seg_index]
-            return segment[1][index - length]
+            return self.segments[seg_index][1][index - self._segment_start(seg_index)]
 
-        segment_start, segment_end, segments = self._map_string_range_to_segments(index)
-        segment_str = "".join(x[1] for x in segments)
+        start, stop, step = slice(index.start, index.stop, index.step).indices(len(self))
+        if step != 1:
+            return str(self)[start:stop:step]
+        if start >= stop:
+            return ""
 
-        index_correction = self._acc_lengths[segment_start - 1] if segment_start > 0 else 0
-        return segment_str[index.start - index_correction:index.stop - index_correction:index.step]
+        first = self._map_string_index_to_segment_index(start)
+        last = self._map_string_index_to_segment_index(stop - 1)
+        first_start = self._segment_start(first)
+
+        if first == last:
+            return self.segments[first][1][start - first_start:stop - first_start]
+
+        pieces = [self.segments[first][1][start - first_start:]]
+        pieces.extend(x[1] for x in self.segments[first + 1:last])
+        pieces.append(self.segments[last][1][:stop - self._segment_start(last)])
+        return "".join(pieces)
 
     def __eq__(self, other) -> bool:
         if len(self.segments) != len(other.segments):
@@ -59,15 +88,240 @@ class LogicalLine:
 
         return True
 
+    def __repr__(self):
+        return f"LogicalLine(segments={self.segments})"
+
+    def map_to_physical(self, index: int) -> Tuple[int, int]:
+        """Maps a column of the logical line to a (physical line index, physical column) pair."""
+        if index < 0:
+            index += len(self)
+
+        seg_index = self._map_string_index_to_segment_index(index)
+        return (self.segments[seg_index][0], self.columns[seg_index] + index - self._segment_start(seg_index))
+
+    def _segment_start(self, seg_index: int) -> int:
+        return self._acc_lengths[seg_index - 1] if seg_index > 0 else 0
+
     def _map_string_index_to_segment_index(self, string_index: int):
-        if string_index >= len(self):
-            raise IndexError(f"Index {string_index} is larger than length {len(self)}")
+        if not 0 <= string_index < len(self):
+            raise IndexError(f"Index {string_index} is out of range for length {len(self)}")
+
+        return bisect_right(self._acc_lengths, string_index)
+
+
+# Largest slice copied out of a buffer at once when counting in a buffer without a `count` method
+_COUNT_CHUNK_SIZE = 1 << 20
+
+
+def count_in_buffer(buffer, sub, start: int, end: int) -> int:
+    """`buffer.count(sub, start, end)` that also works for `mmap` objects, which lack `count`."""
+    try:
+        return buffer.count(sub, start, end)
+    except AttributeError:
+        return sum(buffer[i:min(i + _COUNT_CHUNK_SIZE, end)].count(sub) for i in range(start, end, _COUNT_CHUNK_SIZE))
+
+
+TRIGRAPHS = {"=": "#", "/": "\\", "'": "^", "(": "[", ")": "]", "!": "|", "<": "{", ">": "}", "-": "~"}
+
+_SPLICE = r"(?P<splice>(?:\\|\?\?/)\r?\n)"
+_NEWLINE = r"(?P<newline>\r?\n)"
+# A '#' that is only preceded by whitespace and comments on its physical line
+_DIRECTIVE = r"(?m:(?P<directive>^[ \t]*(?:/\*(?:[^*\n]|\*(?!/))*\*/[ \t]*)*(?:#|\?\?=)))"
+_TRIGRAPH = r"(?P<trigraph>\?\?[=/'()!<>-])"
+_SANITIZER_PATTERNS = {
+    # Text that is part of a logical line
+    "normal": "|".join((_SPLICE, _NEWLINE, _TRIGRAPH, r"(?P<block>/\*)", r"(?P<line>//)", r"(?P<quote>[\"'])")),
+    # Text between lines that are not directives, when only directives are wanted. Only block comments and
+    # splices can hide, extend or start a directive line, so the search is for those and for directives.
+    "skip": "|".join((_DIRECTIVE, _SPLICE, r"(?P<block>/\*)")),
+    "line_comment": "|".join((_SPLICE, _NEWLINE)),
+    "string\"": "|".join((_SPLICE, _NEWLINE, r"(?P<escape>(?:\\|\?\?/)[^\r\n])", _TRIGRAPH, r"(?P<quote>\")")),
+    "string'": "|".join((_SPLICE, _NEWLINE, r"(?P<escape>(?:\\|\?\?/)[^\r\n])", _TRIGRAPH, r"(?P<quote>')")),
+}
+_STR_PATTERNS = {name: re.compile(pattern) for name, pattern in _SANITIZER_PATTERNS.items()}
+_BYTES_PATTERNS = {name: re.compile(pattern.encode()) for name, pattern in _SANITIZER_PATTERNS.items()}
+
+
+class Sanitizer:
+    """
+    Performs phases 1 to 3 in a single sweep: trigraphs are replaced, lines are spliced and comments are
+    replaced by a single space. String and character literals are respected. Text is fed in chunks of whole
+    physical lines (or a whole buffer at once) and completed `LogicalLine`s are returned as they are found.
+
+    Every segment of the resulting logical lines is a run of text that maps to one physical line and column,
+    so `LogicalLine.map_to_physical` stays exact even after replacements. With `directives_only` set, only the
+    lines that are directives are returned. Other lines are searched for `#`, comments and splices, and are never
+    copied unless they have a comment or splice, in which case they are sanitized in full before being dropped.
+    """
+
+    def __init__(self, binary: bool = False, directives_only: bool = False, encoding: str = "utf-8"):
+        self.binary = binary
+        self.directives_only = directives_only
+        self.encoding = encoding
+        self._patterns = _BYTES_PATTERNS if binary else _STR_PATTERNS
+        self._newline = self._encode("\n")
+        self._comment_end = self._encode("*/")
+
+        self.line_index = 0
+        self._mode = "normal"
+        self._return_mode = "normal"
+        self._emitting = not directives_only
+        self._speculative = False
+        self._segments: List[list] = []
+        self._split_segment = False
+        self._logical_start = 0
 
-        length_iter = (i for i, length in enumerate(self._acc_lengths) if string_index < length)
-        return next(length_iter)
+    def _encode(self, value: str):
+        return value.encode() if self.binary else value
 
-    def _map_string_range_to_segments(self, string_range: range):
-        start_index = self._map_string_index_to_segment_index(string_range.start)
-        end_index = self._map_string_index_to_segment_index(string_range.stop)
+    def _decode(self, value) -> str:
+        return value.decode() if self.binary else value
 
-        return (start_index, end_index, self.segments[start_index:end_index + 1])
+    def _emit(self, text, line_index: int, column: int, replacement: bool = False):
+        if not text:
+            return
+
+        if self._segments and not self._split_segment and not replacement:
+            last = self._segments[-1]
+            if last[0] == line_index and last[2] + len(last[1]) == column:
+                last[1] += text
+                return
+
+        self._segments.append([line_index, text, column])
+        # Text after a replacement gets its own segment so that columns stay exact
+        self._split_segment = replacement
+
+    def _finish_line(self) -> Optional[LogicalLine]:
+        if not self._segments:
+            self._segments.append([self._logical_start, self._encode(""), 0])
+
+        if self.binary:
+            segments = [(i, text.decode(self.encoding)) for i, text, _ in self._segments]
+        else:
+            segments = [(i, text) for i, text, _ in self._segments]
+        rv = LogicalLine(segments, [column for _, _, column in self._segments])
+
+        self._segments = []
+        self._emitting = not self.directives_only
+        if self._speculative:
+            self._speculative = False
+            if not str(rv).lstrip(" \t").startswith("#"):
+                return None
+        return rv
+
+    def feed(self, text) -> List[LogicalLine]:
+        """Processes `text`, which must end at the end of a physical line. Returns the completed logical lines."""
+        rv: List[LogicalLine] = []
+        patterns = self._patterns
+        pos = 0
+        line_start = 0
+        size = len(text)
+
+        def advance(to: int):
+            """Moves `pos` to `to`, counting the newlines that are skipped over."""
+            nonlocal pos, line_start
+            newlines = count_in_buffer(text, self._newline, pos, to)
+            if newlines:
+                self.line_index += newlines
+                line_start = text.rfind(self._newline, pos, to) + 1
+            pos = to
+
+        while pos < size:
+            mode = self._mode
+
+            if mode == "block_comment":
+                end = text.find(self._comment_end, pos)
+                if end == -1:
+                    advance(size)
+                    break
+                advance(end + 2)
+                self._mode = self._return_mode
+                continue
+
+            if mode == "normal" and not self._emitting:
+                # Always at the start of a logical line here. Newlines are only counted once something is found,
+                # which keeps this loop tight.
+                match = patterns["skip"].search(text, pos)
+                if match is None:
+                    advance(size)
+                    break
+
+                if match.lastgroup == "directive":
+                    advance(match.start())
+                else:
+                    # A comment or a splice, which can hide the rest of the line, or continue it into a directive.
+                    # The line is sanitized in full, and dropped when it ends if it is not a directive.
+                    advance(text.rfind(self._newline, pos, match.start()) + 1 or pos)
+                    self._speculative = True
+
+                self._emitting = True
+                self._logical_start = self.line_index
+                continue
+
+            match = patterns[mode].search(text, pos)
+            end = match.start() if match else size
+            if self._emitting and mode != "line_comment":
+                self._emit(text[pos:end], self.line_index, pos - line_start)
+            if match is None:
+                pos = size
+                break
+
+            kind = match.lastgroup
+            column = end - line_start
+            if kind == "splice":
+                self.line_index += 1
+                pos = line_start = match.end()
+                continue
+
+            if kind == "newline":
+                if self._emitting:
+                    line = self._finish_line()
+                    if line is not None:
+                        rv.append(line)
+                self.line_index += 1
+                pos = line_start = match.end()
+                self._mode = "normal"
+                self._logical_start = self.line_index
+                continue
+
+            pos = match.end()
+            value = match.group()
+            if kind == "trigraph" and self._emitting:
+                self._emit(self._encode(TRIGRAPHS[self._decode(value[2:])]), self.line_index, column, True)
+            elif kind in {"block", "line"}:
+                if self._emitting:
+                    self._emit(self._encode(" "), self.line_index, column, True)
+                if kind == "block":
+                    self._mode, self._return_mode = "block_comment", mode
+                else:
+                    self._mode = "line_comment"
+            elif kind == "quote":
+                if self._emitting:
+                    self._emit(value, self.line_index, column)
+                self._mode = "normal" if mode.startswith("string") else "string" + self._decode(value)
+            elif kind == "escape" and self._emitting:
+                if len(value) == 2:
+                    self._emit(value, self.line_index, column)
+                else:
+                    # A ??/ trigraph followed by the escaped character
+                    self._emit(self._encode("\\"), self.line_index, column, True)
+                    self._emit(value[3:], self.line_index, column + 3)
+
+        return rv
+
+    def finish(self) -> List[LogicalLine]:
+        """Returns the last logical line if the input did not end with a newline."""
+        rv = []
+        if self._emitting and self._segments:
+            line = self._finish_line()
+            if line is not None:
+                rv.append(line)
+
+        self._mode = "normal"
+        return rv
+
+    @classmethod
+    def sanitize(cls, buffer, directives_only: bool = False, encoding: str = "utf-8") -> List[LogicalLine]:
+        """Runs a whole `str` or bytes-like buffer (such as an `mmap`) through a new `Sanitizer`."""
+        sanitizer = cls(not isinstance(buffer, str), directives_only, encoding)
+        return sanitizer.feed(buffer) + sanitizer.finish()
@@ -0,0 +1,190 @@
+"""
+Per-header summaries. A summary records what including a header did: the macros it read and their definitions,
+the macros it defined and undefined, the `#pragma once` files it checked and entered, and the files it included.
+A later include of the same header under the same definitions of the macros it read can apply the summary
+instead of evaluating the header again, including in other translation units.
+"""
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Union
+from collections.abc import MutableMapping
+from .parser import IncludeDirective, ObjectMacro, FunctionMacro
+from .macro_table import MacroTable
+
+
+Macro = Union[ObjectMacro, FunctionMacro]
+
+
+def same_definition(a: Optional[Macro], b: Optional[Macro]) -> bool:
+    """
+    Checks if two definitions (or None for undefined) are the same. Definitions are compared by their spelling, since
+    their tokens hold the matches of the line they were parsed from, and the same header parsed for another
+    translation unit gives equal definitions with other tokens.
+    """
+    if a is b:
+        return True
+    if a is None or b is None or type(a) is not type(b) or a.identifier != b.identifier:
+        return False
+    if isinstance(a, ObjectMacro):
+        return a.spelling == b.spelling
+    return (tuple(a.params) == tuple(b.params) and
+            [t.value.group() for t in a.expression] == [t.value.group() for t in b.expression])
+
+
+class HeaderSummary:
+    """
+    The effect of including one header, together with everything it included. `reads` and `once_reads` are the
+    inputs: the definition of every macro that was read before being written, and whether each `#pragma once`
+    file had already been entered. The rest are the outputs.
+    """
+    __slots__ = ("reads", "writes", "once_reads", "once_writes", "dependencies", "unresolved")
+
+    def __init__(self):
+        self.reads: Dict[str, Optional[Macro]] = {}
+        # The new definition of every macro that was written, None if it was undefined
+        self.writes: Dict[str, Optional[Macro]] = {}
+        self.once_reads: Dict[Path, bool] = {}
+        self.once_writes: Dict[Path, None] = {}
+        self.dependencies: Dict[Path, None] = {}
+        self.unresolved: Dict[IncludeDirective, None] = {}
+
+    def matches(self, macro_table: MacroTable, seen_once: Set[Path]) -> bool:
+        """Checks if including the header with `macro_table` and `seen_once` would have the same effect."""
+        return (all(same_definition(macro_table.get(name), value) for name, value in self.reads.items()) and
+                all((path in seen_once) == seen for path, seen in self.once_reads.items()))
+
+
+class SummaryRecorder(MutableMapping):
+    """
+    Stands in for the macro table of a translation unit while it is evaluated, and records every read and write
+    into the summary of each header that is being included. Summaries are nested, so a read made while including
+    `b.h` from `a.h` counts towards both.
+    """
+
+    def __init__(self, macro_table: MacroTable):
+        self.macro_table = macro_table
+        self.open: List[HeaderSummary] = []
+
+    def _read(self, name: str, value: Optional[Macro]):
+        for summary in self.open:
+            if name not in summary.writes and name not in summary.reads:
+                summary.reads[name] = value
+
+    def _write(self, name: str, value: Optional[Macro]):
+        for summary in self.open:
+            summary.writes[name] = value
+
+    def get(self, name: str, default=None):
+        value = self.macro_table.get(name)
+        self._read(name, value)
+        return default if value is None else value
+
+    def __getitem__(self, name: str) -> Macro:
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name) -> bool:
+        return self.get(name) is not None
+
+    def __setitem__(self, name: str, macro: Macro):
+        self._write(name, macro)
+        self.macro_table[name] = macro
+
+    def __delitem__(self, name: str):
+        self._write(name, None)
+        del self.macro_table[name]
+
+    def pop(self, name: str, *default):
+        # Undefining a macro does not depend on its definition, so this is only a write
+        self._write(name, None)
+        return self.macro_table.pop(name, *default)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.macro_table)
+
+    def __len__(self) -> int:
+        return len(self.macro_table)
+
+    def _read_once(self, path: Path, seen: bool):
+        for summary in self.open:
+            if path not in summary.once_writes and path not in summary.once_reads:
+                summary.once_reads[path] = seen
+
+    def read_once(self, path: Path, seen_once: Set[Path]) -> bool:
+        """Checks if the `#pragma once` file at `path` was already entered."""
+        seen = path in seen_once
+        self._read_once(path, seen)
+        return seen
+
+    def write_once(self, path: Path, seen_once: Set[Path]):
+        seen_once.add(path)
+        for summary in self.open:
+            summary.once_writes[path] = None
+
+    def add_dependency(self, path: Path):
+        for summary in self.open:
+            summary.dependencies[path] = None
+
+    def add_unresolved(self, directive: IncludeDirective):
+        for summary in self.open:
+            summary.unresolved[directive] = None
+
+    def begin(self):
+        """Starts recording the summary of a header that is about to be included."""
+        self.open.append(HeaderSummary())
+
+    def end(self) -> HeaderSummary:
+        return self.open.pop()
+
+    def apply(self, summary: HeaderSummary, seen_once: Set[Path]):
+        """Applies the effects of `summary`, recording them into the summaries that are open."""
+        for name, value in summary.reads.items():
+            self._read(name, value)
+        for path, seen in summary.once_reads.items():
+            self._read_once(path, seen)
+
+        for name, value in summary.writes.items():
+            if value is None:
+                self.pop(name, None)
+            else:
+                self[name] = value
+        for path in summary.once_writes:
+            self.write_once(path, seen_once)
+
+        for path in summary.dependencies:
+            self.add_dependency(path)
+        for directive in summary.unresolved:
+            self.add_unresolved(directive)
+
+
+class SummaryCache:
+    """
+    Keeps the summaries of every header, keyed by path. Up to `max_per_header` summaries are kept for each header,
+    one for each distinct set of inputs it was included with; the oldest one is dropped to make room.
+    """
+
+    def __init__(self, max_per_header: int = 8):
+        self.max_per_header = max_per_header
+        self.summaries: Dict[Path, List[HeaderSummary]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def find(self, path: Path, macro_table: MacroTable, seen_once: Set[Path]) -> Optional[HeaderSummary]:
+        """Returns a summary of `path` that applies to `macro_table` and `seen_once`, if there is one."""
+        for summary in self.summaries.get(path, ()):
+            if summary.matches(macro_table, seen_once):
+                self.hits += 1
+                return summary
+
+        self.misses += 1
+        return None
+
+    def add(self, path: Path, summary: HeaderSummary):
+        summaries = self.summaries.setdefault(path, [])
+        if len(summaries) >= self.max_per_header:
+            summaries.pop(0)
+        summaries.append(summary)
+
+    def clear(self):
+        self.summaries.clear()
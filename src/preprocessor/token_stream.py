@@ -0,0 +1,166 @@
+"""
+Compact, column oriented storage for tokens. A `TokenStream` keeps the token types, offsets and lines of many
+logical lines in `array` columns over one shared source buffer. `Token`-like views are only created on access.
+"""
+from array import array
+from typing import Iterable, Iterator, Tuple, Union
+import re
+from .tokenizer import TOKEN_MAP, TokenType, iter_token_matches
+
+
+_GROUP_CODES = {f"_{i}": token_type.value for i, (_, token_type) in enumerate(TOKEN_MAP)}
+_TYPE_REGEXES = {token_type.value: regex for regex, token_type in reversed(TOKEN_MAP)}
+_TYPES = {token_type.value: token_type for token_type in TokenType}
+
+
+class TokenView:
+    """
+    A lightweight stand in for `Token` that reads its fields from a `TokenStream`. `value` is re-matched
+    against the shared buffer when accessed, so it behaves like the `re.Match` stored by `Token`.
+    """
+    __slots__ = ("stream", "index")
+
+    def __init__(self, stream: "TokenStream", index: int):
+        self.stream = stream
+        self.index = index
+
+    @property
+    def type(self) -> TokenType:
+        return _TYPES[self.stream.types[self.index]]
+
+    @property
+    def value(self) -> re.Match:
+        stream = self.stream
+        code = stream.types[self.index]
+        return _TYPE_REGEXES[code].match(stream.source, stream.starts[self.index], stream.ends[self.index])
+
+    @property
+    def text(self) -> str:
+        return self.stream.source[self.stream.starts[self.index]:self.stream.ends[self.index]]
+
+    @property
+    def col(self) -> int:
+        stream = self.stream
+        return stream.starts[self.index] - stream.row_offsets[stream.rows[self.index]]
+
+    @property
+    def line(self) -> int:
+        return self.stream.row_lines[self.stream.rows[self.index]]
+
+    def __eq__(self, o):
+        return (self.type == o.type and
+                self.value.group() == o.value.group() and
+                self.col == o.col and
+                self.line == o.line)
+
+    def __repr__(self):
+        return f"TokenView(ttype: {self.type}, value: {self.text!r}, col: {self.col}, line: {self.line})"
+
+
+class TokenSlice:
+    """A lazy, read-only sequence of `TokenView`s covering tokens [start, stop) of a `TokenStream`."""
+    __slots__ = ("stream", "start", "stop")
+
+    def __init__(self, stream: "TokenStream", start: int, stop: int):
+        self.stream = stream
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("TokenSlice does not support slicing with a step")
+            return TokenSlice(self.stream, self.start + start, self.start + max(start, stop))
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Token index {index} out of range")
+
+        return TokenView(self.stream, self.start + index)
+
+    def __iter__(self) -> Iterator[TokenView]:
+        return (TokenView(self.stream, i) for i in range(self.start, self.stop))
+
+    def __eq__(self, o):
+        try:
+            return len(self) == len(o) and all(a == b for a, b in zip(self, o))
+        except TypeError:
+            return False
+
+    def __repr__(self):
+        return f"TokenSlice({list(self)})"
+
+
+class TokenStream:
+    """
+    Tokens of a sequence of logical lines ("rows"). The rows are joined into `source`, and each token is stored
+    as a type code, a start and end offset into `source` and the row it belongs to.
+    """
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[Tuple[int, str]], include_whitespace: bool = False) -> "TokenStream":
+        """Tokenizes `(line_num, text)` pairs. Whitespace tokens are dropped unless `include_whitespace` is set."""
+        lines = list(lines)
+        stream = cls("\n".join(text for _, text in lines))
+        whitespace = TokenType.WHITESPACE.value
+        group_codes = _GROUP_CODES
+
+        offset = 0
+        for row, (line_num, text) in enumerate(lines):
+            stream.row_offsets.append(offset)
+            stream.row_lines.append(line_num)
+            stream.row_starts.append(len(stream.types))
+
+            for match in iter_token_matches(stream.source, offset, offset + len(text)):
+                code = group_codes[match.lastgroup]
+                if code == whitespace and not include_whitespace:
+                    continue
+
+                stream.types.append(code)
+                stream.starts.append(match.start())
+                stream.ends.append(match.end())
+                stream.rows.append(row)
+
+            offset += len(text) + 1
+
+        stream.row_starts.append(len(stream.types))
+        return stream
+
+    def __init__(self, source: str):
+        self.source = source
+
+        # Token columns
+        self.types = array("B")
+        self.starts = array("I")
+        self.ends = array("I")
+        self.rows = array("I")
+
+        # Row columns. `row_starts` has one extra entry holding the total token count
+        self.row_offsets = array("I")
+        self.row_lines = array("I")
+        self.row_starts = array("I")
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index: Union[int, slice]):
+        return TokenSlice(self, 0, len(self))[index]
+
+    def __iter__(self) -> Iterator[TokenView]:
+        return iter(TokenSlice(self, 0, len(self)))
+
+    @property
+    def row_count(self) -> int:
+        return len(self.row_lines)
+
+    def row(self, row: int) -> TokenSlice:
+        """Returns the tokens of the `row`th line passed to `from_lines`."""
+        return TokenSlice(self, self.row_starts[row], self.row_starts[row + 1])
+
+    def iter_rows(self) -> Iterator[TokenSlice]:
+        return (self.row(i) for i in range(self.row_count))
@@ -1,5 +1,5 @@
 from enum import Enum, auto
-from typing import Optional, List
+from typing import Iterable, Optional, List, Iterator
 import re
 
 
@@ -25,6 +25,22 @@ class TokenType(Enum):
     OP_DEFINED = auto()
     OP_JOIN = auto()
     OP_CONCAT = auto()
+    OP_ADD = auto()
+    OP_SUB = auto()
+    OP_MUL = auto()
+    OP_DIV = auto()
+    OP_MOD = auto()
+    OP_LSHIFT = auto()
+    OP_RSHIFT = auto()
+    OP_TERNARY = auto()
+    OP_COLON = auto()
+    OP_BIT_AND = auto()
+    OP_BIT_OR = auto()
+    OP_BIT_XOR = auto()
+    OP_BIT_NOT = auto()
+    # Never tokenized, `ShuntingYard` turns a `+` or `-` that comes before its operand into these
+    OP_UNARY_PLUS = auto()
+    OP_UNARY_MINUS = auto()
 
 
 LITERAL_TYPES = {TokenType.STRING_LITERAL, TokenType.NUM_LITERAL}
@@ -35,25 +51,37 @@ COMPARISON_OPERATOR_TYPES = {
 BOOLEAN_OPERATOR_TYPES = {TokenType.OP_AND, TokenType.OP_OR}
 UNARY_BOOLEAN_OPERATOR_TYPES = {TokenType.OP_NOT, TokenType.OP_DEFINED}
 TOKEN_OPERATOR_TYPES = {TokenType.OP_JOIN, TokenType.OP_CONCAT}
-OPERATOR_TYPES = COMPARISON_OPERATOR_TYPES | BOOLEAN_OPERATOR_TYPES | UNARY_BOOLEAN_OPERATOR_TYPES | TOKEN_OPERATOR_TYPES
+ARITHMETIC_OPERATOR_TYPES = {
+    TokenType.OP_ADD, TokenType.OP_SUB, TokenType.OP_MUL, TokenType.OP_DIV, TokenType.OP_MOD, TokenType.OP_LSHIFT,
+    TokenType.OP_RSHIFT
+}
+UNARY_ARITHMETIC_OPERATOR_TYPES = {TokenType.OP_UNARY_PLUS, TokenType.OP_UNARY_MINUS}
+CONDITIONAL_OPERATOR_TYPES = {TokenType.OP_TERNARY, TokenType.OP_COLON}
+BITWISE_OPERATOR_TYPES = {TokenType.OP_BIT_AND, TokenType.OP_BIT_OR, TokenType.OP_BIT_XOR, TokenType.OP_BIT_NOT}
+OPERATOR_TYPES = (COMPARISON_OPERATOR_TYPES | BOOLEAN_OPERATOR_TYPES | UNARY_BOOLEAN_OPERATOR_TYPES | TOKEN_OPERATOR_TYPES |
+                  ARITHMETIC_OPERATOR_TYPES | UNARY_ARITHMETIC_OPERATOR_TYPES | CONDITIONAL_OPERATOR_TYPES |
+                  BITWISE_OPERATOR_TYPES)
 
 
 TOKEN_MAP = (
     (re.compile(r"\s"),             TokenType.WHITESPACE),
-    (re.compile(r"#(\S*)"),         TokenType.DIRECTIVE),
+    # Whitespace may separate the name from the '#', as in `#  endif`
+    (re.compile(r"#[ \t]*(\w*)"),   TokenType.DIRECTIVE),
     (re.compile(r"\"(.*)\""), TokenType.STRING_LITERAL),
-    (re.compile(r"(\d+)(\S?)(\d*)"), TokenType.NUM_LITERAL),
-    (re.compile(r"defined"),        TokenType.OP_DEFINED),
-    (re.compile(r"=="),             TokenType.OP_EQ),
-    (re.compile(r"!="),             TokenType.OP_NEQ),
-    (re.compile(r"(\d+)(\S?)(\d*)"), TokenType.NUM_LITERAL),
-    (re.compile(r"defined"),        TokenType.OP_DEFINED),
+    (re.compile(r"(\d+)(\.?)(\d*)\w*"), TokenType.NUM_LITERAL),
+    (re.compile(r"defined\b"),      TokenType.OP_DEFINED),
+    (re.compile(r"<<"),             TokenType.OP_LSHIFT),
+    (re.compile(r">>"),             TokenType.OP_RSHIFT),
     (re.compile(r"=="),             TokenType.OP_EQ),
     (re.compile(r"!="),             TokenType.OP_NEQ),
     (re.compile(r"<="),             TokenType.OP_LTE),
     (re.compile(r">="),             TokenType.OP_GTE),
     (re.compile(r"&&"),             TokenType.OP_AND),
     (re.compile(r"\|\|"),           TokenType.OP_OR),
+    (re.compile(r"&"),              TokenType.OP_BIT_AND),
+    (re.compile(r"\|"),             TokenType.OP_BIT_OR),
+    (re.compile(r"\^"),             TokenType.OP_BIT_XOR),
+    (re.compile(r"~"),              TokenType.OP_BIT_NOT),
     (re.compile(r"##"),             TokenType.OP_CONCAT),
     (re.compile(r"<"),              TokenType.OP_LT),
     (re.compile(r">"),              TokenType.OP_GT),
@@ -62,11 +90,52 @@ TOKEN_MAP = (
     (re.compile(r","),              TokenType.COMMA),
     (re.compile(r"#"),              TokenType.OP_JOIN),
     (re.compile(r"!"),              TokenType.OP_NOT),
-    (re.compile(r"[a-zA-Z]\w*"),    TokenType.IDENTIFIER),
+    (re.compile(r"\+"),             TokenType.OP_ADD),
+    (re.compile(r"-"),              TokenType.OP_SUB),
+    (re.compile(r"\*"),             TokenType.OP_MUL),
+    (re.compile(r"/"),              TokenType.OP_DIV),
+    (re.compile(r"%"),              TokenType.OP_MOD),
+    (re.compile(r"\?"),             TokenType.OP_TERNARY),
+    (re.compile(r":"),              TokenType.OP_COLON),
+    (re.compile(r"[a-zA-Z_]\w*"),   TokenType.IDENTIFIER),
     (re.compile(r"\S"),             TokenType.GENERIC)
 )
 
 
+def _compile_master_regex(token_map, exclude: Iterable[TokenType] = ()) -> re.Pattern:
+    """
+    Joins every pattern in `token_map` into a single alternation. Each alternative is wrapped in a
+    named group `_<index>` so the matching entry can be recovered from `Match.lastgroup`.
+    Alternation tries the patterns in order, so the first entry to match still wins.
+    Entries whose type is in `exclude` are left out.
+    """
+    return re.compile("|".join(f"(?P<_{i}>{regex.pattern})" for i, (regex, token_type) in enumerate(token_map)
+                               if token_type not in exclude))
+
+
+MASTER_REGEX = _compile_master_regex(TOKEN_MAP)
+# A '#' is only a directive at the start of a line. Anywhere else it is the '#' or '##' operator
+BODY_REGEX = _compile_master_regex(TOKEN_MAP, {TokenType.DIRECTIVE})
+_GROUP_MAP = {f"_{i}": entry for i, entry in enumerate(TOKEN_MAP)}
+_WHITESPACE_GROUP = next(name for name, (_, token_type) in _GROUP_MAP.items() if token_type is TokenType.WHITESPACE)
+
+
+def iter_token_matches(line: str, start: int = 0, end: Optional[int] = None) -> Iterator[re.Match]:
+    """
+    Yields the `MASTER_REGEX` matches of `line[start:end]`. Once the first token that is not whitespace has been
+    matched, the rest of the line is matched with `BODY_REGEX`.
+    """
+    if end is None:
+        end = len(line)
+
+    whitespace = _WHITESPACE_GROUP
+    for match in MASTER_REGEX.finditer(line, start, end):
+        yield match
+        if match.lastgroup != whitespace:
+            yield from BODY_REGEX.finditer(line, match.end(), end)
+            return
+
+
 class Token():
     def __init__(self, ttype: TokenType, value: Optional[re.Match] = None, col: int = 0, line: int = 0):
         self.type = ttype
@@ -84,19 +153,17 @@ class Token():
         return f"Token(ttype: {self.type}, value: {self.value}, col: {self.col}, line: {self.line})"
 
 
-def tokenize_line_iter(line: str, line_num: int = 0):
-    cursor = 0
-
-    while cursor < len(line):
-        match_generator = ((regex.match(line, cursor), token_type) for regex, token_type in TOKEN_MAP)
-        match, token_type = next(x for x in match_generator if x[0] is not None)
+def tokenize_line_iter(line: str, line_num: int = 0) -> Iterator[Token]:
+    """
+    Scans `line` once with `iter_token_matches`. The winning alternative is re-matched with its own pattern
+    so that `Token.value` keeps the group numbering of the original `TOKEN_MAP` entry.
+    """
+    group_map = _GROUP_MAP
 
-        if match is not None:
-            y = Token(token_type, match, cursor, line_num)
-            cursor += len(match.group(0))
-            yield y
-        else:
-            raise Exception("This should never happen. Unknown tokens are Generic.")
+    for master_match in iter_token_matches(line):
+        regex, token_type = group_map[master_match.lastgroup]
+        cursor = master_match.start()
+        yield Token(token_type, regex.match(line, cursor), cursor, line_num)
 
 
 def tokenize_line(line: str, line_num: int = 0) -> List[Token]:
@@ -0,0 +1,218 @@
+"""
+Follows the includes of a translation unit. Every header is loaded and analysed once per scanner. Headers that
+are protected by an include guard or `#pragma once` are skipped without being opened or evaluated again once they
+have been seen, like GCC's multiple-include optimization.
+"""
+from pathlib import Path
+from typing import Dict, List, Mapping, NamedTuple, Optional, Set, Union
+import os
+from .parser import ASTObject, ConditionalIndex, IncludeDirective, build_conditional_index, find_include_guard
+from .parser import has_pragma_once
+from .scanner import is_blank_outside, lines_blank_outside, scan_buffer_compact, scan_directives, scan_file_compact
+from .interpreter import evaluate_ast
+from .include_resolver import IncludeResolver
+from .macro_table import MacroTable
+from .cache import ASTCache, fingerprint_bytes
+from .summary import SummaryCache, SummaryRecorder
+from . import stats
+
+
+# GCC's limit on nested includes
+MAX_INCLUDE_DEPTH = 200
+
+
+def predefined_macros(defines: Mapping[str, str]) -> MacroTable:
+    """Builds a macro table from `-D` style `{name: value}` definitions."""
+    source = "".join(f"#define {name} {value}\n" for name, value in defines.items())
+    return MacroTable({m.identifier: m for m in scan_directives(source)})
+
+
+class HeaderInfo:
+    """
+    The parsed directives of a file, their conditional index, and how the file protects itself from being
+    included twice. `guard` is the name of the include guard macro, if the file has one.
+    """
+    __slots__ = ("ast", "conditional_index", "guard", "once")
+
+    def __init__(self, ast: List[ASTObject], conditional_index: ConditionalIndex, guard: Optional[str], once: bool):
+        self.ast = ast
+        self.conditional_index = conditional_index
+        self.guard = guard
+        self.once = once
+
+
+class ScanResult(NamedTuple):
+    """
+    The files a translation unit includes, in the order they are first reached, and the includes that could not
+    be found.
+    """
+    path: Path
+    dependencies: List[Path]
+    unresolved: List[IncludeDirective]
+
+
+class TranslationUnitScanner:
+    """
+    Finds every file a translation unit includes, evaluating each included file with the macros defined at the
+    point it is included. Files are parsed with `ast_cache` when one is given. With a `summaries` cache, a header
+    that is included again with the same definitions of the macros it reads is not evaluated again; its recorded
+    effects are applied instead.
+
+    With a `reader` (a `prefetch.PrefetchReader`), files are read through it, and the headers named by every
+    include of a loaded file are handed to it to prefetch while the file is evaluated.
+
+    Loaded files are kept until `clear` is called, so one scanner should be used for the translation units of
+    one build. `loads` counts the files that were parsed and `skips` the includes that were skipped because of an
+    include guard or `#pragma once`.
+    """
+
+    def __init__(self, resolver: IncludeResolver, ast_cache: Optional[ASTCache] = None, encoding: str = "utf-8",
+                 summaries: Optional[SummaryCache] = None, reader=None):
+        self.resolver = resolver
+        self.ast_cache = ast_cache
+        self.summaries = summaries
+        self.reader = reader
+        self.encoding = encoding
+        self.files: Dict[Path, HeaderInfo] = {}
+
+        self.loads = 0
+        self.skips = 0
+
+    def load(self, path: Path) -> HeaderInfo:
+        """Returns the `HeaderInfo` of the file at `path`, parsing it the first time."""
+        info = self.files.get(path)
+        if info is not None:
+            return info
+
+        collector = stats.COLLECTOR
+        if collector is not None:
+            with collector.file(path):
+                return self._load(path)
+        return self._load(path)
+
+    def _load(self, path: Path) -> HeaderInfo:
+        data = None
+        if self.reader is not None:
+            ast = self.ast_cache.get(path) if self.ast_cache is not None else None
+            if ast is None:
+                stat, data = self.reader.read_stat(path)
+                ast = scan_buffer_compact(data, self.encoding)
+                if self.ast_cache is not None:
+                    self.ast_cache.put(path, ast, fingerprint_bytes(data), stat)
+            else:
+                self.reader.discard(path)
+        elif self.ast_cache is not None:
+            ast = self.ast_cache.parse(path)
+        else:
+            ast = scan_file_compact(path, self.encoding)
+        conditional_index = build_conditional_index(ast)
+
+        guard = find_include_guard(ast, conditional_index)
+        if guard is not None:
+            if data is not None:
+                blank = lines_blank_outside(data.decode(self.encoding).splitlines(True), ast[0].line, ast[-1].line)
+            else:
+                blank = is_blank_outside(path, ast[0].line, ast[-1].line, self.encoding)
+            if not blank:
+                guard = None
+
+        if self.reader is not None:
+            self._prefetch_includes(path, ast)
+
+        info = self.files[path] = HeaderInfo(ast, conditional_index, guard, has_pragma_once(ast, guard is not None))
+        self.loads += 1
+        return info
+
+    def _prefetch_includes(self, path: Path, ast: List[ASTObject]):
+        # Includes in inactive branches are prefetched too, since they are found before the file is evaluated
+        headers = []
+        for o in ast:
+            if isinstance(o, IncludeDirective):
+                resolved = self.resolver.resolve(o, path)
+                if resolved is not None and resolved not in self.files:
+                    headers.append(resolved)
+        self.reader.prefetch(headers)
+
+    def scan(self, path: Union[str, Path], macro_table: Optional[MacroTable] = None) -> ScanResult:
+        """
+        Evaluates the translation unit at `path`, following its includes. `macro_table` holds predefined macros,
+        and is left holding the macros defined at the end of the translation unit.
+        """
+        path = Path(os.path.abspath(path))
+        if macro_table is None:
+            macro_table = MacroTable()
+
+        dependencies: Dict[Path, None] = {}
+        unresolved: Dict[IncludeDirective, None] = {}
+        seen_once: Set[Path] = set()
+        stack: List[Path] = []
+
+        summaries = self.summaries
+        recorder = SummaryRecorder(macro_table) if summaries is not None else None
+        table = recorder if recorder is not None else macro_table
+
+        def enter(file: Path):
+            info = self.load(file)
+            if info.once:
+                seen = recorder.read_once(file, seen_once) if recorder is not None else file in seen_once
+                if seen:
+                    self.skips += 1
+                    return
+                if recorder is not None:
+                    recorder.write_once(file, seen_once)
+                else:
+                    seen_once.add(file)
+
+            stack.append(file)
+            collector = stats.COLLECTOR
+            if collector is not None:
+                with collector.file(file):
+                    evaluate_ast(info.ast, table, info.conditional_index, follow)
+            else:
+                evaluate_ast(info.ast, table, info.conditional_index, follow)
+            stack.pop()
+
+        def follow(directive: IncludeDirective):
+            resolved = self.resolver.resolve(directive, stack[-1])
+            if resolved is None:
+                unresolved[directive] = None
+                if recorder is not None:
+                    recorder.add_unresolved(directive)
+                return
+            dependencies[resolved] = None
+            if recorder is not None:
+                recorder.add_dependency(resolved)
+
+            # A guarded header that was seen before is skipped without being opened or evaluated
+            known = self.files.get(resolved)
+            if known is not None and known.guard is not None and known.guard in table:
+                self.skips += 1
+                return
+
+            if len(stack) >= MAX_INCLUDE_DEPTH:
+                raise Exception(f"#include nested more than {MAX_INCLUDE_DEPTH} levels deep in {stack[-1]}")
+
+            if recorder is None:
+                enter(resolved)
+                return
+
+            summary = summaries.find(resolved, macro_table, seen_once)
+            if summary is not None:
+                recorder.apply(summary, seen_once)
+                dependencies.update(summary.dependencies)
+                unresolved.update(summary.unresolved)
+                return
+
+            recorder.begin()
+            try:
+                enter(resolved)
+            finally:
+                summary = recorder.end()
+            summaries.add(resolved, summary)
+
+        enter(path)
+        return ScanResult(path, list(dependencies), list(unresolved))
+
+    def clear(self):
+        """Forgets every loaded file."""
+        self.files.clear()
@@ -1,27 +1,239 @@
-from glob import iglob
 from pathlib import Path
-from typing import Iterable, Union
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+import os
+import re
 
 
-def normalize_path(path: Union[str, Iterable[Union[Path, str]]]) -> Iterable[Path]:
-    # Convert a single instance to an interable
-    if type(path) is str:
+MAGIC_REGEX = re.compile(r"[*?[]")
+
+# Maps the names in a directory to whether they are a directory and whether they are a file
+Listing = Dict[str, Tuple[bool, bool]]
+
+
+class DirectorySnapshot:
+    """
+    Directory listings read with `os.scandir`, keeping the type of every entry so it is never looked up again.
+    Pass the same snapshot to several `normalize_path` calls to share the listings when the tree is not expected
+    to change in between, and call `clear` when it might have.
+    """
+
+    def __init__(self):
+        self._listings: Dict[str, Optional[Listing]] = {}
+        self.hits = 0
+        self.scans = 0
+
+    def listing(self, directory: str) -> Optional[Listing]:
+        """Returns the entries of `directory`, or None if it is not a directory that can be listed."""
+        directory = directory or "."
+        if directory in self._listings:
+            self.hits += 1
+            return self._listings[directory]
+
+        self.scans += 1
+        try:
+            with os.scandir(directory) as entries:
+                listing: Optional[Listing] = {e.name: (e.is_dir(), e.is_file()) for e in entries}
+        except OSError:
+            listing = None
+
+        self._listings[directory] = listing
+        return listing
+
+    def entry_type(self, path: str) -> Tuple[bool, bool]:
+        """Returns whether `path` is a directory and whether it is a file, using the listing of its parent."""
+        parent, name = os.path.split(os.path.normpath(path))
+        if name in ("", ".", ".."):
+            return os.path.isdir(path), False
+
+        listing = self.listing(parent)
+        if listing is None or name not in listing:
+            return False, False
+        return listing[name]
+
+    def clear(self):
+        self._listings.clear()
+
+
+def _translate_component(component: str) -> str:
+    """Translates one glob path component to a regex, following `fnmatch` and `glob`'s hidden file rule."""
+    # Wildcards do not match names that start with a dot, unless the pattern does too
+    regex = [] if component.startswith(".") else [r"(?!\.)"]
+    i = 0
+    while i < len(component):
+        c = component[i]
+        i += 1
+        if c == "*":
+            regex.append(r"[^/]*")
+        elif c == "?":
+            regex.append(r"[^/]")
+        elif c == "[":
+            j = i
+            if j < len(component) and component[j] in "!]":
+                j += 1
+            if j < len(component) and component[j] == "]":
+                j += 1
+            j = component.find("]", j)
+            if j < 0:
+                regex.append(r"\[")
+                continue
+
+            # Escape what `re` would read as nested sets or set operations
+            members = re.sub(r"([\\\[&~|])", r"\\\1", component[i:j])
+            i = j + 1
+            if members.startswith("!"):
+                # Like every wildcard, a negated class does not match the separator
+                members = members[1:]
+                members = "^/" + ("\\" + members if members.startswith("]") else members)
+            elif members.startswith("^"):
+                members = "\\" + members
+            regex.append(f"[{members}]")
+        else:
+            regex.append(re.escape(c))
+
+    return "".join(regex)
+
+
+def _translate(root: str, components: List[str]) -> str:
+    """Translates the components of a glob pattern below the literal directory `root` to a regex."""
+    regex = [re.escape(root) + ("/" if root not in ("", "/") else "")]
+    for i, component in enumerate(components):
+        last = i == len(components) - 1
+        if component == "**":
+            # Any number of directories; at the end, anything below the directory
+            regex.append(r"(?!\.)[^/]+(?:/(?!\.)[^/]+)*" if last else r"(?:(?!\.)[^/]+/)*")
+        else:
+            regex.append(_translate_component(component) + ("" if last else "/"))
+    return "".join(regex)
+
+
+class _Pattern:
+    """
+    A glob pattern split into the literal directory to walk from, a regex for the paths below it, and the regexes
+    of the directories only it matches, which `glob` also yields for a trailing `**` that matches no directory.
+    """
+    __slots__ = ("root", "regex", "dir_regexes", "matches_root", "dir_only", "depth", "hidden")
+
+    def __init__(self, pattern: str):
+        self.dir_only = pattern.endswith("/")
+        components = pattern.rstrip("/").split("/")
+
+        literal = 0
+        while literal < len(components) - 1 and not MAGIC_REGEX.search(components[literal]):
+            literal += 1
+        # `.` names the directory it is in, which `Path` leaves out of the paths `glob` returns
+        root = [c for c in components[:literal] if c != "."]
+        self.root = "/".join(root) or ("." if literal else "")
+        if not self.root and pattern.startswith("/"):
+            self.root = "/"
+        rest = [c for c in components[literal:] if c != "."]
+        if components[-1] == "." and rest:
+            self.dir_only = True
+        self.regex = _translate(self.root, rest)
+
+        # `src/**` also matches `src` itself, as does `src/**/`, but `**` only matches the current directory as `**/.`
+        self.dir_regexes: List[str] = []
+        self.matches_root = False
+        prefix = rest
+        while prefix and prefix[-1] == "**":
+            prefix = prefix[:-1]
+            if prefix:
+                self.dir_regexes.append(_translate(self.root, prefix))
+            else:
+                # Unless a `.` spells the current directory as `./`, glob leaves it out as an empty path
+                self.matches_root = self.root != "" or "." in components[literal:]
+
+        # How deep below `root` matches can be, or None if there is no limit
+        self.depth: Optional[int] = None if "**" in rest else len(rest)
+        # Whether matches can be inside directories whose names start with a dot
+        self.hidden = any(c.startswith(".") for c in rest)
+
+
+def _covers(outer: str, inner: str) -> bool:
+    """Checks if walking from `outer` reaches `inner`, spelled the way the walk spells its paths."""
+    if outer == inner:
+        return True
+    if outer == "":
+        return not inner.startswith("/") and inner.split("/")[0] not in (".", "..")
+    return inner.startswith(outer.rstrip("/") + "/")
+
+
+def normalize_path(path: Union[str, Path, Iterable[Union[Path, str]]],
+                   snapshot: Optional[DirectorySnapshot] = None) -> List[Path]:
+    """
+    Returns the files `path` refers to, sorted and without duplicates. `path` is a path or a list of them. Strings
+    are glob patterns, with `**` matching any number of directories; `Path` objects are used as is. Directories,
+    matched or given, stand for the files directly inside them.
+
+    The patterns are compiled into one regex per directory they start from, matched while the directories below
+    them are walked once with `os.scandir`, so overlapping patterns do not walk the same tree twice. A `DirectorySnapshot` can be passed
+    to reuse the listings of an earlier call.
+    """
+    # Convert a single instance to an iterable
+    if isinstance(path, (str, Path)):
         path = [path]
+    if snapshot is None:
+        snapshot = DirectorySnapshot()
+
+    accepted_files: Set[Path] = set()
 
-    def handle_path(path_obj: Path):
-        if path_obj.is_file():
-            return (path_obj,)
-        elif path_obj.is_dir():
-            return (x for x in path_obj.iterdir() if x.is_file())
+    def add_directory(directory: str):
+        for name, (_, is_file) in (snapshot.listing(directory) or {}).items():
+            if is_file:
+                accepted_files.add(Path(os.path.join(directory, name)))
 
-    accepted_files = set()
+    patterns: List[_Pattern] = []
     for p in path:
-        try:
-            # Try to handle p as if it was a string
-            for g in map(Path, iglob(p, recursive=True)):
-                accepted_files.update(handle_path(g))
-        except TypeError:
-            # Not a string, try to handle it like a path
-            accepted_files.update(handle_path(p))
-
-    return accepted_files
\ No newline at end of file
+        if isinstance(p, str) and MAGIC_REGEX.search(p):
+            patterns.append(_Pattern(p))
+            continue
+
+        # A literal path
+        p = os.fspath(p)
+        is_dir, is_file = snapshot.entry_type(p)
+        if is_file and not p.endswith("/"):
+            accepted_files.add(Path(p))
+        elif is_dir:
+            add_directory(p)
+
+    if not patterns:
+        return sorted(accepted_files)
+
+    for pattern in patterns:
+        if pattern.matches_root and snapshot.entry_type(pattern.root or ".")[0]:
+            add_directory(pattern.root)
+
+    # Walk each root once, from the outermost root that reaches it
+    walks: Dict[str, List[_Pattern]] = {}
+    for pattern in sorted(patterns, key=lambda p: len(p.root)):
+        root = next((r for r in walks if _covers(r, pattern.root)), pattern.root)
+        walks.setdefault(root, []).append(pattern)
+
+    for root, root_patterns in walks.items():
+        # Only the patterns of this walk, as a path spelled from another root may match a pattern of that root
+        match = re.compile("|".join(f"(?:{p.regex})" for p in root_patterns if not p.dir_only) or r"(?!)").fullmatch
+        match_dir = re.compile("|".join(f"(?:{r})" for p in root_patterns for r in (p.regex, *p.dir_regexes))).fullmatch
+
+        max_depth: Optional[int] = 0
+        hidden = False
+        for pattern in root_patterns:
+            extra = pattern.root[len(root):].strip("/").split("/") if pattern.root != root else []
+            hidden = hidden or pattern.hidden or any(c.startswith(".") for c in extra)
+            if pattern.depth is None or max_depth is None:
+                max_depth = None
+            else:
+                max_depth = max(max_depth, len(extra) + pattern.depth)
+
+        stack = [(root, 1)]
+        while stack:
+            directory, depth = stack.pop()
+            for name, (is_dir, is_file) in (snapshot.listing(directory) or {}).items():
+                entry = os.path.join(directory, name)
+                if is_dir:
+                    if match_dir(entry):
+                        add_directory(entry)
+                    if (max_depth is None or depth < max_depth) and (hidden or not name.startswith(".")):
+                        stack.append((entry, depth + 1))
+                elif is_file and match(entry):
+                    accepted_files.add(Path(entry))
+
+    return sorted(accepted_files)
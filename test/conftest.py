@@ -0,0 +1,38 @@
+import pytest # NOQA
+import stat
+import sys
+from types import SimpleNamespace
+
+
+# Writes its output file and logs the input, warns about sources that contain "WARN", and fails on sources that
+# contain "FAIL"
+STUB_COMPILER = f"""#!{sys.executable}
+import sys
+args = sys.argv[1:]
+output = args[args.index("-o") + 1]
+inputs = [a for a in args if a.endswith((".c", ".o"))]
+with open(sys.argv[0] + ".log", "a") as log:
+    log.write(" ".join(inputs) + "\\n")
+for path in inputs:
+    if path.endswith(".c") and "WARN" in open(path).read():
+        print(path + ": warning: WARN")
+    if path.endswith(".c") and "FAIL" in open(path).read():
+        print(path + ": error: FAIL")
+        sys.exit(1)
+open(output, "w").write("built from " + " ".join(inputs))
+"""
+
+
+@pytest.fixture
+def project(tmp_path):
+    compiler = tmp_path / "cc"
+    compiler.write_text(STUB_COMPILER)
+    compiler.chmod(compiler.stat().st_mode | stat.S_IEXEC)
+
+    (tmp_path / "include").mkdir()
+    (tmp_path / "include/common.h").write_text("#pragma once\n")
+    for name in ("a", "b", "c"):
+        (tmp_path / f"{name}.c").write_text(f"#include <common.h>\nint {name};\n")
+
+    module = SimpleNamespace(name="app", files={tmp_path / f"{n}.c" for n in "abc"}, variables={"APP": "1"})
+    return tmp_path, compiler, module
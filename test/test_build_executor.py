@@ -0,0 +1,137 @@
+import pytest # NOQA
+import os
+from pathlib import Path
+from types import SimpleNamespace
+from .utilities import NamedTestMatrix
+from src.build.executor import BuildHistory, BuildJob, FAILED, SKIPPED, SUCCEEDED, UP_TO_DATE
+from src.build.executor import build, compile_flags, critical_path, plan_build, run_build
+from src.preprocessor.translation_unit import ScanResult
+
+
+def configuration(compiler, modules, warnings_are_errors=False, name="debug"):
+    return SimpleNamespace(name=name, compiler=compiler, optimization=1, warnings=3,
+                           warnings_are_errors=warnings_are_errors, enable_static_linking=False,
+                           additional_params=("-g",), modules=modules)
+
+
+def compile_log(compiler):
+    with open(str(compiler) + ".log") as f:
+        return [line.split() for line in f]
+
+
+FLAGS_MATRIX = NamedTestMatrix(
+    ("optimization", "warnings", "warnings_are_errors", "expected"),
+    (
+        ("defaults",        1,  1,  True,   ["-O2", "-pedantic", "-Werror"]),
+        ("no warnings",     0,  0,  False,  ["-O0"]),
+        ("extra",           3,  3,  False,  ["-Os", "-pedantic", "-Wall", "-Wextra"]),
+    )
+)
+@pytest.mark.parametrize(FLAGS_MATRIX.arg_names, FLAGS_MATRIX.arg_values, ids=FLAGS_MATRIX.test_names)
+def test_compile_flags(optimization, warnings, warnings_are_errors, expected):
+    config = SimpleNamespace(optimization=optimization, warnings=warnings, warnings_are_errors=warnings_are_errors,
+                             additional_params=())
+    assert compile_flags(config) == expected
+
+
+def test_build_and_rebuild(project):
+    root, compiler, module = project
+    config = configuration(compiler, [module])
+    build_dir = root / "out"
+
+    result = build(config, build_dir, [root / "include"], workers=2)
+    assert result.succeeded
+    assert [r.status for r in result.jobs.values()] == [SUCCEEDED] * 4
+    assert (build_dir / "debug/app/app").read_text().count(".o") == 3
+    assert set(BuildHistory(build_dir / "debug/durations.json").durations) == set(result.jobs)
+
+    # Nothing changed, then only a.c changed
+    assert [r.status for r in build(config, build_dir, [root / "include"]).jobs.values()] == [UP_TO_DATE] * 4
+    stat = os.stat(root / "a.c")
+    os.utime(root / "a.c", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 10))
+    result = build(config, build_dir, [root / "include"])
+    assert {name: r.status for name, r in result.jobs.items()} == {
+        f"debug/app/{root / 'a.c'}": SUCCEEDED, f"debug/app/{root / 'b.c'}": UP_TO_DATE,
+        f"debug/app/{root / 'c.c'}": UP_TO_DATE, "debug/app": SUCCEEDED,
+    }
+
+    # Touching the header rebuilds everything that includes it
+    os.utime(root / "include/common.h", ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 10))
+    result = build(config, build_dir, [root / "include"])
+    assert [r.status for r in result.jobs.values()] == [SUCCEEDED] * 4
+
+
+def test_longest_jobs_first(project):
+    root, compiler, module = project
+    scans = {"app": [ScanResult(root / f"{n}.c", [], []) for n in "abc"]}
+    jobs = plan_build(configuration(compiler, [module]), root / "out", scans=scans)
+
+    history = BuildHistory()
+    for name, duration in (("a", 1.0), ("b", 5.0), ("c", 3.0)):
+        history.record(f"debug/app/{root / name}.c", duration)
+    history.record("debug/app", 2.0)
+
+    assert critical_path(jobs, history) == {f"debug/app/{root / 'a.c'}": 3.0, f"debug/app/{root / 'b.c'}": 7.0,
+                                            f"debug/app/{root / 'c.c'}": 5.0, "debug/app": 2.0}
+
+    assert run_build(jobs, workers=1, history=history).succeeded
+    assert [Path(line[0]).name for line in compile_log(compiler)] == ["b.c", "c.c", "a.c", jobs[0].output.name]
+
+
+FAILURE_MATRIX = NamedTestMatrix(
+    ("warnings_are_errors", "statuses"),
+    (
+        ("keep going",      False,  {"a": FAILED, "b": SUCCEEDED, "c": SUCCEEDED, "app": SKIPPED}),
+        ("stop early",      True,   {"a": FAILED, "b": SKIPPED, "c": SKIPPED, "app": SKIPPED}),
+    )
+)
+@pytest.mark.parametrize(FAILURE_MATRIX.arg_names, FAILURE_MATRIX.arg_values, ids=FAILURE_MATRIX.test_names)
+def test_failure(project, warnings_are_errors, statuses):
+    root, compiler, module = project
+    (root / "a.c").write_text("FAIL\n")
+    config = configuration(compiler, [module], warnings_are_errors)
+
+    # a.c has the longest history, so it runs first
+    history = BuildHistory(root / "out/debug/durations.json")
+    history.record(f"debug/app/{root / 'a.c'}", 10.0)
+    history.save()
+
+    result = build(config, root / "out", [root / "include"], workers=1)
+    assert not result.succeeded
+    assert {Path(name).stem: r.status for name, r in result.jobs.items()} == statuses
+    assert "error: FAIL" in result.jobs[f"debug/app/{root / 'a.c'}"].output
+
+
+def test_shared_source(project):
+    root, compiler, module = project
+    (root / "slow.c").write_text("int slow;\n")
+    first = SimpleNamespace(name="first", files={root / "a.c", root / "slow.c"}, variables={})
+    second = SimpleNamespace(name="second", files={root / "a.c", root / "b.c"}, variables={})
+    config = configuration(compiler, [first, second])
+
+    # Equal histories give the jobs that share a source equal priorities
+    history = BuildHistory(root / "out/debug/durations.json")
+    for name in ("first", "second"):
+        history.record(f"debug/{name}/{root / 'a.c'}", 1.0)
+    history.save()
+
+    result = build(config, root / "out", [root / "include"], workers=1)
+    assert result.succeeded
+    assert sorted(result.jobs) == sorted([f"debug/first/{root / 'a.c'}", f"debug/first/{root / 'slow.c'}",
+                                          f"debug/second/{root / 'a.c'}", f"debug/second/{root / 'b.c'}",
+                                          "debug/first", "debug/second"])
+    assert (root / "out/debug/first/first").read_text().count(".o") == 2
+    assert (root / "out/debug/second/second").read_text().count(".o") == 2
+
+
+def test_missing_compiler(tmp_path):
+    job = BuildJob("a", [str(tmp_path / "missing-cc")], [], tmp_path / "a.o")
+    dependent = BuildJob("b", ["true"], [], tmp_path / "b", [job])
+    result = run_build([job, dependent], workers=1)
+
+    assert [r.status for r in result.jobs.values()] == [FAILED, SKIPPED]
+
+
+def test_duplicate_names(tmp_path):
+    with pytest.raises(ValueError):
+        run_build([BuildJob("a", ["true"], [], tmp_path / "a"), BuildJob("a", ["true"], [], tmp_path / "b")])
@@ -0,0 +1,186 @@
+import pytest # NOQA
+import functools
+import http.server
+import tarfile
+import threading
+import zipfile
+from types import SimpleNamespace
+from .utilities import NamedTestMatrix
+from src.build.executor import FAILED
+from src.build.externals import BUILT, REUSED, ArtifactStore, external_key, fetch_externals
+
+
+SCRIPT = ["mkdir -p lib", "cat src.c > lib/libext.a", "echo \"$CFLAGS\" > lib/flags.txt"]
+
+
+def remote(url, name="ext", script=SCRIPT, artifacts=("lib/*",), required=True):
+    return SimpleNamespace(url=url, name=name, script=list(script), artifacts=list(artifacts), required=required)
+
+
+def local(path, name="local", script=SCRIPT, artifacts=("lib/*",), required=True):
+    return SimpleNamespace(path=path, name=name, script=list(script), artifacts=list(artifacts), required=required)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "src.c").write_text("int ext;\n")
+    with tarfile.open(tmp_path / "ext-1.0.tar.gz", "w:gz") as tar:
+        tar.add(source / "src.c", arcname="src.c")
+    return tmp_path / "ext-1.0.tar.gz"
+
+
+def test_fetch_build_and_reuse(tmp_path, archive):
+    store = ArtifactStore(tmp_path / "cache")
+    externals = [remote(archive.as_uri()), local(tmp_path / "source"), SimpleNamespace(name="sys", required=True)]
+
+    result = fetch_externals(externals, tmp_path / "project1/.externals", store)
+    assert result.succeeded
+    assert {name: r.status for name, r in result.externals.items()} == {"ext": BUILT, "local": BUILT}
+    assert (tmp_path / "project1/.externals/ext/lib/libext.a").read_text() == "int ext;\n"
+    assert sorted(p.name for p in (tmp_path / "project1/.externals/local/lib").iterdir()) == ["flags.txt", "libext.a"]
+
+    # Another project reuses both builds
+    result = fetch_externals(externals, tmp_path / "project2/.externals", store)
+    assert {name: r.status for name, r in result.externals.items()} == {"ext": REUSED, "local": REUSED}
+    assert (tmp_path / "project2/.externals/ext/lib/libext.a").exists()
+
+    # Changing a local external builds it again
+    (tmp_path / "source/src.c").write_text("int changed;\n")
+    result = fetch_externals(externals, tmp_path / "project2/.externals", store)
+    assert {name: r.status for name, r in result.externals.items()} == {"ext": REUSED, "local": BUILT}
+    assert (tmp_path / "project2/.externals/local/lib/libext.a").read_text() == "int changed;\n"
+
+
+KEY_MATRIX = NamedTestMatrix(
+    ("change", "same"),
+    (
+        ("nothing",         {},                                             True),
+        ("name",            {"name": "other", "required": False},           True),
+        ("url",             {"url": "file:///other.tar.gz"},                False),
+        ("script",          {"script": SCRIPT + ["true"]},                  False),
+        ("artifacts",       {"artifacts": ["lib/*.a"]},                     False),
+    )
+)
+@pytest.mark.parametrize(KEY_MATRIX.arg_names, KEY_MATRIX.arg_values, ids=KEY_MATRIX.test_names)
+def test_external_key(change, same):
+    external = remote("file:///ext.tar.gz")
+    changed = SimpleNamespace(**{**vars(external), **change})
+    assert (external_key(external) == external_key(changed)) == same
+
+
+def test_configuration_is_part_of_the_key(tmp_path, archive):
+    store = ArtifactStore(tmp_path / "cache")
+    configs = [SimpleNamespace(compiler=None, optimization=o, warnings=0, warnings_are_errors=False,
+                               additional_params=()) for o in (0, 2)]
+
+    for config in configs:
+        result = fetch_externals([remote(archive.as_uri())], tmp_path / str(config.optimization), store, config)
+        assert result.externals["ext"].status == BUILT
+
+    assert (tmp_path / "0/ext/lib/flags.txt").read_text() == "-O0\n"
+    assert (tmp_path / "2/ext/lib/flags.txt").read_text() == "-O3\n"
+
+
+FAILURE_MATRIX = NamedTestMatrix(
+    ("script", "artifacts", "required", "error"),
+    (
+        ("script fails",        ["exit 3"],     [],             True,   "exit code 3"),
+        ("missing artifact",    SCRIPT,         ["bin/tool"],   True,   "bin/tool was not built"),
+        ("optional",            ["false"],      [],             False,  "exit code 1"),
+    )
+)
+@pytest.mark.parametrize(FAILURE_MATRIX.arg_names, FAILURE_MATRIX.arg_values, ids=FAILURE_MATRIX.test_names)
+def test_failures(tmp_path, archive, script, artifacts, required, error):
+    store = ArtifactStore(tmp_path / "cache")
+    result = fetch_externals([remote(archive.as_uri(), script=script, artifacts=artifacts, required=required)],
+                             tmp_path / ".externals", store)
+
+    assert result.succeeded == (not required)
+    assert result.externals["ext"].status == FAILED
+    assert error in result.externals["ext"].error
+    assert [p.name for p in store.directory.iterdir()] == []
+
+
+def add_member(tar, name, member_type=tarfile.REGTYPE, linkname=""):
+    member = tarfile.TarInfo(name)
+    member.type = member_type
+    member.linkname = linkname
+    tar.addfile(member)
+
+
+UNSAFE_ARCHIVE_MATRIX = NamedTestMatrix(
+    ("suffix", "name", "member_type", "linkname", "error"),
+    (
+        ("parent path",         ".tar.gz", "../evil.c",    tarfile.REGTYPE,   "",         "outside of the archive"),
+        ("absolute path",       ".tar.gz", "/tmp/evil.c",  tarfile.REGTYPE,   "",         "outside of the archive"),
+        ("symlink out",         ".tar.gz", "lib",          tarfile.SYMTYPE,   "../..",    "links outside"),
+        ("absolute symlink",    ".tar.gz", "lib",          tarfile.SYMTYPE,   "/etc",     "links outside"),
+        ("hard link out",       ".tar.gz", "a",            tarfile.LNKTYPE,   "../a",     "links outside"),
+        ("device",              ".tar.gz", "tty",          tarfile.CHRTYPE,   "",         "not a file"),
+        ("zip parent path",     ".zip",    "../evil.c",    None,              None,       "outside of the archive"),
+    )
+)
+@pytest.mark.parametrize(UNSAFE_ARCHIVE_MATRIX.arg_names, UNSAFE_ARCHIVE_MATRIX.arg_values,
+                         ids=UNSAFE_ARCHIVE_MATRIX.test_names)
+def test_unsafe_archive(tmp_path, suffix, name, member_type, linkname, error):
+    path = tmp_path / "a/b" / f"ext{suffix}"
+    path.parent.mkdir(parents=True)
+    if suffix == ".zip":
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("src.c", "int ext;\n")
+            archive.writestr(name, "int evil;\n")
+    else:
+        with tarfile.open(path, "w:gz") as archive:
+            add_member(archive, "src.c")
+            add_member(archive, name, member_type, linkname)
+
+    store = ArtifactStore(tmp_path / "cache")
+    result = fetch_externals([remote(path.as_uri(), script=[], artifacts=())], tmp_path / ".externals", store)
+    assert result.externals["ext"].status == FAILED
+    assert error in result.externals["ext"].error
+    assert not list(tmp_path.glob("**/evil.c"))
+    assert [p.name for p in store.directory.iterdir()] == []
+
+
+def test_safe_symlink(tmp_path):
+    source = tmp_path / "src.c"
+    source.write_text("int ext;\n")
+    with tarfile.open(tmp_path / "ext.tar.gz", "w:gz") as tar:
+        tar.add(source, arcname="lib/src.c")
+        add_member(tar, "include/src.c", tarfile.SYMTYPE, "../lib/src.c")
+
+    result = fetch_externals([remote((tmp_path / "ext.tar.gz").as_uri(), script=[], artifacts=())],
+                             tmp_path / ".externals", ArtifactStore(tmp_path / "cache"))
+    assert result.succeeded
+    assert (tmp_path / ".externals/ext/include/src.c").read_text() == "int ext;\n"
+
+
+@pytest.mark.parametrize("name", ["", ".", "..", "../other", "a/b"])
+def test_unsafe_name(tmp_path, archive, name):
+    (tmp_path / "other").mkdir()
+    with pytest.raises(ValueError):
+        fetch_externals([remote(archive.as_uri(), name=name)], tmp_path / ".externals", ArtifactStore(tmp_path / "cache"))
+    assert (tmp_path / "other").exists()
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def test_fetch_concurrently_over_http(tmp_path, archive):
+    handler = functools.partial(QuietHandler, directory=str(tmp_path))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/{archive.name}"
+        externals = [remote(url, name=f"ext{i}", script=SCRIPT + [f"echo {i} > lib/{i}"]) for i in range(4)]
+        result = fetch_externals(externals, tmp_path / ".externals", ArtifactStore(tmp_path / "cache"), workers=4)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert result.succeeded
+    assert [(tmp_path / f".externals/ext{i}/lib/{i}").read_text() for i in range(4)] == ["0\n", "1\n", "2\n", "3\n"]
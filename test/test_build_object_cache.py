@@ -0,0 +1,135 @@
+import pytest # NOQA
+import os
+import shutil
+from types import SimpleNamespace
+from .utilities import NamedTestMatrix
+from .test_build_executor import configuration, compile_log
+from src.build.executor import CACHED, SUCCEEDED, build
+from src.build.object_cache import ObjectCache
+
+
+def write(path, text):
+    # Bump the mtime explicitly, in case the file system's resolution is too coarse to notice the edit
+    mtime = os.stat(path).st_mtime_ns if path.exists() else 0
+    path.write_text(text)
+    os.utime(path, ns=(mtime + 10 ** 10, mtime + 10 ** 10))
+
+
+def test_key_inputs(tmp_path):
+    (tmp_path / "a.c").write_text("int a;\n")
+    (tmp_path / "a.h").write_text("")
+    cache = ObjectCache(tmp_path / "cache")
+    command = ["true", "-O2", "-c", str(tmp_path / "a.c"), "-o", str(tmp_path / "out/a.o")]
+    key = cache.key(command, tmp_path / "out/a.o", [tmp_path / "a.c", tmp_path / "a.h"])
+
+    # The output path does not matter
+    moved = command[:-1] + [str(tmp_path / "other/a.o")]
+    assert cache.key(moved, tmp_path / "other/a.o", [tmp_path / "a.c", tmp_path / "a.h"]) == key
+
+    assert cache.key(["true", "-O3"] + command[2:], tmp_path / "out/a.o", [tmp_path / "a.c", tmp_path / "a.h"]) != key
+    assert cache.key(command, tmp_path / "out/a.o", [tmp_path / "a.c"]) != key
+    write(tmp_path / "a.h", "#define A\n")
+    assert cache.key(command, tmp_path / "out/a.o", [tmp_path / "a.c", tmp_path / "a.h"]) != key
+
+
+def test_key_base_dir(tmp_path):
+    keys = {}
+    for checkout in ("one", "two"):
+        root = tmp_path / checkout
+        (root / "include").mkdir(parents=True)
+        (root / "a.c").write_text("int a;\n")
+        (root / "include/a.h").write_text("")
+        command = ["true", f"-I{root / 'include'}", "-c", str(root / "a.c"), "-o", str(root / "out/a.o")]
+        inputs = [root / "a.c", root / "include/a.h"]
+        keys[checkout] = (ObjectCache(tmp_path / "cache", base_dir=root).key(command, root / "out/a.o", inputs),
+                          ObjectCache(tmp_path / "cache", base_dir=None).key(command, root / "out/a.o", inputs))
+
+    assert keys["one"][0] == keys["two"][0]
+    assert keys["one"][1] != keys["two"][1]
+
+
+def test_get_put_and_eviction(tmp_path):
+    # Each entry takes a 16 byte header and its object
+    cache = ObjectCache(tmp_path / "cache", max_bytes=60)
+    for name in "abc":
+        (tmp_path / f"{name}.o").write_bytes(name.encode() * 10)
+
+    assert cache.get("a", tmp_path / "out/a.o") is None
+    cache.put("a", tmp_path / "a.o")
+    cache.put("b", tmp_path / "b.o")
+    assert cache.get("a", tmp_path / "out/a.o") == ""
+    assert (tmp_path / "out/a.o").read_bytes() == b"a" * 10
+
+    # "b" is the least recently used
+    os.utime(cache.directory / "b", ns=(0, 0))
+    cache.put("c", tmp_path / "c.o")
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 1)
+    assert sorted(p.name for p in cache.directory.iterdir()) == ["a", "c"]
+    assert cache.size == 52
+
+    cache.clear()
+    assert cache.size == 0
+    assert cache.get("a", tmp_path / "out/a.o") is None
+
+
+def test_compiler_output_is_replayed(tmp_path):
+    (tmp_path / "a.o").write_bytes(b"object")
+    cache = ObjectCache(tmp_path / "cache")
+    cache.put("a", tmp_path / "a.o", "a.c:1: warning: \u2018x\u2019 unused\n")
+
+    assert cache.get("a", tmp_path / "out/a.o") == "a.c:1: warning: \u2018x\u2019 unused\n"
+    assert (tmp_path / "out/a.o").read_bytes() == b"object"
+
+    (cache.directory / "a").write_bytes(b"garbage")
+    assert cache.get("a", tmp_path / "out/b.o") is None
+    assert not (tmp_path / "out/b.o").exists()
+
+
+BUILD_MATRIX = NamedTestMatrix(
+    ("edit", "statuses"),
+    (
+        ("clean rebuild",   None,                               [CACHED, CACHED, CACHED, SUCCEEDED]),
+        ("edited source",   ("a.c", "int a = 1;\n"),            [SUCCEEDED, CACHED, CACHED, SUCCEEDED]),
+        ("edited header",   ("include/common.h", "#define C\n"), [SUCCEEDED, SUCCEEDED, SUCCEEDED, SUCCEEDED]),
+    )
+)
+@pytest.mark.parametrize(BUILD_MATRIX.arg_names, BUILD_MATRIX.arg_values, ids=BUILD_MATRIX.test_names)
+def test_build_with_cache(project, edit, statuses):
+    root, compiler, module = project
+    config = configuration(compiler, [module])
+    cache = ObjectCache(root / "cache")
+
+    assert build(config, root / "out", [root / "include"], workers=2, object_cache=cache).succeeded
+    if edit is not None:
+        write(root / edit[0], edit[1])
+
+    # A fresh build directory, as in a new checkout
+    result = build(config, root / "fresh", [root / "include"], workers=2, object_cache=cache)
+    assert result.succeeded
+    assert sorted(r.status for r in result.jobs.values()) == sorted(statuses)
+    assert (root / "fresh/debug/app/app").exists()
+    assert len(compile_log(compiler)) == 4 + statuses.count(SUCCEEDED)
+
+
+def test_build_with_cache_elsewhere(project):
+    root, compiler, module = project
+    (root / "a.c").write_text("WARN\n")
+    results = []
+    for checkout in ("one", "two"):
+        shutil.copytree(root / "include", root / checkout / "include")
+        for name in "abc":
+            shutil.copy(root / f"{name}.c", root / checkout / f"{name}.c")
+        moved = SimpleNamespace(name="app", files={root / checkout / f"{n}.c" for n in "abc"}, variables={"APP": "1"})
+
+        cache = ObjectCache(root / "cache", base_dir=root / checkout)
+        results.append(build(configuration(compiler, [moved]), root / checkout / "out", [root / checkout / "include"],
+                             object_cache=cache))
+
+    first, second = (sorted(r.status for name, r in result.jobs.items() if name != "debug/app") for result in results)
+    assert first == [SUCCEEDED] * 3
+    assert second == [CACHED] * 3
+
+    # The warning is shown again, although the compiler did not run
+    warnings = [[r.output for name, r in result.jobs.items() if name.endswith("a.c")][0] for result in results]
+    assert warnings[0].endswith(": warning: WARN\n")
+    assert warnings[1] == warnings[0]
@@ -55,4 +55,45 @@ LINE_SPLICING_MATRIX = NamedTestMatrix(
 @pytest.mark.parametrize(LINE_SPLICING_MATRIX.arg_names, LINE_SPLICING_MATRIX.arg_values, ids=LINE_SPLICING_MATRIX.test_names)
 def test_line_splicer(test_input, expected_objects):
     actual = LogicalLine.splice_lines(test_input)
-    assert actual == expected_objects
\ No newline at end of file
+    assert actual == expected_objects
+
+
+SLICE_TEST_MATRIX = NamedTestMatrix(
+    ("test_object", "test_index", "expected_str"),
+    (
+        ("negative int",        LogicalLine([(0, "abc"), (1, "def")]),              -1,             "f"),
+        ("full range",          LogicalLine([(0, "abc"), (1, "def")]),              range(0, 6),    "abcdef"),
+        ("slice",               LogicalLine([(0, "abc"), (1, "def")]),              slice(2, None), "cdef"),
+        ("empty slice",         LogicalLine([(0, "abc"), (1, "def")]),              slice(4, 2),    ""),
+        ("stepped slice",       LogicalLine([(0, "abc"), (1, "def")]),              slice(0, 6, 2), "ace"),
+        ("empty segment",       LogicalLine([(0, "ab"), (1, ""), (2, "cd")]),        2,              "c"),
+        ("segment boundary",    LogicalLine([(0, "ab"), (1, "cd"), (2, "ef")]),      range(2, 4),    "cd"),
+    )
+)
+@pytest.mark.parametrize(SLICE_TEST_MATRIX.arg_names, SLICE_TEST_MATRIX.arg_values, ids=SLICE_TEST_MATRIX.test_names)
+def test_get_item_slices(test_object, test_index, expected_str):
+    assert test_object[test_index] == expected_str
+
+
+def test_get_item_out_of_range():
+    with pytest.raises(IndexError):
+        LogicalLine([(0, "abc")])[3]
+
+
+MAP_TO_PHYSICAL_MATRIX = NamedTestMatrix(
+    ("test_input", "index", "expected"),
+    (
+        ("first segment",       "#define A \\\n  1",        3,      (0, 3)),
+        ("second segment",      "#define A \\\n  1",        12,     (1, 2)),
+        ("negative",            "#define A \\\n  1",        -1,     (1, 2)),
+        ("leading backslash",   "#if A \\\n\\\\B",          6,      (1, 2)),
+        ("later line",          "x\n#if \\\n\\\nC",         4,      (3, 0)),
+    )
+)
+@pytest.mark.parametrize(MAP_TO_PHYSICAL_MATRIX.arg_names, MAP_TO_PHYSICAL_MATRIX.arg_values, ids=MAP_TO_PHYSICAL_MATRIX.test_names)
+def test_map_to_physical(test_input, index, expected):
+    logical_line = LogicalLine.splice_lines(test_input)[-1]
+    line_index, column = logical_line.map_to_physical(index)
+
+    assert (line_index, column) == expected
+    assert test_input.splitlines()[line_index][column] == logical_line[index]
@@ -0,0 +1,99 @@
+import os
+import pytest # NOQA
+from src.preprocessor import cache as cache_module
+from src.preprocessor.cache import ASTCache
+from src.preprocessor.parser import IncludeDirective, ObjectMacro
+
+
+def write_header(path, text):
+    path.write_text(text)
+    return path
+
+
+def test_miss_then_hit(tmp_path):
+    header = write_header(tmp_path / "a.h", "#include <b.h>\nint x;\n#define A 1\n")
+    cache = ASTCache(tmp_path / "cache")
+
+    first = cache.parse(header)
+    second = ASTCache(tmp_path / "cache").parse(header)
+
+    assert cache.misses == 1 and cache.hits == 0
+    assert second[0] == IncludeDirective("b.h", False)
+    assert isinstance(second[1], ObjectMacro)
+    assert [t.value.group() for t in second[1].tokens] == [t.value.group() for t in first[1].tokens] == ["1"]
+
+
+def test_changed_file_is_reparsed(tmp_path):
+    header = write_header(tmp_path / "a.h", "#include <b.h>\n")
+    cache = ASTCache(tmp_path / "cache")
+    cache.parse(header)
+
+    write_header(header, "#include <cc.h>\n")
+    stat = header.stat()
+    os.utime(header, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert cache.parse(header) == [IncludeDirective("cc.h", False)]
+    assert cache.misses == 2
+
+
+def test_edit_during_parse(tmp_path, monkeypatch):
+    header = write_header(tmp_path / "a.h", "#include <b.h>\n")
+    parse = cache_module.scan_buffer_compact
+
+    def parse_then_edit(data, encoding):
+        ast = parse(data, encoding)
+        write_header(header, "#include <cc.h>\n")
+        stat = header.stat()
+        os.utime(header, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        return ast
+
+    monkeypatch.setattr(cache_module, "scan_buffer_compact", parse_then_edit)
+    assert ASTCache(tmp_path / "cache").parse(header) == [IncludeDirective("b.h", False)]
+    monkeypatch.undo()
+
+    cache = ASTCache(tmp_path / "cache")
+    assert cache.parse(header) == [IncludeDirective("cc.h", False)]
+    assert cache.misses == 1
+
+
+def test_touched_file_is_a_hit(tmp_path):
+    header = write_header(tmp_path / "a.h", "#include <b.h>\n")
+    cache = ASTCache(tmp_path / "cache")
+    cache.parse(header)
+
+    stat = header.stat()
+    os.utime(header, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert cache.parse(header) == [IncludeDirective("b.h", False)]
+    assert cache.parse(header) == [IncludeDirective("b.h", False)]
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    header = write_header(tmp_path / "a.h", "#include <b.h>\n")
+    cache = ASTCache(tmp_path / "cache")
+    cache.parse(header)
+
+    for entry in cache.directory.iterdir():
+        entry.write_bytes(b"garbage")
+
+    assert cache.get(header) is None
+    assert cache.parse(header) == [IncludeDirective("b.h", False)]
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    headers = [write_header(tmp_path / f"{i}.h", f"#include <{i}.h>\n") for i in range(3)]
+    probe = ASTCache(tmp_path / "probe")
+    probe.parse(headers[0])
+    entry_size = next(probe.directory.iterdir()).stat().st_size
+
+    cache = ASTCache(tmp_path / "cache", max_bytes=2 * entry_size)
+    for i, header in enumerate(headers):
+        cache.parse(header)
+        for entry in cache.directory.iterdir():
+            # Give every entry a distinct age
+            os.utime(entry, ns=(0, entry.stat().st_mtime_ns - 10 ** 9 * (3 - i)))
+
+    assert cache.evictions == 1
+    assert cache.get(headers[0]) is None
+    assert cache.get(headers[2]) is not None
@@ -0,0 +1,140 @@
+import pytest # NOQA
+import os
+from .utilities import NamedTestMatrix
+from src.preprocessor import dependency_db
+from src.preprocessor.dependency_db import DependencyDB, configuration_key, scan_incremental
+from src.preprocessor.parallel import scan_parallel
+
+
+FILES = {
+    "include/common.h": "#pragma once\n#include \"detail.h\"\n",
+    "include/detail.h": "#define DETAIL 1\n",
+    "include/feature.h": "",
+    "a.c": "#include <common.h>\n",
+    "b.c": "#include <common.h>\n#include <feature.h>\n",
+    "c.c": "#include <feature.h>\n",
+    "d.c": "int main() { return 0; }\n",
+}
+
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / "include").mkdir()
+    for path, text in FILES.items():
+        (tmp_path / path).write_text(text)
+    return tmp_path
+
+
+def scan(root, **kwargs):
+    return scan_incremental(root.glob("*.c"), [root / "include"], workers=1, cache_dir=root / ".cache", **kwargs)
+
+
+def edit(path, text):
+    # Bump the mtime explicitly, in case the file system's resolution is too coarse to notice the edit
+    stat = os.stat(path)
+    path.write_text(text)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+EDIT_MATRIX = NamedTestMatrix(
+    ("path", "text", "rescanned"),
+    (
+        ("leaf source",         "d.c",                  "int main() { return 1; }\n",       ["d.c"]),
+        ("shared header",       "include/feature.h",    "#define FEATURE\n",                ["b.c", "c.c"]),
+        ("nested header",       "include/detail.h",     "#define DETAIL 2\n",               ["a.c", "b.c"]),
+        ("new include",         "c.c",                  "#include <common.h>\n",            ["c.c"]),
+        ("touched",             "include/common.h",     FILES["include/common.h"],          []),
+    )
+)
+@pytest.mark.parametrize(EDIT_MATRIX.arg_names, EDIT_MATRIX.arg_values, ids=EDIT_MATRIX.test_names)
+def test_rescan_after_edit(tree, path, text, rescanned):
+    first = scan(tree)
+    assert [p.name for p in first.rescanned] == ["a.c", "b.c", "c.c", "d.c"]
+
+    edit(tree / path, text)
+    second = scan(tree)
+
+    assert [p.name for p in second.rescanned] == rescanned
+    assert second.results == scan_parallel(tree.glob("*.c"), [tree / "include"], workers=1)
+
+
+def test_rescan_new_and_removed_units(tree):
+    scan(tree)
+    (tree / "e.c").write_text("#include <feature.h>\n")
+    (tree / "d.c").unlink()
+
+    result = scan(tree)
+    assert [p.name for p in result.rescanned] == ["e.c"]
+    assert [r.path.name for r in result.results] == ["a.c", "b.c", "c.c", "e.c"]
+
+    with DependencyDB(tree / ".cache", configuration_key([tree / "include"])) as db:
+        assert db.load(tree / "d.c") is None
+        assert [p.name for p in db.dependents(tree / "include/feature.h")] == ["b.c", "c.c", "e.c"]
+
+
+def test_rescan_unresolved_and_deleted(tree):
+    (tree / "f.c").write_text("#include <later.h>\n")
+    scan(tree)
+    assert [p.name for p in scan(tree).rescanned] == ["f.c"]
+
+    (tree / "include/later.h").write_text("")
+    result = scan(tree)
+    assert result.results[-1].dependencies == [tree / "include/later.h"]
+    assert scan(tree).rescanned == []
+
+    (tree / "include/later.h").unlink()
+    result = scan(tree)
+    assert [p.name for p in result.rescanned] == ["f.c"]
+    assert [d.path for d in result.results[-1].unresolved] == ["later.h"]
+
+
+def test_configurations_are_separate(tree):
+    scan(tree)
+    assert len(scan(tree, defines={"X": "1"}).rescanned) == 4
+    assert scan(tree).rescanned == []
+
+    # Rescanning with one configuration does not hide the edit from the other
+    edit(tree / "include/detail.h", "#define DETAIL 2\n")
+    assert [p.name for p in scan(tree).rescanned] == ["a.c", "b.c"]
+    assert [p.name for p in scan(tree, defines={"X": "1"}).rescanned] == ["a.c", "b.c"]
+
+
+EDIT_DURING_SCAN_MATRIX = NamedTestMatrix(
+    ("path", "text", "rescanned"),
+    (
+        ("known header",        "include/detail.h",     "#define DETAIL 3\n",          ["a.c", "b.c"]),
+        ("new header",          "include/new.h",        "#define NEW 2\n",             ["d.c"]),
+    )
+)
+@pytest.mark.parametrize(EDIT_DURING_SCAN_MATRIX.arg_names, EDIT_DURING_SCAN_MATRIX.arg_values,
+                         ids=EDIT_DURING_SCAN_MATRIX.test_names)
+def test_edit_during_scan(tree, monkeypatch, path, text, rescanned):
+    scan(tree)
+    (tree / "include/new.h").write_text("#define NEW 1\n")
+    edit(tree / "d.c", "#include <new.h>\n")
+    edit(tree / "include/detail.h", "#define DETAIL 2\n")
+
+    def scan_then_edit(*args, **kwargs):
+        results = scan_parallel(*args, **kwargs)
+        edit(tree / path, text)
+        return results
+
+    monkeypatch.setattr(dependency_db, "scan_parallel", scan_then_edit)
+    assert [p.name for p in scan(tree).rescanned] == ["a.c", "b.c", "d.c"]
+    monkeypatch.undo()
+
+    assert [p.name for p in scan(tree).rescanned] == rescanned
+
+
+def test_touched_file_hashed_once(tree):
+    scan(tree)
+    edit(tree / "include/feature.h", "")
+
+    with DependencyDB(tree / ".cache", configuration_key([tree / "include"])) as db:
+        assert not db.is_stale(tree / "b.c")
+        assert not db.is_stale(tree / "c.c")
+        assert db.hashed == 1
+
+    with DependencyDB(tree / ".cache", configuration_key([tree / "include"])) as db:
+        assert not db.changed(tree / "include/feature.h")
+        assert db.hashed == 0
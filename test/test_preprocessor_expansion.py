@@ -0,0 +1,127 @@
+import pytest # NOQA
+from .utilities import NamedTestMatrix
+from src.preprocessor.tokenizer import TokenType, tokenize_line
+from src.preprocessor.expansion import MacroExpander
+from src.preprocessor.interpreter import evaluate_ast
+from src.preprocessor.macro_table import MacroTable
+from src.preprocessor.parser import IncludeDirective
+from src.preprocessor.scanner import scan_directives
+from src.preprocessor.shunting_yard import PreprocessorSyntaxError
+
+
+def line_tokens(text):
+    return [t for t in tokenize_line(text) if t.type is not TokenType.WHITESPACE]
+
+
+def macro_table(source):
+    return MacroTable({m.identifier: m for m in scan_directives(source)})
+
+
+def spell(tokens):
+    return " ".join(t.value.group() for t in tokens)
+
+
+EXPAND_MATRIX = NamedTestMatrix(
+    ("macros", "text", "expected"),
+    (
+        ("object",              "#define A 1\n",                            "A + B",            "1 + B"),
+        ("nested",              "#define A B\n#define B 2\n",               "A",                "2"),
+        ("self reference",      "#define A A + 1\n",                        "A",                "A + 1"),
+        ("mutual recursion",    "#define A B\n#define B A\n",               "A B",              "A B"),
+        ("function",            "#define F(a, b) b - a\n",                  "F(1, 2)",          "2 - 1"),
+        ("nested parens",       "#define F(a) [a]\n",                       "F((1, 2))",        "[ ( 1 , 2 ) ]"),
+        ("no arguments",        "#define F() 3\n",                          "F()",              "3"),
+        ("name without call",   "#define F(a) a\n",                         "F + 1",            "F + 1"),
+        ("argument expanded",   "#define A 1\n#define F(a) a\n",            "F(A)",             "1"),
+        ("call after object",   "#define F G\n#define G(a) a + 1\n",        "F(2)",             "2 + 1"),
+        ("rescan with rest",    "#define f(a) a*g\n#define g(a) f(a)\n",     "f(2)(9)",          "2 * 9 * g"),
+        ("stringize",           "#define S(a) #a\n",                        "S(x  +   \"y\")",  "\"x + \\\"y\\\"\""),
+        ("paste",               "#define P(a, b) a ## b\n",                 "P(x, 1)",          "x1"),
+        ("paste not expanded",  "#define A 1\n#define P(a) a ## _t\n",      "P(A)",             "A_t"),
+        ("paste then expand",   "#define xy 5\n#define P(a, b) a##b\n",     "P(x, y)",          "5"),
+        ("paste empty",         "#define P(a, b) a ## b\n",                 "P(, y) P(x, )",    "y x"),
+        ("object paste",        "#define V 1 ## 2\n",                       "V",                "12"),
+    )
+)
+@pytest.mark.parametrize(EXPAND_MATRIX.arg_names, EXPAND_MATRIX.arg_values, ids=EXPAND_MATRIX.test_names)
+def test_expand(macros, text, expected):
+    assert spell(MacroExpander().expand(line_tokens(text), macro_table(macros))) == expected
+
+
+DEFINED_MATRIX = NamedTestMatrix(
+    ("macros", "text", "expected"),
+    (
+        ("defined",             "#define A 1\n",                            "defined A",        "1"),
+        ("parenthesized",       "#define A 1\n",                            "defined(B)",       "0"),
+        ("operand not expanded", "#define A B\n#define B 1\n",              "defined(A) + A",   "1 + 1"),
+        ("from macro",          "#define HAS_X defined(X)\n#define X\n",   "HAS_X",            "1"),
+    )
+)
+@pytest.mark.parametrize(DEFINED_MATRIX.arg_names, DEFINED_MATRIX.arg_values, ids=DEFINED_MATRIX.test_names)
+def test_expand_expression(macros, text, expected):
+    assert spell(MacroExpander().expand_expression(line_tokens(text), macro_table(macros))) == expected
+
+
+ERROR_MATRIX = NamedTestMatrix(
+    ("macros", "text"),
+    (
+        ("too many arguments",  "#define F(a) a\n",     "F(1, 2)"),
+        ("too few arguments",   "#define F(a, b) a\n",  "F(1)"),
+        ("unterminated call",   "#define F(a) a\n",     "F(1"),
+    )
+)
+@pytest.mark.parametrize(ERROR_MATRIX.arg_names, ERROR_MATRIX.arg_values, ids=ERROR_MATRIX.test_names)
+def test_expand_errors(macros, text):
+    with pytest.raises(PreprocessorSyntaxError):
+        MacroExpander().expand(line_tokens(text), macro_table(macros))
+
+
+def test_memoized_until_redefined():
+    expander = MacroExpander()
+    table = macro_table("#define VERSION MAJOR * 100\n#define MAJOR 2\n")
+
+    for _ in range(3):
+        assert spell(expander.expand(line_tokens("VERSION"), table)) == "2 * 100"
+    assert (expander.hits, expander.misses) == (2, 1)
+
+    # An unrelated definition changes the generation, but the entry is still valid
+    evaluate_ast(scan_directives("#define OTHER 1\n"), table)
+    assert spell(expander.expand(line_tokens("VERSION"), table)) == "2 * 100"
+    assert (expander.hits, expander.misses) == (3, 1)
+
+    evaluate_ast(scan_directives("#define MAJOR 3\n"), table)
+    assert spell(expander.expand(line_tokens("VERSION"), table)) == "3 * 100"
+    assert (expander.hits, expander.misses) == (3, 2)
+
+    expander.clear()
+    assert spell(expander.expand(line_tokens("VERSION"), table)) == "3 * 100"
+    assert (expander.hits, expander.misses) == (3, 3)
+
+
+def test_trailing_function_name_not_memoized():
+    expander = MacroExpander()
+    table = macro_table("#define F G\n#define G(a) a\n")
+
+    assert spell(expander.expand(line_tokens("F(1) F"), table)) == "1 G"
+    assert expander.memo == {}
+
+
+INTERPRETER_MATRIX = NamedTestMatrix(
+    ("source", "expected"),
+    (
+        ("computed include",    "#define HEADER(name) <name.h>\n#include HEADER(stdio)\n",                 {"stdio.h"}),
+        ("include string",      "#define CONFIG \"config.h\"\n#include CONFIG\n",                           {"config.h"}),
+        ("version check",       "#define MAJOR 1\n#define MINOR 2\n#define AT_LEAST(a, b) (MAJOR > a || (MAJOR == a && MINOR >= b))\n"
+                                "#if AT_LEAST(1, 1)\n#include <new.h>\n#else\n#include <old.h>\n#endif\n",  {"new.h"}),
+        ("hidden is zero",      "#define A A\n#if A == 0\n#include <a.h>\n#endif\n",                        {"a.h"}),
+    )
+)
+@pytest.mark.parametrize(INTERPRETER_MATRIX.arg_names, INTERPRETER_MATRIX.arg_values, ids=INTERPRETER_MATRIX.test_names)
+def test_interpreter_expands_macros(source, expected):
+    assert {d.path for d in evaluate_ast(scan_directives(source))} == expected
+    assert {d.path for d in evaluate_ast(list(scan_directives(source)))} == expected
+
+
+def test_resolve_include_keeps_kind():
+    source = "#define LOCAL \"a.h\"\n#define SYSTEM <a.h>\n#include LOCAL\n#include SYSTEM\n"
+    assert evaluate_ast(scan_directives(source)) == {IncludeDirective("a.h", True), IncludeDirective("a.h", False)}
@@ -0,0 +1,131 @@
+import pytest # NOQA
+from .utilities import NamedTestMatrix
+from src.preprocessor.tokenizer import TokenType, tokenize_line
+from src.preprocessor.expression import ExpressionCache, compile_expression
+from src.preprocessor.scanner import scan_directives
+from src.preprocessor.shunting_yard import PreprocessorSyntaxError
+
+
+def expression_tokens(expression):
+    return [t for t in tokenize_line(expression) if t.type is not TokenType.WHITESPACE]
+
+
+def macro_table(source):
+    return {m.identifier: m for m in scan_directives(source)}
+
+
+MACROS = macro_table("#define ONE 1\n#define TWO 2\n#define ALIAS TWO\n#define GT (TWO > ONE)\n#define SELF SELF\n#define F(x) x\n#define EMPTY\n"
+                     "#define GNUC 4\n#define GNUC_MINOR 6\n")
+
+
+EXPRESSION_MATRIX = NamedTestMatrix(
+    ("expression", "expected"),
+    (
+        ("literal",             "1",                            1),
+        ("hex literal",         "0x10 == 16",                   True),
+        ("suffixed literal",    "10UL > 9",                     True),
+        ("parenthesis",         "(2 > 1)",                      True),
+        ("comparison order",    "1 < 2",                        True),
+        ("not",                 "!0",                           True),
+        ("precidence",          "0 && 1 || 1",                  True),
+        ("left associative",    "3 > 2 == 1",                   True),
+        ("defined",             "defined(ONE) && defined TWO",  True),
+        ("not defined",         "!defined(THREE)",              True),
+        ("undefined is zero",   "THREE == 0",                   True),
+        ("macro value",         "ONE < TWO",                    True),
+        ("nested macro",        "ALIAS == 2",                   True),
+        ("expression macro",    "GT",                           True),
+        ("self reference",      "SELF == 0",                    True),
+        ("function macro",      "F == 0",                       True),
+        ("empty macro",         "EMPTY == 0",                   True),
+        ("octal literal",       "010 == 8",                     True),
+        ("arithmetic",          "2 + 3 * 4 - 10 / 5",           12),
+        ("version check",       "GNUC * 100 + GNUC_MINOR >= 406", True),
+        ("shift",               "1 << 2 + 1 >> 1",              4),
+        ("shift before compare", "1 << 3 > 4",                  True),
+        ("unary minus",         "-ONE - -TWO",                  1),
+        ("unary plus",          "+ONE == 1",                    True),
+        ("not negative",        "!-1",                          False),
+        ("division truncates",  "-7 / 2 == -3 && -7 % 2 == -1", True),
+        ("conditional",         "ONE ? TWO : 3",                2),
+        ("conditional false",   "ONE > TWO ? 1 : ONE + 4",      5),
+        ("nested conditional",  "0 ? 1 : ONE ? 2 : 3",          2),
+        ("conditional in middle", "1 ? 0 ? 2 : 3 : 4",          3),
+        ("conditional operands", "ONE || 0 ? 1 + 1 : 0",        2),
+        ("lazy conditional",    "ONE ? 5 : 1 / 0",              5),
+        ("bitwise and",         "(3 & 1) == 1",                 True),
+        ("bitwise or",          "(1<<8|2) > 3",                 True),
+        ("bitwise xor",         "6 ^ 3",                        5),
+        ("bitwise not",         "~ONE == -2",                   True),
+        ("bitwise precidence",  "1 | 6 ^ 3 & 5",                7),
+        ("bitwise below equality", "2 & 2 == 2",                0),
+        ("bitwise above and",   "1 & 0 && 1 | 0",               False),
+        ("version mask",        "((GNUC)<<8|(GNUC_MINOR)) >= 0x0406", True),
+    )
+)
+@pytest.mark.parametrize(EXPRESSION_MATRIX.arg_names, EXPRESSION_MATRIX.arg_values, ids=EXPRESSION_MATRIX.test_names)
+def test_evaluate(expression, expected):
+    assert ExpressionCache().evaluate(expression_tokens(expression), MACROS) == expected
+
+
+def test_short_circuit():
+    calls = []
+
+    class RecordingTable(dict):
+        def get(self, name, default=None):
+            calls.append(name)
+            return super().get(name, default)
+
+    compiled = compile_expression(expression_tokens("0 && A || 1 || B"))
+    assert compiled(RecordingTable())
+    assert calls == []
+
+
+def test_identifiers():
+    compiled = compile_expression(expression_tokens("defined(A) && B > C"))
+    assert compiled.identifiers == {"A", "B", "C"}
+
+
+def test_memoized_on_macro_values():
+    cache = ExpressionCache()
+    tokens = expression_tokens("defined(X) && Y > 2")
+
+    assert not cache.evaluate(tokens, macro_table("#define X\n#define Y 1\n"))
+    assert not cache.evaluate(tokens, macro_table("#define X\n#define Y 1\n#define Z 5\n"))
+    assert cache.evaluate(tokens, macro_table("#define X\n#define Y 3\n"))
+    assert cache.evaluate(expression_tokens("defined(X) && Y > 2"), macro_table("#define X\n#define Y 3\n"))
+
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert len(cache.compiled) == 1
+
+    cache.clear()
+    assert cache.evaluate(tokens, macro_table("#define X\n#define Y 3\n"))
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_memo_sees_nested_redefinition():
+    cache = ExpressionCache()
+    tokens = expression_tokens("Y > 2")
+
+    assert not cache.evaluate(tokens, macro_table("#define Y Z\n#define Z 1\n"))
+    assert cache.evaluate(tokens, macro_table("#define Y Z\n#define Z 3\n"))
+
+
+SYNTAX_ERROR_MATRIX = NamedTestMatrix(
+    ("expression", ),
+    (
+        ("missing operand",     "1 &&"),
+        ("defined literal",     "defined 1"),
+        ("unbalanced",          "(1"),
+        ("unsupported",         "1 @ 2"),
+        ("invalid octal",       "08"),
+        ("missing colon",       "1 ? 2"),
+        ("missing question",    "1 : 2"),
+        ("colon in parenthesis", "1 ? (2 : 3)"),
+        ("division by zero",    "1 / (ONE - 1)"),
+    )
+)
+@pytest.mark.parametrize(SYNTAX_ERROR_MATRIX.arg_names, SYNTAX_ERROR_MATRIX.arg_values, ids=SYNTAX_ERROR_MATRIX.test_names)
+def test_syntax_errors(expression):
+    with pytest.raises((PreprocessorSyntaxError, ValueError)):
+        compile_expression(expression_tokens(expression))(MACROS)
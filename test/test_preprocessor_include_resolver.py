@@ -0,0 +1,65 @@
+import pytest # NOQA
+from .utilities import NamedTestMatrix
+from src.preprocessor.include_resolver import IncludeResolver
+from src.preprocessor.parser import IncludeDirective
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for path in ("src/main.c", "src/local.h", "src/sub/inner.h", "include/local.h", "include/sys/types.h",
+                 "include/shared.h", "system/shared.h", "system/only.h", "quote/quoted.h"):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("")
+    return tmp_path
+
+
+RESOLVE_MATRIX = NamedTestMatrix(
+    ("path", "expanded", "expected"),
+    (
+        ("quoted relative first",   "local.h",          True,   "src/local.h"),
+        ("angle skips relative",    "local.h",          False,  "include/local.h"),
+        ("nested directory",        "sys/types.h",      False,  "include/sys/types.h"),
+        ("first directory wins",    "shared.h",         False,  "include/shared.h"),
+        ("later directory",         "only.h",           False,  "system/only.h"),
+        ("quote directory",         "quoted.h",         True,   "quote/quoted.h"),
+        ("quote dirs not angle",    "quoted.h",         False,  None),
+        ("relative subdirectory",   "sub/inner.h",      True,   "src/sub/inner.h"),
+        ("parent directory",        "../include/sys/types.h", True, "include/sys/types.h"),
+        ("directory is not a file", "sys",              False,  None),
+        ("missing",                 "missing.h",        True,   None),
+    )
+)
+@pytest.mark.parametrize(RESOLVE_MATRIX.arg_names, RESOLVE_MATRIX.arg_values, ids=RESOLVE_MATRIX.test_names)
+def test_resolve(tree, path, expanded, expected):
+    resolver = IncludeResolver([tree / "include", tree / "system"], [tree / "quote"])
+    actual = resolver.resolve(IncludeDirective(path, expanded), tree / "src/main.c")
+
+    assert actual == (tree / expected if expected is not None else None)
+
+
+def test_directories_listed_once(tree):
+    resolver = IncludeResolver([tree / "include", tree / "system"])
+    directives = [IncludeDirective(p, False) for p in ("only.h", "sys/types.h", "missing.h", "other/missing.h")]
+
+    for directive in directives:
+        resolver.resolve(directive)
+    scans = resolver.scans
+    # include, include/sys and system. Missing subdirectories are never listed
+    assert scans == 3
+
+    for directive in directives:
+        resolver.resolve(directive)
+    assert resolver.scans == scans
+    assert (resolver.hits, resolver.misses) == (4, 4)
+
+
+def test_negative_lookups_cached_until_cleared(tree):
+    resolver = IncludeResolver([tree / "include"])
+    directive = IncludeDirective("new.h", False)
+
+    assert resolver.resolve(directive) is None
+    (tree / "include/new.h").write_text("")
+    assert resolver.resolve(directive) is None
+
+    resolver.clear()
+    assert resolver.resolve(directive) == tree / "include/new.h"
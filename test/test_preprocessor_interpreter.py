@@ -1,2 +1,125 @@
 import pytest
-from src.preprocessor.interpreter import evaluate_ast
+from .utilities import NamedTestMatrix
+from src.preprocessor.interpreter import evaluate_ast, evaluate_file, evaluate_lines
+from src.preprocessor.parser import IncludeDirective
+from src.preprocessor.scanner import parse_stream, scan_directives
+from src.preprocessor.string_santization import Sanitizer
+
+
+EVALUATE_AST_MATRIX = NamedTestMatrix(
+    ("source", "expected"),
+    (
+        ("plain include",       "#include <a.h>\n",                                                 {"a.h"}),
+        ("ifdef defined",       "#define A 1\n#ifdef A\n#include <a.h>\n#endif\n",                  {"a.h"}),
+        ("ifdef undefined",     "#ifdef A\n#include <a.h>\n#endif\n#include <b.h>\n",               {"b.h"}),
+        ("ifndef",              "#ifndef A\n#include <a.h>\n#else\n#include <b.h>\n#endif\n",       {"a.h"}),
+        ("else",                "#if 0\n#include <a.h>\n#else\n#include <b.h>\n#endif\n",           {"b.h"}),
+        ("elif",                "#if 0\n#include <a.h>\n#elif 2 > 1\n#include <b.h>\n#else\n#include <c.h>\n#endif\n", {"b.h"}),
+        ("first branch only",   "#if 1\n#include <a.h>\n#elif 1\n#include <b.h>\n#endif\n",           {"a.h"}),
+        ("nested inactive",     "#if 0\n#if 1\n#include <a.h>\n#else\n#include <b.h>\n#endif\n#endif\n", set()),
+        ("nested active",       "#ifndef G\n#define G\n#ifdef G\n#include <a.h>\n#endif\n#endif\n", {"a.h"}),
+        ("define in branch",    "#if 0\n#define A\n#endif\n#ifdef A\n#include <a.h>\n#endif\n",      set()),
+    )
+)
+@pytest.mark.parametrize(EVALUATE_AST_MATRIX.arg_names, EVALUATE_AST_MATRIX.arg_values, ids=EVALUATE_AST_MATRIX.test_names)
+def test_evaluate_ast(source, expected):
+    streamed = evaluate_ast(scan_directives(source))
+    indexed = evaluate_ast(list(scan_directives(source)))
+    lazy = evaluate_lines(Sanitizer.sanitize(source, directives_only=True))
+
+    assert {d.path for d in streamed} == expected
+    assert {d.path for d in indexed} == expected
+    assert {d.path for d in lazy} == expected
+
+
+def test_evaluate_ast_updates_macro_table():
+    macro_table = {}
+    evaluate_ast(scan_directives("#define A 1\n"), macro_table)
+    assert "A" in macro_table
+
+
+def test_evaluate_file_spaced_directives(tmp_path):
+    path = tmp_path / "a.c"
+    path.write_text("#ifdef A\n  # ifndef B\n  # endif\n#else\n# include <b.h>\n#\n#endif\n")
+
+    assert evaluate_file(path) == {IncludeDirective("b.h", False)}
+
+
+def test_undef_and_error():
+    macro_table = {}
+    evaluate_ast(scan_directives("#define A 1\n#undef A\n#undef B\n"), macro_table)
+    assert "A" not in macro_table
+
+    with pytest.raises(Exception):
+        evaluate_ast(scan_directives("#ifndef A\n#error A is required\n#endif\n"))
+
+
+def test_evaluate_ast_consumes_lazily():
+    consumed = []
+
+    def lines():
+        for line in ("#include <a.h>\n", "int x;\n", "#if 1\n", "#endif\n"):
+            consumed.append(line)
+            yield line
+
+    objects = parse_stream(lines())
+    next(objects)
+    assert consumed == ["#include <a.h>\n"]
+
+    assert evaluate_ast(objects) == set()
+    assert len(consumed) == 4
+
+
+UNBALANCED_MATRIX = NamedTestMatrix(
+    ("source", ),
+    (
+        ("endif without if",    "#endif\n"),
+        ("else without if",     "#else\n"),
+        ("unterminated if",     "#if 1\n"),
+    )
+)
+@pytest.mark.parametrize(UNBALANCED_MATRIX.arg_names, UNBALANCED_MATRIX.arg_values, ids=UNBALANCED_MATRIX.test_names)
+def test_unbalanced_conditionals(source):
+    with pytest.raises(Exception):
+        evaluate_ast(scan_directives(source))
+    with pytest.raises(Exception):
+        evaluate_ast(list(scan_directives(source)))
+    with pytest.raises(Exception):
+        evaluate_lines(Sanitizer.sanitize(source, directives_only=True))
+
+
+def test_indexed_evaluation_skips_untaken_branches():
+    objects = list(scan_directives("#if 0\n#if 1 +\n#endif\n#elif 1\n#include <a.h>\n#elif 1 +\n#endif\n"))
+    # The malformed conditions are never evaluated
+    assert evaluate_ast(objects) == {IncludeDirective("a.h", False)}
+
+
+LAZY_SKIP_MATRIX = NamedTestMatrix(
+    ("source", "expected"),
+    (
+        ("unsupported directive",   "#if 0\n#ident no\n#endif\n#include <a.h>\n",                     {"a.h"}),
+        ("malformed condition",     "#ifdef A\n#if 1 +\n#elif )\n#endif\n#elif 1\n#include <a.h>\n#endif\n", {"a.h"}),
+        ("nested else",             "#if 0\n#ifdef A\n#else\n#include <a.h>\n#endif\n#else\n#include <b.h>\n#endif\n", {"b.h"}),
+        ("after taken branch",      "#if 1\n#include <a.h>\n#elif 1 +\n#line 4\n#else\n#assert A\n#endif\n",   {"a.h"}),
+        ("spaced names",            "#if 0\n  #  if 1 +\n  # endif\n# else\n#include <a.h>\n#  endif\n",        {"a.h"}),
+        ("null directives",         "#\n#if 0\n#\n#else\n  #\n#include <a.h>\n#endif\n",              {"a.h"}),
+    )
+)
+@pytest.mark.parametrize(LAZY_SKIP_MATRIX.arg_names, LAZY_SKIP_MATRIX.arg_values, ids=LAZY_SKIP_MATRIX.test_names)
+def test_lazy_evaluation_skips_inactive_lines(source, expected):
+    # None of the inactive lines can be parsed, so they must never reach the parser
+    dependencies = evaluate_lines(Sanitizer.sanitize(source, directives_only=True))
+    assert {d.path for d in dependencies} == expected
+
+
+def test_evaluate_file(tmp_path):
+    path = tmp_path / "a.c"
+    path.write_text("#define A\n#ifndef A\n#error no\n#else\n#include \"b.h\"\n#endif\nint main;\n")
+    macro_table = {}
+
+    assert evaluate_file(path, macro_table) == {IncludeDirective("b.h", True)}
+    assert "A" in macro_table
+
+
+def test_include_directive_hashable():
+    assert len({IncludeDirective("a.h", True), IncludeDirective("a.h", True), IncludeDirective("a.h", False)}) == 2
@@ -0,0 +1,113 @@
+import pytest # NOQA
+import sys
+from .utilities import NamedTestMatrix
+from src.preprocessor.macro_table import MacroTable, MAX_CHAIN_LENGTH
+from src.preprocessor.parser import ObjectMacro
+
+
+A1 = ObjectMacro("A", [])
+A2 = ObjectMacro("A", [])
+B1 = ObjectMacro("B", [])
+
+
+def test_mapping_behaviour():
+    table = MacroTable({"A": A1})
+    table["B"] = B1
+
+    assert table["A"] is A1
+    assert "B" in table
+    assert "C" not in table
+    assert table.get("C") is None
+    assert len(table) == 2
+    assert sorted(table) == ["A", "B"]
+
+    del table["A"]
+    assert "A" not in table
+    assert len(table) == 1
+    with pytest.raises(KeyError):
+        del table["A"]
+
+
+def test_snapshot_is_isolated():
+    table = MacroTable({"A": A1})
+    snapshot = table.snapshot()
+
+    table["A"] = A2
+    table["B"] = B1
+    del table["A"]
+
+    assert dict(snapshot) == {"A": A1}
+    assert dict(table) == {"B": B1}
+    assert len(snapshot) == 1 and len(table) == 1
+    with pytest.raises(TypeError):
+        snapshot["C"] = B1
+
+
+def test_unchanged_snapshot_is_reused():
+    table = MacroTable({"A": A1})
+    assert table.snapshot() is table.snapshot()
+
+
+def test_fork_is_isolated():
+    parent = MacroTable({"A": A1})
+    child = parent.fork()
+
+    child["A"] = A2
+    parent["B"] = B1
+
+    assert dict(parent) == {"A": A1, "B": B1}
+    assert dict(child) == {"A": A2}
+
+    grandchild = child.snapshot().fork()
+    del grandchild["A"]
+    assert dict(grandchild) == {}
+    assert dict(child) == {"A": A2}
+
+
+def test_long_chains_are_flattened():
+    table = MacroTable()
+    snapshots = []
+    for i in range(MAX_CHAIN_LENGTH * 3):
+        table[f"M{i}"] = A1
+        snapshots.append(table.snapshot())
+
+    assert table._length <= MAX_CHAIN_LENGTH + 1
+    assert len(table) == MAX_CHAIN_LENGTH * 3
+    assert all(len(s) == i + 1 for i, s in enumerate(snapshots))
+
+
+def test_keys_are_interned():
+    table = MacroTable()
+    name = "".join(["NAME", "_", "1"])
+    table[name] = A1
+    assert next(iter(table)) is sys.intern("NAME_1")
+
+
+DIFF_MATRIX = NamedTestMatrix(
+    ("change", "expected"),
+    (
+        ("no change", lambda t: None, {}),
+        ("redefined", lambda t: t.__setitem__("A", A2), {"A": (A1, A2)}),
+        ("defined", lambda t: t.__setitem__("B", B1), {"B": (None, B1)}),
+        ("undefined", lambda t: t.__delitem__("A"), {"A": (A1, None)}),
+    )
+)
+@pytest.mark.parametrize(DIFF_MATRIX.arg_names, DIFF_MATRIX.arg_values, ids=DIFF_MATRIX.test_names)
+def test_diff(change, expected):
+    base = MacroTable({"A": A1})
+    snapshot = base.snapshot()
+    change(base)
+
+    assert base.diff(snapshot) == expected
+    assert base.diff(dict(snapshot)) == expected
+    assert snapshot.diff(base) == {name: (new, old) for name, (old, new) in expected.items()}
+
+
+def test_diff_between_forks():
+    base = MacroTable({"A": A1})
+    left = base.fork()
+    right = base.fork()
+    left["B"] = B1
+    right["A"] = A2
+
+    assert left.diff(right) == {"A": (A2, A1), "B": (None, B1)}
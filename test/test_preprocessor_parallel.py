@@ -0,0 +1,72 @@
+import pytest # NOQA
+from types import SimpleNamespace
+from .utilities import NamedTestMatrix
+from src.preprocessor.parallel import batch_files, scan_module, scan_parallel
+
+
+@pytest.fixture
+def sources(tmp_path):
+    (tmp_path / "include").mkdir()
+    (tmp_path / "include/common.h").write_text("#ifndef COMMON_H\n#define COMMON_H\n#include \"detail.h\"\n#endif\n")
+    (tmp_path / "include/detail.h").write_text("#pragma once\n")
+    (tmp_path / "include/feature.h").write_text("")
+
+    paths = []
+    for i in range(12):
+        path = tmp_path / f"tu{i:02}.c"
+        feature = "#include <feature.h>\n" if i % 3 == 0 else ""
+        path.write_text(f"#include <common.h>\n#if {i} > 5\n#include <missing.h>\n#endif\n{feature}" + "int x;\n" * i)
+        paths.append(path)
+
+    return tmp_path, paths
+
+
+def test_scan_parallel_matches_sequential(sources):
+    root, paths = sources
+    sequential = scan_parallel(reversed(paths), [root / "include"], workers=1)
+    parallel = scan_parallel(paths, [root / "include"], workers=3, batch_bytes=16)
+
+    assert parallel == sequential
+    assert [r.path for r in parallel] == sorted(paths)
+
+    first, last = parallel[0], parallel[-1]
+    assert first.dependencies == [root / "include/common.h", root / "include/detail.h", root / "include/feature.h"]
+    assert first.unresolved == []
+    assert [d.path for d in last.unresolved] == ["missing.h"]
+
+
+def test_scan_parallel_defines_and_cache(sources, tmp_path_factory):
+    root, paths = sources
+    cache_dir = tmp_path_factory.mktemp("cache")
+    results = scan_parallel(paths, [root / "include"], defines={"SKIP": "1"}, workers=2, cache_dir=cache_dir)
+
+    assert len(results) == len(paths)
+    assert any((cache_dir / "ast").iterdir())
+
+
+def test_scan_module(sources):
+    root, paths = sources
+    module = SimpleNamespace(files=set(paths) | {root / "include/common.h"})
+
+    assert [r.path for r in scan_module(module, include_dirs=[root / "include"], workers=1)] == paths
+
+
+BATCH_MATRIX = NamedTestMatrix(
+    ("sizes", "workers", "batch_bytes", "expected"),
+    (
+        ("small files grouped",     [10] * 8,           1,  20,     [2, 2, 2, 2]),
+        ("large file alone",        [100, 1, 1],        1,  50,     [1, 2]),
+        ("spread over workers",     [10] * 8,           2,  1000,   [1] * 8),
+    )
+)
+@pytest.mark.parametrize(BATCH_MATRIX.arg_names, BATCH_MATRIX.arg_values, ids=BATCH_MATRIX.test_names)
+def test_batch_files(tmp_path, sizes, workers, batch_bytes, expected):
+    paths = []
+    for i, size in enumerate(sizes):
+        path = tmp_path / f"{i}.c"
+        path.write_text("x" * size)
+        paths.append(path)
+
+    batches = batch_files(paths, workers, batch_bytes)
+    assert [len(b) for b in batches] == expected
+    assert [p for b in batches for p in b] == paths
@@ -1,5 +1,7 @@
 import pytest
 from src.preprocessor.parser import IncludeDirective, parse_line, ObjectMacro, FunctionMacro, IfDirective
+from src.preprocessor.parser import UndefDirective, DiagnosticDirective, NullDirective
+from src.preprocessor.parser import ConditionalBlock, build_conditional_index
 from src.preprocessor.tokenizer import tokenize_line, TokenType
 from .utilities import NamedTestMatrix
 
@@ -38,6 +40,15 @@ def test_parse_function_macro():
     assert [t.value.group() for t in actual.expression] == ["B", "+", "C"]
 
 
+def test_parse_function_macro_without_params():
+    tokens = list(filter(lambda t: t.type is not TokenType.WHITESPACE, tokenize_line("#define A() 1")))
+    actual = parse_line(tokens)
+
+    assert isinstance(actual, FunctionMacro)
+    assert actual.params == ()
+    assert [t.value.group() for t in actual.expression] == ["1"]
+
+
 PARSE_IF_DIRECTIVE = NamedTestMatrix(
     ("line", "expected"),
     (
@@ -46,7 +57,9 @@ PARSE_IF_DIRECTIVE = NamedTestMatrix(
         ("ifdef",       "#ifdef TRUE",  IfDirective("ifdef", ["TRUE"])),
         ("ifndef",      "#ifndef A",    IfDirective("ifndef", ["A"])),
         ("else",        "#else",        IfDirective("else", None)),
-        ("endif",       "#endif",       IfDirective("endif", None))
+        ("endif",       "#endif",       IfDirective("endif", None)),
+        ("spaced endif", "#  endif",    IfDirective("endif", None)),
+        ("spaced if",   "# if(A)",      IfDirective("if", ["(", "A", ")"])),
     )
 )
 @pytest.mark.parametrize(PARSE_IF_DIRECTIVE.arg_names, PARSE_IF_DIRECTIVE.arg_values, ids=PARSE_IF_DIRECTIVE.test_names)
@@ -59,4 +72,56 @@ def test_parse_if_directive(line, expected):
     if not expected.expression:
         assert not actual.expression
     else:
-        assert [t.value.group() for t in actual.expression] == expected.expression
\ No newline at end of file
+        assert [t.value.group() for t in actual.expression] == expected.expression
+
+
+def test_parse_undef():
+    tokens = list(filter(lambda t: t.type is not TokenType.WHITESPACE, tokenize_line("#undef A")))
+    assert parse_line(tokens) == UndefDirective("A")
+
+
+def test_parse_error():
+    tokens = list(filter(lambda t: t.type is not TokenType.WHITESPACE, tokenize_line("#error no config")))
+    actual = parse_line(tokens)
+
+    assert isinstance(actual, DiagnosticDirective)
+    assert [t.value.group() for t in actual.message] == ["no", "config"]
+
+
+def test_parse_null_directive():
+    assert parse_line(tokenize_line("#")) == NullDirective()
+
+
+def test_parse_object_macro_with_parenthesis():
+    tokens = list(filter(lambda t: t.type is not TokenType.WHITESPACE, tokenize_line("#define A (B + C)")))
+    actual = parse_line(tokens)
+
+    assert isinstance(actual, ObjectMacro)
+    assert [t.value.group() for t in actual.tokens] == ["(", "B", "+", "C", ")"]
+
+
+def test_build_conditional_index():
+    objects = [IfDirective("ifdef", None), IncludeDirective("a.h", False), IfDirective("if", None), IfDirective("endif", None),
+               IfDirective("elif", None), IfDirective("else", None), IfDirective("endif", None)]
+    actual = build_conditional_index(objects)
+    outer = ConditionalBlock([0, 4, 5], 6)
+
+    assert sorted(actual) == [0, 2, 3, 4, 5, 6]
+    assert actual[0] == actual[4] == actual[6] == outer
+    assert actual[0] is actual[5]
+    assert actual[2] == ConditionalBlock([2], 3)
+
+
+BAD_CONDITIONALS = NamedTestMatrix(
+    ("directives", ),
+    (
+        ("endif without if",    ["endif"]),
+        ("elif without if",     ["elif"]),
+        ("unterminated",        ["if", "if", "endif"]),
+        ("elif after else",     ["if", "else", "elif", "endif"]),
+    )
+)
+@pytest.mark.parametrize(BAD_CONDITIONALS.arg_names, BAD_CONDITIONALS.arg_values, ids=BAD_CONDITIONALS.test_names)
+def test_build_conditional_index_unbalanced(directives):
+    with pytest.raises(Exception):
+        build_conditional_index([IfDirective(d, None) for d in directives])
@@ -0,0 +1,88 @@
+import pytest # NOQA
+import asyncio
+from .utilities import NamedTestMatrix
+from src.preprocessor.include_resolver import IncludeResolver
+from src.preprocessor.parallel import scan_parallel
+from src.preprocessor.prefetch import PrefetchReader, scan_async, scan_prefetched
+from src.preprocessor.translation_unit import TranslationUnitScanner
+
+
+@pytest.fixture
+def sources(tmp_path):
+    (tmp_path / "include").mkdir()
+    (tmp_path / "include/common.h").write_text("#ifndef COMMON_H\n#define COMMON_H\n#include \"detail.h\"\n#endif\n")
+    (tmp_path / "include/detail.h").write_text("#pragma once\n")
+    (tmp_path / "include/feature.h").write_text("")
+
+    paths = []
+    for i in range(6):
+        path = tmp_path / f"tu{i}.c"
+        path.write_text(f"#include <common.h>\n#if {i} > 2\n#include <feature.h>\n#include <missing.h>\n#endif\n")
+        paths.append(path)
+
+    return tmp_path, paths
+
+
+WINDOW_MATRIX = NamedTestMatrix(
+    ("window", "prefetched", "read", "hits"),
+    (
+        ("all in window",   3,  3,  ["0", "1", "2"],    3),
+        ("queued read",     1,  3,  ["2", "0", "1"],    2),
+        ("not prefetched",  3,  1,  ["0", "3"],         1),
+    )
+)
+@pytest.mark.parametrize(WINDOW_MATRIX.arg_names, WINDOW_MATRIX.arg_values, ids=WINDOW_MATRIX.test_names)
+def test_reader_window(tmp_path, window, prefetched, read, hits):
+    for i in range(4):
+        (tmp_path / str(i)).write_bytes(bytes([i]) * 10)
+
+    with PrefetchReader(window, threads=2) as reader:
+        reader.prefetch(tmp_path / str(i) for i in range(prefetched))
+        assert len(reader._pending) == min(window, prefetched)
+
+        for name in read:
+            assert reader.read(tmp_path / name) == bytes([int(name)]) * 10
+            assert len(reader._pending) <= window
+
+        assert reader.hits == hits
+        assert reader.misses == len(read) - hits
+
+
+def test_reader_errors(tmp_path):
+    with PrefetchReader() as reader:
+        reader.prefetch([tmp_path / "missing.h"])
+        with pytest.raises(FileNotFoundError):
+            reader.read(tmp_path / "missing.h")
+
+
+def test_scanner_prefetches_includes(sources):
+    root, paths = sources
+    with PrefetchReader() as reader:
+        scanner = TranslationUnitScanner(IncludeResolver([root / "include"]), reader=reader)
+        scanner.scan(paths[0])
+
+        # feature.h is only included by a branch that is not taken
+        assert reader.misses == 1
+        assert list(reader._pending) == [root / "include/feature.h"]
+
+
+def test_scan_prefetched_matches_parallel(sources, tmp_path_factory):
+    root, paths = sources
+    expected = scan_parallel(paths, [root / "include"], workers=1)
+
+    assert scan_prefetched(reversed(paths), [root / "include"], window=2) == expected
+    cache_dir = tmp_path_factory.mktemp("cache")
+    for _ in range(2):
+        assert scan_prefetched(paths, [root / "include"], cache_dir=cache_dir) == expected
+
+
+def test_scan_async(sources):
+    root, paths = sources
+    expected = scan_parallel(paths, [root / "include"], workers=1)
+
+    async def main():
+        return await asyncio.gather(scan_async(paths[:3], include_dirs=[root / "include"]),
+                                    scan_async(paths[3:], include_dirs=[root / "include"]))
+
+    first, second = asyncio.run(main())
+    assert first + second == expected
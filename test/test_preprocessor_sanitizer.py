@@ -0,0 +1,99 @@
+import pytest # NOQA
+import random
+from .utilities import NamedTestMatrix
+from src.preprocessor.string_santization import LogicalLine, Sanitizer
+
+
+SANITIZE_MATRIX = NamedTestMatrix(
+    ("test_input", "expected_lines"),
+    (
+        ("plain lines",         "a\n\nb",                               ["a", "", "b"]),
+        ("splice",              "#define A \\\n  1\n",                  ["#define A   1"]),
+        ("trigraphs",           "??=define A ??( ??) ??<??>\n",         ["#define A [ ] {}"]),
+        ("trigraph splice",     "#define A ??/\n1\n",                   ["#define A 1"]),
+        ("block comment",       "a /* x */ b\n",                        ["a   b"]),
+        ("multiline comment",   "#if A /* x\n y */ || B\nc\n",           ["#if A   || B", "c"]),
+        ("line comment",        "#include <a.h> // x\n",                ["#include <a.h>  "]),
+        ("spliced line comment", "// x \\\n y\nz\n",                    [" ", "z"]),
+        ("comment in string",   "s = \"/* x */ // y\";\n",              ["s = \"/* x */ // y\";"]),
+        ("escaped quote",       "s = \"a\\\"/*\"; /**/\n",              ["s = \"a\\\"/*\";  "]),
+        ("char literal",        "c = '\"'; /* \" */\n",                  ["c = '\"';  "]),
+        ("crlf",                "a\r\nb \\\r\nc\r\n",                   ["a", "b c"]),
+    )
+)
+@pytest.mark.parametrize(SANITIZE_MATRIX.arg_names, SANITIZE_MATRIX.arg_values, ids=SANITIZE_MATRIX.test_names)
+def test_sanitize(test_input, expected_lines):
+    assert [str(line) for line in Sanitizer.sanitize(test_input)] == expected_lines
+    assert [str(line) for line in Sanitizer.sanitize(test_input.encode())] == expected_lines
+
+
+DIRECTIVES_ONLY_MATRIX = NamedTestMatrix(
+    ("test_input", "expected_lines"),
+    (
+        ("comment hides directive", "/*\n#include <a.h>\n*/\n#include <b.h>\n",  ["#include <b.h>"]),
+        ("comment opener in string", "x = \"/*\";\n#a\n",                        ["#a"]),
+        ("comment opener in comment", "x; // /* \n#b\n",                          ["#b"]),
+        ("continued body",          "a \\\n#no\n#yes\n",                          ["#yes"]),
+        ("comment before hash",     "/* x */ #e\n",                               ["  #e"]),
+        ("trigraph hash",           "??=define X\n",                              ["#define X"]),
+        ("unterminated comment",    "q /* open\n#g\n",                            []),
+        ("comment ends early",      "/* x */ puts(\"*/ #\");\n#define A 1\n",     ["#define A 1"]),
+        ("multiline before hash",   "/* x\n y */ #h\n",                          ["  #h"]),
+        ("spliced empty line",      "\\\n#i\n",                                  ["#i"]),
+        ("spliced blank line",      " \t\\\n /* x */ #j\n",                      [" \t   #j"]),
+        ("spliced line comment",    "// x \\\n/* y\n#k\n",                        ["#k"]),
+        ("spliced string",          "\"a\\\n/*\";\n#l\n",                         ["#l"]),
+    )
+)
+@pytest.mark.parametrize(DIRECTIVES_ONLY_MATRIX.arg_names, DIRECTIVES_ONLY_MATRIX.arg_values, ids=DIRECTIVES_ONLY_MATRIX.test_names)
+def test_sanitize_directives_only(test_input, expected_lines):
+    actual = Sanitizer.sanitize(test_input, directives_only=True)
+    expected = [line for line in Sanitizer.sanitize(test_input) if str(line).lstrip(" \t").startswith("#")]
+
+    assert [str(line) for line in actual] == expected_lines
+    assert actual == expected
+
+
+def test_directives_only_matches_full():
+    # Short random mixes of everything that can hide, extend or start a directive
+    pieces = ["#", "/*", "*/", "//", "\\\n", "\n", "\n", "\"", "'", " ", "\t", "x", "??=", "??/\n", "\\", "*", "/"]
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(1, 14)))
+        expected = [line for line in Sanitizer.sanitize(text) if str(line).lstrip(" \t").startswith("#")]
+
+        assert Sanitizer.sanitize(text, directives_only=True) == expected, text
+        sanitizer = Sanitizer(directives_only=True)
+        fed = [line for physical in text.splitlines(keepends=True) for line in sanitizer.feed(physical)]
+        assert fed + sanitizer.finish() == expected, text
+
+
+def test_sanitize_matches_splice_lines():
+    text = "#include <a.h>\nint x = 1 + \\\n 2;\n  #define B(x) \\\n  x\n"
+    assert Sanitizer.sanitize(text) == LogicalLine.splice_lines(text)
+
+
+MAP_TO_PHYSICAL_MATRIX = NamedTestMatrix(
+    ("test_input", "logical_index", "expected"),
+    (
+        ("after comment",       "a /* x */ b\n",            4,      (0, 10)),
+        ("comment space",       "a /* x */ b\n",            2,      (0, 2)),
+        ("after trigraph",      "??=define A\n",            1,      (0, 3)),
+        ("after splice",        "#if \\\n  B\n",            6,      (1, 2)),
+        ("after multiline",     "#if /*\n*/ B\n",           6,      (1, 3)),
+    )
+)
+@pytest.mark.parametrize(MAP_TO_PHYSICAL_MATRIX.arg_names, MAP_TO_PHYSICAL_MATRIX.arg_values, ids=MAP_TO_PHYSICAL_MATRIX.test_names)
+def test_map_to_physical(test_input, logical_index, expected):
+    line = Sanitizer.sanitize(test_input)[0]
+    assert line.map_to_physical(logical_index) == expected
+
+
+def test_feed_lines():
+    text = "#if A /* x\n#include <a.h>\n*/\nint a;\n#define B \\\n 1\n"
+    sanitizer = Sanitizer(directives_only=True)
+    actual = [line for physical in text.splitlines(keepends=True) for line in sanitizer.feed(physical)]
+    actual += sanitizer.finish()
+
+    assert actual == Sanitizer.sanitize(text, directives_only=True)
+    assert [line.segments[0][0] for line in actual] == [0, 4]
@@ -0,0 +1,70 @@
+import pytest # NOQA
+from src.preprocessor.string_santization import LogicalLine, Sanitizer
+from src.preprocessor.scanner import scan_directives, scan_file, parse_file
+from src.preprocessor.parser import IncludeDirective, ObjectMacro
+
+
+def test_scan_directives():
+    text = "#include \"a.h\"\nint main(void) { return A > 1; }\n#define A 2\n"
+    actual = list(scan_directives(text))
+
+    assert actual[0] == IncludeDirective("a.h", True)
+    assert isinstance(actual[1], ObjectMacro)
+    assert actual[1].identifier == "A"
+    assert actual[1].tokens[0].line == 2
+
+
+def test_scan_file(tmp_path):
+    path = tmp_path / "header.h"
+    path.write_bytes("/* \u00e9t\u00e9 */\nint a;\n#include \"caf\u00e9.h\"\n#define A \\\r\n 1\r\n".encode())
+    actual = list(scan_file(path))
+
+    assert actual[0] == IncludeDirective("caf\u00e9.h", True)
+    assert [t.value.group() for t in actual[1].tokens] == ["1"]
+    assert actual[1].tokens[0].line == 3
+
+
+def test_scan_empty_file(tmp_path):
+    path = tmp_path / "empty.h"
+    path.write_bytes(b"")
+    assert list(scan_file(path)) == []
+
+
+def test_directive_physical_position():
+    text = "int a;\n#define A \\\n\\\\ 1\n"
+    expected = LogicalLine.splice_lines(text)[1]
+    actual = Sanitizer.sanitize(text, directives_only=True)[0]
+
+    assert actual.map_to_physical(len(actual) - 1) == expected.map_to_physical(len(expected) - 1) == (2, 3)
+
+
+def test_parse_file_matches_scan_directives(tmp_path):
+    text = "int a;\n#include <a.h>\n#define A \\\n  1\nint b;\n  #ifdef A\n#endif\n"
+    path = tmp_path / "header.h"
+    path.write_text(text)
+
+    actual = list(parse_file(path))
+    expected = list(scan_directives(text))
+
+    assert len(actual) == len(expected) == 4
+    assert actual[0] == expected[0]
+    assert [t.value.group() for t in actual[1].tokens] == ["1"]
+    assert actual[2].directive == "ifdef"
+
+
+def test_scan_skips_commented_directives(tmp_path):
+    text = "/* #include \"x.h\"\n#include \"y.h\" */\n#include \"z.h\" // \"w.h\"\n"
+    path = tmp_path / "header.h"
+    path.write_text(text)
+
+    for actual in (list(scan_directives(text)), list(scan_file(path)), list(parse_file(path))):
+        assert actual == [IncludeDirective("z.h", True)]
+
+
+def test_scan_skips_comment_before_code(tmp_path):
+    text = "/* x */ puts(\"*/ #\");\n#include \"a.h\"\n"
+    path = tmp_path / "source.c"
+    path.write_text(text)
+
+    for actual in (list(scan_directives(text)), list(scan_file(path)), list(parse_file(path))):
+        assert actual == [IncludeDirective("a.h", True)]
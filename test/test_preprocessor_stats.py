@@ -0,0 +1,142 @@
+import pytest # NOQA
+import itertools
+import json
+from .utilities import NamedTestMatrix
+from src.preprocessor import interpreter, stats
+from src.preprocessor.include_resolver import IncludeResolver
+from src.preprocessor.interpreter import evaluate_file
+from src.preprocessor.macro_table import MacroTable
+from src.preprocessor.parallel import scan_parallel
+from src.preprocessor.scanner import iter_directive_lines, scan_directives_compact
+from src.preprocessor.stats import StatsCollector, UNKNOWN_FILE
+from src.preprocessor.summary import SummaryCache
+from src.preprocessor.translation_unit import TranslationUnitScanner
+
+
+FILES = {
+    "main.c": "#include \"a.h\"\n#if defined(A) && B > 1\n#include \"b.h\"\n#endif\nint main;\n",
+    "a.h": "#pragma once\n#define A\n#define B 2\n#define LONG 1 + \\\n    2\n",
+    "b.h": "#ifdef A\n#undef A\n#endif\n",
+}
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for path, text in FILES.items():
+        (tmp_path / path).write_text(text)
+    return tmp_path
+
+
+def test_no_collector_by_default():
+    assert stats.COLLECTOR is None
+
+
+def test_nested_collectors():
+    with StatsCollector() as outer:
+        with StatsCollector() as inner:
+            assert stats.COLLECTOR is inner
+        assert stats.COLLECTOR is outer
+    assert stats.COLLECTOR is None
+
+
+def test_exclusive_phase_times(monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr(stats.time, "perf_counter", lambda: float(next(clock)))
+    collector = StatsCollector()
+
+    with collector.file("a.c"), collector.phase("evaluate"):         # 0 .. 7
+        with collector.file("b.h"):
+            with collector.phase("parse"):                          # 1 .. 2
+                pass
+            with collector.phase("evaluate"):                       # 3 .. 6
+                with collector.phase("tokenize"):                   # 4 .. 5
+                    pass
+
+    assert collector.files["a.c"].seconds["evaluate"] == 7 - 1 - 3
+    assert collector.files["b.h"].seconds == {"splice": 0.0, "tokenize": 1.0, "parse": 1.0, "evaluate": 2.0}
+    assert collector.total().total_seconds == 7
+
+
+COUNT_MATRIX = NamedTestMatrix(
+    ("summaries", "path", "expected"),
+    (
+        ("main",            False,  "main.c",   {"logical_lines": 4, "tokens": 14, "directives": 4, "conditionals": 1,
+                                                 "macro_lookups": 2}),
+        # Defining macros is not a lookup
+        ("header",          False,  "a.h",      {"logical_lines": 4, "tokens": 12, "directives": 4, "conditionals": 0,
+                                                 "macro_lookups": 0}),
+        ("nested",          False,  "b.h",      {"logical_lines": 3, "tokens": 5, "directives": 3, "conditionals": 1,
+                                                 "macro_lookups": 1}),
+        ("with summaries",  True,   "b.h",      {"logical_lines": 3, "tokens": 5, "directives": 3, "conditionals": 1,
+                                                 "macro_lookups": 1}),
+    )
+)
+@pytest.mark.parametrize(COUNT_MATRIX.arg_names, COUNT_MATRIX.arg_values, ids=COUNT_MATRIX.test_names)
+def test_translation_unit_counts(tree, summaries, path, expected):
+    scanner = TranslationUnitScanner(IncludeResolver(), summaries=SummaryCache() if summaries else None)
+    with StatsCollector() as collector:
+        scanner.scan(tree / "main.c")
+
+    assert set(collector.files) == {str(tree / p) for p in FILES}
+    file_stats = collector.files[str(tree / path)]
+    assert file_stats.counts == expected
+    assert all(seconds >= 0 for seconds in file_stats.seconds.values())
+
+
+def test_evaluate_file_and_unknown_file(tree):
+    with StatsCollector() as collector:
+        evaluate_file(tree / "a.h", MacroTable())
+        scan_directives_compact("#define X\n")
+
+    assert collector.files[str(tree / "a.h")].counts["directives"] == 4
+    assert collector.files[UNKNOWN_FILE].counts["directives"] == 1
+
+
+def test_evaluate_file_splice_time(tree, monkeypatch):
+    # Each line takes a second to sanitize, which must not be charged to evaluation
+    def slow_lines(path, encoding="utf-8"):
+        for logical_line in iter_directive_lines(path, encoding):
+            clock[0] += 1.0
+            yield logical_line
+
+    clock = [0.0]
+    monkeypatch.setattr(stats.time, "perf_counter", lambda: clock[0])
+    monkeypatch.setattr(interpreter, "iter_directive_lines", slow_lines)
+
+    with StatsCollector() as collector:
+        evaluate_file(tree / "a.h", MacroTable())
+
+    seconds = collector.files[str(tree / "a.h")].seconds
+    assert seconds["splice"] == 4.0
+    assert seconds["evaluate"] == 0.0
+
+
+def test_export(tree):
+    with StatsCollector() as collector:
+        TranslationUnitScanner(IncludeResolver()).scan(tree / "main.c")
+
+    exported = json.loads(collector.to_json())
+    assert list(exported["files"]) == sorted(str(tree / p) for p in FILES)
+    assert exported["total"]["counts"]["directives"] == 11
+    assert exported["total"]["total_seconds"] == pytest.approx(collector.total().total_seconds)
+
+    merged = StatsCollector()
+    merged.merge(collector)
+    merged.merge(collector)
+    assert merged.total().counts["directives"] == 22
+
+
+def test_parallel_workers_report(tree):
+    (tree / "other.c").write_text("#include \"b.h\"\n#if LONG\n#endif\n")
+    units = [tree / "main.c", tree / "other.c"]
+    with StatsCollector() as serial:
+        scan_parallel(units, workers=1)
+    with StatsCollector() as parallel:
+        scan_parallel(units, workers=2, batch_bytes=1)
+
+    # Each unit is scanned once whichever worker scans it
+    for unit in units:
+        assert parallel.files[str(unit)].counts == serial.files[str(unit)].counts
+    assert set(parallel.files) == set(serial.files)
+    assert parallel.total().counts["directives"] >= serial.total().counts["directives"]
+    assert parallel.total().total_seconds > 0
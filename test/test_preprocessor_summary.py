@@ -0,0 +1,126 @@
+import pytest # NOQA
+from .utilities import NamedTestMatrix
+from src.preprocessor.include_resolver import IncludeResolver
+from src.preprocessor.macro_table import MacroTable
+from src.preprocessor.scanner import scan_directives
+from src.preprocessor.summary import SummaryCache, SummaryRecorder, same_definition
+from src.preprocessor.translation_unit import TranslationUnitScanner, predefined_macros
+
+
+HEADERS = {
+    "lib.h": "#ifndef LIB_H\n#define LIB_H\n#ifdef USE_X\n#include \"x.h\"\n#else\n#include \"y.h\"\n#endif\n"
+             "#define LIB_VERSION 2\n#undef TEMP\n#endif\n",
+    "x.h": "#pragma once\n#define HAVE_X\n",
+    "y.h": "#define HAVE_Y\n",
+}
+
+
+def write_tree(root, files):
+    for path, text in files.items():
+        (root / path).write_text(text)
+
+
+def test_recorder_tracks_reads_and_writes():
+    table = MacroTable({m.identifier: m for m in scan_directives("#define A 1\n#define B 2\n")})
+    recorder = SummaryRecorder(table)
+
+    recorder.begin()
+    assert "A" in recorder
+    recorder["C"] = table["B"]
+    assert recorder.get("C") is table["B"]
+    recorder.pop("B", None)
+    assert "D" not in recorder
+    summary = recorder.end()
+
+    assert summary.reads == {"A": table["A"], "D": None}
+    assert summary.writes == {"C": table["C"], "B": None}
+
+
+DEFINITION_MATRIX = NamedTestMatrix(
+    ("a", "b", "same"),
+    (
+        ("object",              "#define X 1\n",           "#define X 1\n",           True),
+        ("other value",         "#define X 1\n",           "#define X 2\n",           False),
+        ("other name",          "#define X 1\n",           "#define Y 1\n",           False),
+        ("function",            "#define F(a) (a + 1)\n",  "#define F(a) (a + 1)\n",  True),
+        ("other parameter",     "#define F(a) (a + 1)\n",  "#define F(b) (a + 1)\n",  False),
+        ("other body",          "#define F(a) (a + 1)\n",  "#define F(a) (a - 1)\n",  False),
+        ("object and function", "#define F (a)\n",         "#define F(a)\n",          False),
+    )
+)
+@pytest.mark.parametrize(DEFINITION_MATRIX.arg_names, DEFINITION_MATRIX.arg_values, ids=DEFINITION_MATRIX.test_names)
+def test_same_definition(a, b, same):
+    # Parsed separately, as by two translation units
+    assert same_definition(next(scan_directives(a)), next(scan_directives(b))) == same
+    assert same_definition(next(scan_directives(a)), None) is False
+
+
+TU_MATRIX = NamedTestMatrix(
+    ("sources", "hits"),
+    (
+        ("same state",      ("#include \"lib.h\"\n", "#include \"lib.h\"\n"),                                 1),
+        ("unrelated macro", ("#include \"lib.h\"\n", "#define OTHER\n#include \"lib.h\"\n"),                  1),
+        ("read macro",      ("#include \"lib.h\"\n", "#define USE_X\n#include \"lib.h\"\n"),                  0),
+        # x.h is reused, but lib.h was summarized before x.h had been entered
+        ("once seen",       ("#define USE_X\n#include \"lib.h\"\n",
+                             "#define USE_X\n#include \"x.h\"\n#include \"lib.h\"\n"),                          1),
+    )
+)
+@pytest.mark.parametrize(TU_MATRIX.arg_names, TU_MATRIX.arg_values, ids=TU_MATRIX.test_names)
+def test_summaries_shared_across_translation_units(tmp_path, sources, hits):
+    write_tree(tmp_path, HEADERS)
+    write_tree(tmp_path, {f"tu{i}.c": source for i, source in enumerate(sources)})
+
+    summaries = SummaryCache()
+    with_summaries = TranslationUnitScanner(IncludeResolver(), summaries=summaries)
+    without_summaries = TranslationUnitScanner(IncludeResolver())
+
+    for i in range(len(sources)):
+        table, expected_table = MacroTable(), MacroTable()
+        result = with_summaries.scan(tmp_path / f"tu{i}.c", table)
+        expected = without_summaries.scan(tmp_path / f"tu{i}.c", expected_table)
+
+        assert result == expected
+        assert dict(table) == dict(expected_table)
+
+    assert summaries.hits == hits
+
+
+def test_summaries_shared_with_separate_defines(tmp_path):
+    write_tree(tmp_path, HEADERS)
+    (tmp_path / "tu.c").write_text("#include \"x.h\"\n#include \"lib.h\"\n")
+    summaries = SummaryCache()
+    scanner = TranslationUnitScanner(IncludeResolver(), summaries=summaries)
+
+    # `-D USE_X=1` is parsed again for every translation unit, which must not keep lib.h from being reused
+    scanner.scan(tmp_path / "tu.c", predefined_macros({"USE_X": "1"}))
+    misses = summaries.misses
+    scanner.scan(tmp_path / "tu.c", predefined_macros({"USE_X": "1"}))
+    assert summaries.misses == misses
+    assert summaries.hits == 2
+
+
+def test_summary_applies_undefines(tmp_path):
+    write_tree(tmp_path, HEADERS)
+    write_tree(tmp_path, {"tu.c": "#include \"lib.h\"\n"})
+    scanner = TranslationUnitScanner(IncludeResolver(), summaries=SummaryCache())
+    scanner.scan(tmp_path / "tu.c")
+
+    table = MacroTable({m.identifier: m for m in scan_directives("#define TEMP 1\n")})
+    scanner.scan(tmp_path / "tu.c", table)
+
+    assert scanner.summaries.hits == 1
+    assert "TEMP" not in table
+    assert "LIB_VERSION" in table
+
+
+def test_max_per_header(tmp_path):
+    write_tree(tmp_path, {"h.h": "#ifdef A\n#endif\n"})
+    cache = SummaryCache(max_per_header=1)
+    scanner = TranslationUnitScanner(IncludeResolver(), summaries=cache)
+
+    for source in ("#include \"h.h\"\n", "#define A\n#include \"h.h\"\n"):
+        (tmp_path / "tu.c").write_text(source)
+        scanner.scan(tmp_path / "tu.c")
+
+    assert len(cache.summaries[tmp_path / "h.h"]) == 1
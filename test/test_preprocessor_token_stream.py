@@ -0,0 +1,57 @@
+import pytest # NOQA
+from src.preprocessor.tokenizer import TokenType, tokenize_line
+from src.preprocessor.token_stream import TokenStream
+from src.preprocessor.parser import parse_line, FunctionMacro, IncludeDirective
+from src.preprocessor.scanner import scan_directives, scan_directives_compact
+
+
+LINES = [(0, "#include \"a.h\""), (4, "#define F(a, b) a ## b"), (5, "#if defined(X) && Y >= 3.5")]
+
+
+def test_stream_matches_tokenize_line():
+    stream = TokenStream.from_lines(LINES, include_whitespace=True)
+    expected = [t for line_num, text in LINES for t in tokenize_line(text, line_num)]
+
+    assert len(stream) == len(expected)
+    for a, e in zip(stream, expected):
+        assert (a.type, a.value.groups(), a.value.group(), a.col, a.line) == (e.type, e.value.groups(), e.value.group(), e.col, e.line)
+
+
+def test_stream_drops_whitespace():
+    stream = TokenStream.from_lines(LINES)
+    assert all(t.type is not TokenType.WHITESPACE for t in stream)
+    assert [t.text for t in stream.row(0)] == ["#include", "\"a.h\""]
+
+
+def test_rows_and_slices():
+    stream = TokenStream.from_lines(LINES)
+    row = stream.row(1)
+
+    assert stream.row_count == 3
+    assert [t.text for t in row[1:3]] == ["F", "("]
+    assert row[-1].text == "b"
+    assert len(row[100:]) == 0
+
+    with pytest.raises(IndexError):
+        row[len(row)]
+
+
+def test_parse_rows():
+    stream = TokenStream.from_lines(LINES)
+    include = parse_line(stream.row(0))
+    macro = parse_line(stream.row(1))
+
+    assert include == IncludeDirective("a.h", True)
+    assert isinstance(macro, FunctionMacro)
+    assert macro.params == ("a", "b")
+    assert [t.value.group() for t in macro.expression] == ["a", "##", "b"]
+
+
+def test_scan_directives_compact():
+    text = "#include <x/y.h>\nint a;\n#define A 1 + 2\n"
+    compact = scan_directives_compact(text)
+    regular = list(scan_directives(text))
+
+    assert compact[0] == regular[0]
+    assert [t.value.group() for t in compact[1].tokens] == [t.value.group() for t in regular[1].tokens]
+    assert compact[1].tokens[0].line == 2
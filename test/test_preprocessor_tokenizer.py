@@ -1,6 +1,6 @@
 import pytest # NOQA
 from .utilities import NamedTestMatrix
-from src.preprocessor.tokenizer import Token, TokenType, tokenize_line
+from src.preprocessor.tokenizer import Token, TokenType, TOKEN_MAP, tokenize_line
 
 
 SINGLE_TOKEN_TESTS = NamedTestMatrix(
@@ -8,6 +8,7 @@ SINGLE_TOKEN_TESTS = NamedTestMatrix(
     (
         ("whitespace",  "\t",       TokenType.WHITESPACE),
         ("directive",   "#define",  TokenType.DIRECTIVE),
+        ("spaced directive", "# define", TokenType.DIRECTIVE),
         ("string",      "\"uwu\"",  TokenType.STRING_LITERAL),
         ("int",         "42069",    TokenType.NUM_LITERAL),
         ("dec",         "3.141",    TokenType.NUM_LITERAL),
@@ -17,8 +18,18 @@ SINGLE_TOKEN_TESTS = NamedTestMatrix(
         ("less than",   "<",        TokenType.OP_LT),
         ("grea than",   ">",        TokenType.OP_GT),
         ("not",         "!",        TokenType.OP_NOT),
+        ("minus",       "-",        TokenType.OP_SUB),
+        ("modulo",      "%",        TokenType.OP_MOD),
+        ("left shift",  "<<",       TokenType.OP_LSHIFT),
+        ("right shift", ">>",       TokenType.OP_RSHIFT),
+        ("conditional", "?",        TokenType.OP_TERNARY),
+        ("colon",       ":",        TokenType.OP_COLON),
         ("identifier",  "UWU2",     TokenType.IDENTIFIER),
-        ("generic",     "~",        TokenType.GENERIC),
+        ("generic",     "@",        TokenType.GENERIC),
+        ("bitwise and", "&",        TokenType.OP_BIT_AND),
+        ("bitwise or",  "|",        TokenType.OP_BIT_OR),
+        ("bitwise xor", "^",        TokenType.OP_BIT_XOR),
+        ("bitwise not", "~",        TokenType.OP_BIT_NOT),
         ("single-char identifier", "A", TokenType.IDENTIFIER),
 
     )
@@ -39,3 +50,52 @@ def test_tokenize_line():
     for a, e in zip(actual, expected):
         assert a.type == e[0]
         assert a.value.group(0) == e[1]
+
+
+OPERATOR_MATRIX = NamedTestMatrix(
+    ("line", "expected"),
+    (
+        ("stringize",   "#define S(x) #x",      [TokenType.OP_JOIN, TokenType.IDENTIFIER]),
+        ("paste",       "#define P(a) a##_t",   [TokenType.IDENTIFIER, TokenType.OP_CONCAT, TokenType.IDENTIFIER]),
+        ("spaced",      "#define P(a) a ## b",  [TokenType.IDENTIFIER, TokenType.OP_CONCAT, TokenType.IDENTIFIER]),
+    )
+)
+@pytest.mark.parametrize(OPERATOR_MATRIX.arg_names, OPERATOR_MATRIX.arg_values, ids=OPERATOR_MATRIX.test_names)
+def test_hash_operators_after_directive(line, expected):
+    tokens = [t for t in tokenize_line(line) if t.type is not TokenType.WHITESPACE]
+    assert tokens[0].type is TokenType.DIRECTIVE
+    assert [t.type for t in tokens[-len(expected):]] == expected
+
+
+def _reference_tokenize(line):
+    """
+    Tries every TOKEN_MAP entry in order at each position, like the original scanner. Only the first token
+    that is not whitespace can be a directive.
+    """
+    cursor = 0
+    first = True
+    while cursor < len(line):
+        regex, token_type = next((r, t) for r, t in TOKEN_MAP
+                                 if (first or t is not TokenType.DIRECTIVE) and r.match(line, cursor))
+        match = regex.match(line, cursor)
+        yield token_type, match.groups(), cursor
+        cursor = match.end()
+        first = first and token_type is TokenType.WHITESPACE
+
+
+MASTER_REGEX_MATRIX = NamedTestMatrix(
+    ("line", ),
+    (
+        ("include",     "#include <linux/x.h>"),
+        ("string",      "#include \"waluigi.h\" // \"x\""),
+        ("condition",   "#if defined(A) && B >= 2 || !C != 3 <= 4"),
+        ("concat",      "#define J(a, b) a ## b # a"),
+        ("c body",      "\tstatic int x_1 = 0x1f + 3.5f; ~y;"),
+        ("indented",    "  #  if A"),
+    )
+)
+@pytest.mark.parametrize(MASTER_REGEX_MATRIX.arg_names, MASTER_REGEX_MATRIX.arg_values, ids=MASTER_REGEX_MATRIX.test_names)
+def test_master_regex_matches_token_map(line):
+    actual = [(t.type, t.value.groups(), t.col) for t in tokenize_line(line, 3)]
+    assert actual == list(_reference_tokenize(line))
+    assert all(t.line == 3 for t in tokenize_line(line, 3))
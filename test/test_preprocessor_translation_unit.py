@@ -0,0 +1,104 @@
+import pytest # NOQA
+from .utilities import NamedTestMatrix
+from src.preprocessor.include_resolver import IncludeResolver
+from src.preprocessor.macro_table import MacroTable
+from src.preprocessor.parser import IncludeDirective, find_include_guard, has_pragma_once
+from src.preprocessor.scanner import scan_directives
+from src.preprocessor.translation_unit import TranslationUnitScanner
+
+
+def write_tree(root, files):
+    for path, text in files.items():
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text(text)
+
+
+GUARD_MATRIX = NamedTestMatrix(
+    ("source", "expected"),
+    (
+        ("ifndef",              "#ifndef A_H\n#define A_H\n#endif\n",                           "A_H"),
+        ("not defined",         "#if !defined A_H\n#define A_H\n#endif\n",                      "A_H"),
+        ("not defined parens",  "#if !defined(A_H)\n#define A_H\n#endif\n",                     "A_H"),
+        ("ifdef",               "#ifdef A_H\n#endif\n",                                         None),
+        ("else branch",         "#ifndef A_H\n#define A_H\n#else\n#endif\n",                    None),
+        ("directive after",     "#ifndef A_H\n#define A_H\n#endif\n#define B\n",                None),
+        ("directive before",    "#define B\n#ifndef A_H\n#define A_H\n#endif\n",                None),
+        ("two blocks",          "#ifndef A_H\n#endif\n#ifndef B_H\n#endif\n",                   None),
+    )
+)
+@pytest.mark.parametrize(GUARD_MATRIX.arg_names, GUARD_MATRIX.arg_values, ids=GUARD_MATRIX.test_names)
+def test_find_include_guard(source, expected):
+    assert find_include_guard(list(scan_directives(source))) == expected
+
+
+PRAGMA_ONCE_MATRIX = NamedTestMatrix(
+    ("source", "guarded", "expected"),
+    (
+        ("top level",           "#pragma once\n",                                       False,  True),
+        ("inside guard",        "#ifndef A_H\n#pragma once\n#endif\n",                  True,   True),
+        ("conditional",         "#ifdef X\n#pragma once\n#endif\n",                     False,  False),
+        ("other pragma",        "#pragma pack\n",                                       False,  False),
+    )
+)
+@pytest.mark.parametrize(PRAGMA_ONCE_MATRIX.arg_names, PRAGMA_ONCE_MATRIX.arg_values, ids=PRAGMA_ONCE_MATRIX.test_names)
+def test_has_pragma_once(source, guarded, expected):
+    assert has_pragma_once(list(scan_directives(source)), guarded) == expected
+
+
+def test_scan_follows_includes(tmp_path):
+    write_tree(tmp_path, {
+        "main.c": "#include \"a.h\"\n#include <b.h>\n#include <missing.h>\nint main;\n",
+        "a.h": "#define USE_C\n#include <b.h>\n",
+        "include/b.h": "#ifdef USE_C\n#include \"c.h\"\n#endif\n",
+        "include/c.h": "",
+    })
+    scanner = TranslationUnitScanner(IncludeResolver([tmp_path / "include"]))
+    macro_table = MacroTable()
+    result = scanner.scan(tmp_path / "main.c", macro_table)
+
+    assert result.dependencies == [tmp_path / "a.h", tmp_path / "include/b.h", tmp_path / "include/c.h"]
+    assert result.unresolved == [IncludeDirective("missing.h", False)]
+    assert "USE_C" in macro_table
+
+
+SKIP_MATRIX = NamedTestMatrix(
+    ("header", "skips"),
+    (
+        ("include guard",       "/* licence */\n#ifndef H_H\n#define H_H\n#define X\n#endif // H_H\n\n",    2),
+        ("pragma once",         "#pragma once\n#define X\n",                                                2),
+        ("code outside guard",  "int x;\n#ifndef H_H\n#define H_H\n#define X\n#endif\n",                    0),
+        ("no guard",            "#define X\n",                                                              0),
+    )
+)
+@pytest.mark.parametrize(SKIP_MATRIX.arg_names, SKIP_MATRIX.arg_values, ids=SKIP_MATRIX.test_names)
+def test_repeated_includes_skipped(tmp_path, header, skips):
+    write_tree(tmp_path, {
+        "main.c": "#include \"h.h\"\n#include \"a.h\"\n#include \"h.h\"\n",
+        "a.h": "#include \"h.h\"\n",
+        "h.h": header,
+    })
+    scanner = TranslationUnitScanner(IncludeResolver())
+    result = scanner.scan(tmp_path / "main.c")
+
+    assert result.dependencies == [tmp_path / "h.h", tmp_path / "a.h"]
+    assert scanner.skips == skips
+    # Every file is only parsed once
+    assert scanner.loads == 3
+
+
+def test_guard_skip_depends_on_macro_state(tmp_path):
+    write_tree(tmp_path, {
+        "main.c": "#include \"h.h\"\n#undef H_H\n#include \"h.h\"\n",
+        "h.h": "#ifndef H_H\n#define H_H\n#include \"inner.h\"\n#endif\n",
+        "inner.h": "",
+    })
+    scanner = TranslationUnitScanner(IncludeResolver())
+    scanner.scan(tmp_path / "main.c")
+
+    assert scanner.skips == 0
+
+
+def test_recursive_include_is_limited(tmp_path):
+    write_tree(tmp_path, {"loop.h": "#include \"loop.h\"\n"})
+    with pytest.raises(Exception):
+        TranslationUnitScanner(IncludeResolver()).scan(tmp_path / "loop.h")
@@ -0,0 +1,92 @@
+import pytest # NOQA
+import os
+from glob import iglob
+from pathlib import Path
+from .utilities import NamedTestMatrix
+from src.useful import DirectorySnapshot, normalize_path
+
+
+TREE = (
+    "a.c", "b.h", ".hidden.c",
+    "src/main.c", "src/util.c", "src/util.h", "src/README", "src/.dot.c",
+    "src/sub/x.c", "src/sub/deep/y.c", "src/sub/deep/z.h",
+    "src/.git/objects/o.c",
+    "lib/[x].c", "lib/q.c",
+    ".config/settings.c",
+)
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    for path in TREE:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def reference(patterns):
+    """The original implementation, with one `iglob` walk per pattern."""
+    accepted = set()
+    for p in patterns:
+        for g in map(Path, iglob(p, recursive=True)):
+            if g.is_file():
+                accepted.add(g)
+            elif g.is_dir():
+                accepted.update(x for x in g.iterdir() if x.is_file())
+    return sorted(accepted)
+
+
+PATTERN_MATRIX = NamedTestMatrix(
+    ("patterns",),
+    (
+        ("star",                    ["*.c"],),
+        ("nested star",             ["src/*.c", "src/*/*.c"],),
+        ("recursive",               ["**/*.c"],),
+        ("recursive below root",    ["src/**/*.h"],),
+        ("trailing recursive",      ["src/**"],),
+        ("trailing recursive dirs", ["src/**/"],),
+        ("recursive below star",    ["src/*/**"],),
+        ("recursive around",        ["**/sub/**"],),
+        ("double recursive",        ["src/**/**"],),
+        ("recursive from top",      ["**", "**/"],),
+        ("recursive in hidden",     ["src/.git/**"],),
+        ("overlapping",             ["src/**/*.c", "src/*.c", "src/sub/*", "**/*.h"],),
+        ("directory match",         ["src/s*"],),
+        ("directory only",          ["src/*/"],),
+        ("literal directory",       ["src", "lib/"],),
+        ("literal file",            ["a.c", "src/sub/x.c", "missing.c"],),
+        ("character classes",       ["lib/[[]x].c", "src/[!u]*.c", "src/?ain.c"],),
+        ("hidden",                  [".*.c", ".config/*", "src/.git/**/*.c"],),
+        ("dot prefix",              ["./src/*.c", "src/*.h"],),
+    )
+)
+@pytest.mark.parametrize(PATTERN_MATRIX.arg_names, PATTERN_MATRIX.arg_values, ids=PATTERN_MATRIX.test_names)
+def test_matches_glob(tree, patterns):
+    assert normalize_path(patterns) == reference(patterns)
+    absolute = [os.path.join(str(tree), p) for p in patterns]
+    assert normalize_path(absolute) == reference(absolute)
+
+
+def test_single_and_path_arguments(tree):
+    assert normalize_path("src/*.h") == [Path("src/util.h")]
+    assert normalize_path(Path("src/sub")) == [Path("src/sub/x.c")]
+    # Paths are not glob patterns
+    assert normalize_path([Path("lib/[x].c"), Path("*.c")]) == [Path("lib/[x].c")]
+
+
+def test_walks_each_directory_once(tree):
+    snapshot = DirectorySnapshot()
+    normalize_path(["**/*.c", "src/**/*.h", "src/*", "src/sub"], snapshot)
+    # Every directory except the ones below src/.git and .config, which no pattern can match
+    assert snapshot.scans == 5
+
+    scans = snapshot.scans
+    assert normalize_path(["src/**/*.c"], snapshot) == reference(["src/**/*.c"])
+    assert snapshot.scans == scans
+
+    # The snapshot is kept until it is cleared
+    (tree / "src/new.c").write_text("")
+    assert Path("src/new.c") not in normalize_path(["src/*.c"], snapshot)
+    snapshot.clear()
+    assert Path("src/new.c") in normalize_path(["src/*.c"], snapshot)